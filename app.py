@@ -1,10 +1,20 @@
+import click
 from flask import Flask, jsonify, render_template
 from routes.user_routes import user_routes
 from routes.rider_routes import rider_routes
 from routes.restaurant_routes import restaurant_routes
 from routes.order_routes import order_routes
 from routes.notification_routes import notification_routes
-from db import db_cursor, init_db
+from db import db_cursor, init_db, pool_stats, populate_sample_data, write_queue
+from models import identity_map, location_buffer, open_hours, rider_registry, suggestions
+from models.restaurant import Restaurant
+from cache import menu_cache
+from event_bus import bus
+from http_cache import conditional, version_tag
+from services.dispatch_service import batch_dispatch_enabled, dispatcher
+from services.import_service import FORMATS, ImportService
+from services.intake_service import intake, intake_enabled
+from travel import get_model
 
 app = Flask(__name__)
 
@@ -15,8 +25,61 @@ app.register_blueprint(restaurant_routes)
 app.register_blueprint(order_routes)
 app.register_blueprint(notification_routes)
 
-# Initialize database
+@app.before_request
+def open_identity_map():
+    """Give each request its own identity map so repeated model lookups hit memory."""
+    identity_map.begin_scope()
+
+@app.teardown_request
+def close_identity_map(exc):
+    identity_map.end_scope()
+
+# Apply pending schema migrations (a no-op once the schema is current)
 init_db()
+# Build the in-memory indexes used by restaurant search, suggestions and rider matching,
+# and the zone travel-time matrix used for ETAs
+open_hours.refresh()
+suggestions.refresh()
+rider_registry.refresh()
+get_model()
+
+# Opt-in windowed batch dispatch (DISPATCH_WINDOW_SECONDS > 0)
+if batch_dispatch_enabled():
+    dispatcher.start()
+
+# Opt-in asynchronous order intake (ORDER_INTAKE_WORKERS > 0)
+if intake_enabled():
+    intake.start()
+
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Apply pending schema migrations."""
+    init_db()
+
+
+@app.cli.command('seed-db')
+def seed_db_command():
+    """Load the sample restaurants, menus, riders, users and orders."""
+    populate_sample_data()
+    open_hours.refresh()
+    suggestions.refresh()
+    rider_registry.refresh()
+
+
+@app.cli.command('import-menus')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(sorted(FORMATS)),
+              help="File format; taken from the file extension if omitted")
+def import_menus_command(path, file_format):
+    """Bulk import restaurants and menu items from a CSV or NDJSON file."""
+    file_format = file_format or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+    with open(path, encoding='utf-8', newline='') as lines:
+        report = ImportService.import_records(FORMATS[file_format](lines))
+    click.echo(f"{report['records']} records: {report['restaurants_created']} restaurants and "
+               f"{report['menu_items_created']} menu items created, {report['failed']} failed")
+    for error in report['errors']:
+        click.echo(f"  line {error['line']}: {error['error']}", err=True)
 
 # Web UI Routes
 @app.route('/')
@@ -119,22 +182,33 @@ def all_restaurants_page():
     return render_template('restaurants.html')
 
 @app.route('/api/restaurant/<int:restaurant_id>/menu')
+@conditional(lambda restaurant_id: version_tag('menu', restaurant_id, ('menu', restaurant_id)),
+             cache_control='public, max-age=30')
 def get_restaurant_menu(restaurant_id):
     try:
-        with db_cursor() as cursor:
-            cursor.execute("""
-                SELECT menu_id, item_name, price
-                FROM menus
-                WHERE restaurant_id = ?
-            """, (restaurant_id,))
-            menu_items = cursor.fetchall()
-            return jsonify([{
-                'menu_id': item['menu_id'],
-                'item_name': item['item_name'],
-                'price': float(item['price'])
-            } for item in menu_items])
+        menu_items = Restaurant.get_menu(restaurant_id)
+        return jsonify([{
+            'menu_id': item['menu_id'],
+            'item_name': item['item_name'],
+            'price': float(item['price'])
+        } for item in menu_items])
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/stats')
+def get_stats():
+    """Expose runtime counters for the database connection pool and caches."""
+    return jsonify({
+        'db_pool': pool_stats(),
+        'write_queue': write_queue.stats(),
+        'menu_cache': menu_cache.stats(),
+        'open_hours': open_hours.index.stats(),
+        'suggestions': suggestions.index.stats(),
+        'rider_registry': rider_registry.registry.stats(),
+        'location_buffer': location_buffer.buffer.stats(),
+        'event_bus': bus.stats(),
+        'intake': intake.stats()
+    })
+
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,356 @@
+"""
+Deterministic, city-scale synthetic dataset generator.
+
+Builds the same schema as the app (via migrations.migrate) and streams rows
+into it with executemany in large batched transactions, so memory stays flat
+no matter how many rows are requested. The same seed always produces the
+same database.
+
+Usage:
+    python -m bench.datagen --db bench.db --scale small
+    python -m bench.datagen --db city.db --scale city --seed 7
+    python -m bench.datagen --db custom.db --restaurants 2000 --orders 1000000
+"""
+import argparse
+import itertools
+import json
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+from geo import geocode
+from migrations import migrate
+from services.matching_service import MatchingService
+
+# Bump when the generated data changes, so cached benchmark databases are rebuilt
+DATASET_VERSION = 3
+
+# Row counts per preset. menu_items is the average number per restaurant.
+SCALES = {
+    'tiny': dict(restaurants=50, menu_items=10, riders=20, users=500, orders=5_000),
+    'small': dict(restaurants=1_000, menu_items=20, riders=400, users=50_000, orders=200_000),
+    'medium': dict(restaurants=10_000, menu_items=30, riders=4_000, users=500_000, orders=5_000_000),
+    'city': dict(restaurants=50_000, menu_items=40, riders=20_000, users=5_000_000, orders=100_000_000),
+}
+
+CUISINES = {
+    'Italian': ["Margherita Pizza", "Pepperoni Pizza", "Lasagna", "Carbonara", "Risotto", "Tiramisu", "Bruschetta"],
+    'Japanese': ["California Roll", "Salmon Nigiri", "Miso Soup", "Tempura Udon", "Ramen", "Gyoza", "Katsu Curry"],
+    'American': ["Classic Burger", "Cheese Fries", "Milkshake", "Onion Rings", "Hot Dog", "Pancakes", "BBQ Ribs"],
+    'Mexican': ["Street Tacos", "Burrito Supreme", "Guacamole & Chips", "Quesadilla", "Nachos", "Enchiladas"],
+    'Chinese': ["Kung Pao Chicken", "Fried Rice", "Spring Rolls", "Mapo Tofu", "Dumplings", "Chow Mein"],
+    'Indian': ["Butter Chicken", "Naan Bread", "Vegetable Biryani", "Samosas", "Paneer Tikka", "Dal Makhani"],
+    'Thai': ["Pad Thai", "Green Curry", "Tom Yum Soup", "Mango Sticky Rice", "Massaman Curry"],
+    'Mediterranean': ["Hummus Plate", "Falafel Wrap", "Greek Salad", "Shawarma Plate", "Baklava"],
+    'Korean': ["Bibimbap", "Kimchi Jjigae", "Korean BBQ", "Japchae", "Tteokbokki"],
+    'Cafe': ["Cappuccino", "Croissant", "Avocado Toast", "Bagel", "Muffin", "Iced Latte"],
+}
+# Relative share of restaurants per cuisine
+CUISINE_WEIGHTS = [14, 8, 16, 9, 10, 11, 6, 7, 5, 14]
+
+STREETS = ["Main St", "Oak Ave", "Pine Rd", "Elm St", "Maple Dr", "Cedar Ln", "Olive St", "Cherry Ave",
+           "Bamboo Rd", "Vine St", "Park Ave", "Lake St", "River Rd", "Hill Dr", "Forest Ln", "Beach Rd"]
+FIRST_NAMES = ["Alice", "Bob", "Carol", "David", "Eva", "Frank", "Grace", "Henry", "Iris", "Jack",
+               "Kiran", "Leila", "Mateo", "Nora", "Omar", "Priya", "Quinn", "Rosa", "Sam", "Tara"]
+LAST_NAMES = ["Johnson", "Smith", "Wilson", "Brown", "Davis", "Miller", "Taylor", "Clark", "White", "Green",
+              "Patel", "Nguyen", "Garcia", "Kim", "Khan", "Lopez", "Singh", "Ali", "Chen", "Novak"]
+NAME_WORDS = ["Palace", "House", "Kitchen", "Corner", "Express", "Garden", "Bistro", "Grill", "Spot", "Table"]
+
+# (opening, closing, breakfast, lunch, dinner, weight); includes overnight windows
+HOURS_TEMPLATES = [
+    ("09:00", "22:00", 0, 1, 1, 40),
+    ("11:00", "23:00", 0, 1, 1, 25),
+    ("06:00", "15:00", 1, 1, 0, 10),
+    ("07:00", "20:00", 1, 1, 1, 10),
+    ("00:00", "23:59", 1, 1, 1, 5),
+    ("16:00", "23:00", 0, 0, 1, 5),
+    ("18:00", "03:00", 0, 0, 1, 5),
+]
+
+# Share of orders per hour of day: breakfast bump, lunch and dinner peaks
+HOUR_WEIGHTS = [1, 1, 1, 1, 1, 1, 2, 4, 6, 5, 6, 14, 22, 18, 8, 5, 6, 12, 22, 24, 16, 8, 4, 2]
+
+# Status mix of finished orders, and of the orders placed within the last
+# IN_FLIGHT_MINUTES before the end of the history window, which are still in
+# flight
+STATUS_WEIGHTS = [("delivered", 97), ("cancelled", 3)]
+IN_FLIGHT_MINUTES = 60
+IN_FLIGHT_STATUS_WEIGHTS = [("picked_up", 45), ("assigned", 45), ("pending", 10)]
+
+
+def _address(number: int) -> str:
+    """Stable street address derived from an integer."""
+    return f"{(number * 104729) % 9000 + 100} {STREETS[(number * 7919) % len(STREETS)]}"
+
+
+def _menu_item(menu_id: int, food_type: str) -> tuple:
+    """Stable (item_name, price) for a menu row, so orders can be priced without keeping menus in memory."""
+    dishes = CUISINES[food_type]
+    base = dishes[(menu_id * 2654435761) % len(dishes)]
+    variant = (menu_id // len(dishes)) % 4
+    name = base if variant == 0 else f"{base} ({['Large', 'Spicy', 'Combo'][variant - 1]})"
+    price = round(3.99 + ((menu_id * 40503) % 2200) / 100, 2)
+    return name, price
+
+
+def zipf_cum_weights(n: int, s: float = 1.07) -> list:
+    """Cumulative Zipf weights for ranks 1..n (rank 1 is the most popular)."""
+    total = 0.0
+    cum = []
+    for rank in range(1, n + 1):
+        total += 1.0 / rank ** s
+        cum.append(total)
+    return cum
+
+
+def _insert_stream(conn, sql: str, rows, batch_size: int, label: str) -> int:
+    """Insert rows from an iterator with executemany, one transaction per batch."""
+    inserted = 0
+    started = time.perf_counter()
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        conn.execute("BEGIN")
+        conn.executemany(sql, batch)
+        conn.commit()
+        inserted += len(batch)
+        rate = inserted / max(time.perf_counter() - started, 1e-9)
+        print(f"\r  {label}: {inserted:,} rows ({rate:,.0f}/s)", end="", flush=True)
+    print()
+    return inserted
+
+
+class DatasetGenerator:
+    """Streams a synthetic dataset into an SQLite file."""
+
+    def __init__(self, path: str, seed: int = 42, batch_size: int = 50_000, days: int = 90,
+                 restaurants: int = 1_000, menu_items: int = 20, riders: int = 400,
+                 users: int = 50_000, orders: int = 200_000, zipf_s: float = 1.07):
+        """
+        Args:
+            path (str): Database file to create or fill
+            seed (int): Random seed; the same seed yields the same data
+            batch_size (int): Rows per executemany transaction
+            days (int): Length of the order history window
+            restaurants (int): Number of restaurants
+            menu_items (int): Average menu items per restaurant
+            riders (int): Number of riders
+            users (int): Number of users
+            orders (int): Number of orders
+            zipf_s (float): Zipf exponent for restaurant popularity
+        """
+        self.path = path
+        self.seed = seed
+        self.batch_size = batch_size
+        self.days = days
+        self.counts = dict(restaurants=restaurants, menu_items=menu_items, riders=riders,
+                           users=users, orders=orders)
+        self.zipf_s = zipf_s
+        self.rng = random.Random(seed)
+        self.end_time = datetime(2024, 1, 1)
+        # Per-restaurant bookkeeping needed to build orders (small: one entry per restaurant)
+        self._food_types = []
+        self._prep_times = []
+        self._menu_start = []
+        self._menu_count = []
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, isolation_level=None)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("PRAGMA cache_size = -200000")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        return conn
+
+    def _restaurants(self):
+        rng = self.rng
+        cuisines = list(CUISINES)
+        hours = [h[:5] for h in HOURS_TEMPLATES]
+        hour_weights = [h[5] for h in HOURS_TEMPLATES]
+        for restaurant_id in range(1, self.counts['restaurants'] + 1):
+            food_type = rng.choices(cuisines, CUISINE_WEIGHTS)[0]
+            opening, closing, breakfast, lunch, dinner = rng.choices(hours, hour_weights)[0]
+            prep_time = rng.randint(8, 35)
+            self._food_types.append(food_type)
+            self._prep_times.append(prep_time)
+            name = f"{rng.choice(LAST_NAMES)}'s {food_type} {rng.choice(NAME_WORDS)} #{restaurant_id}"
+            address = _address(restaurant_id)
+            yield (name, address, food_type, prep_time,
+                   opening, closing, breakfast, lunch, dinner) + geocode(address)
+
+    def _menus(self):
+        rng = self.rng
+        mean = self.counts['menu_items']
+        menu_id = 0
+        for index, food_type in enumerate(self._food_types):
+            count = max(1, int(rng.triangular(mean * 0.4, mean * 1.6, mean)))
+            self._menu_start.append(menu_id + 1)
+            self._menu_count.append(count)
+            for _ in range(count):
+                menu_id += 1
+                name, price = _menu_item(menu_id, food_type)
+                yield (index + 1, name, price)
+
+    def _riders(self):
+        rng = self.rng
+        for rider_id in range(1, self.counts['riders'] + 1):
+            name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+            address = _address(rider_id * 31)
+            yield (name, address, rng.random() < 0.7) + geocode(address)
+
+    def _users(self):
+        rng = self.rng
+        for user_id in range(1, self.counts['users'] + 1):
+            name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+            address = _address(user_id * 17)
+            yield (name, address) + geocode(address)
+
+    def _orders(self):
+        rng = self.rng
+        n_restaurants = self.counts['restaurants']
+        n_users = self.counts['users']
+        n_riders = self.counts['riders']
+        # Shuffle ranks so popular restaurants are spread over the ID space
+        ranked = list(range(1, n_restaurants + 1))
+        rng.shuffle(ranked)
+        cum = zipf_cum_weights(n_restaurants, self.zipf_s)
+        statuses = [s for s, _ in STATUS_WEIGHTS]
+        status_weights = [w for _, w in STATUS_WEIGHTS]
+        in_flight_statuses = [s for s, _ in IN_FLIGHT_STATUS_WEIGHTS]
+        in_flight_weights = [w for _, w in IN_FLIGHT_STATUS_WEIGHTS]
+        in_flight_since = self.end_time - timedelta(minutes=IN_FLIGHT_MINUTES)
+        # Active orders per rider, capped like live assignment caps them
+        rider_load = {}
+        hours = list(range(24))
+        start = self.end_time - timedelta(days=self.days)
+        block = 1024
+
+        produced = 0
+        total = self.counts['orders']
+        while produced < total:
+            k = min(block, total - produced)
+            restaurant_ranks = rng.choices(range(n_restaurants), cum_weights=cum, k=k)
+            order_hours = rng.choices(hours, HOUR_WEIGHTS, k=k)
+            order_statuses = rng.choices(statuses, status_weights, k=k)
+            for rank, hour, status in zip(restaurant_ranks, order_hours, order_statuses):
+                restaurant_id = ranked[rank]
+                user_id = rng.randint(1, n_users)
+                food_type = self._food_types[restaurant_id - 1]
+                first = self._menu_start[restaurant_id - 1]
+                count = self._menu_count[restaurant_id - 1]
+                menu_ids = [first + rng.randrange(count) for _ in range(rng.choice((1, 1, 2, 2, 3, 4)))]
+                items = [_menu_item(menu_id, food_type) for menu_id in menu_ids]
+                total_price = round(sum(price for _, price in items), 2)
+                when = start + timedelta(days=rng.randrange(self.days), hours=hour,
+                                         minutes=rng.randrange(60), seconds=rng.randrange(60))
+                rider_id = rng.randint(1, n_riders)
+                if when >= in_flight_since:
+                    status = rng.choices(in_flight_statuses, in_flight_weights)[0]
+                    rider_id = None if status == 'pending' else self._free_rider(rider_load, n_riders)
+                    if rider_id is None:
+                        status = 'pending'
+                    else:
+                        rider_load[rider_id] = rider_load.get(rider_id, 0) + 1
+                eta = self._prep_times[restaurant_id - 1] + rng.randint(8, 30)
+                produced += 1
+                order = (user_id, restaurant_id, rider_id,
+                         json.dumps([{"name": name, "price": price} for name, price in items]),
+                         total_price, status, when.strftime('%Y-%m-%d %H:%M:%S'), eta,
+                         _address(user_id * 17))
+                # Orders go into a fresh table, so their IDs are assigned sequentially from 1
+                lines = {}
+                for menu_id, (name, price) in zip(menu_ids, items):
+                    lines[menu_id] = (name, price, lines.get(menu_id, (None, None, 0))[2] + 1)
+                yield order, [(produced, menu_id, name, quantity, price)
+                              for menu_id, (name, price, quantity) in lines.items()]
+
+    def _free_rider(self, rider_load: dict, n_riders: int, tries: int = 8):
+        """A random rider with room for another active order, or None if a few draws find none."""
+        for _ in range(tries):
+            rider_id = self.rng.randint(1, n_riders)
+            if rider_load.get(rider_id, 0) < MatchingService.MAX_ACTIVE_ORDERS:
+                return rider_id
+        return None
+
+    def _insert_orders(self, conn):
+        """Stream orders and their order_items rows, committing both in the same batch."""
+        inserted = 0
+        started = time.perf_counter()
+        rows = self._orders()
+        while True:
+            batch = list(itertools.islice(rows, self.batch_size))
+            if not batch:
+                break
+            conn.execute("BEGIN")
+            conn.executemany("""
+                INSERT INTO orders (
+                    user_id, restaurant_id, rider_id, items, total_price,
+                    status, order_time, estimated_delivery_time, delivery_location
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (order for order, _ in batch))
+            conn.executemany("""
+                INSERT INTO order_items (order_id, menu_id, item_name, quantity, unit_price)
+                VALUES (?, ?, ?, ?, ?)
+            """, (line for _, lines in batch for line in lines))
+            conn.commit()
+            inserted += len(batch)
+            rate = inserted / max(time.perf_counter() - started, 1e-9)
+            print(f"\r  orders: {inserted:,} rows ({rate:,.0f}/s)", end="", flush=True)
+        print()
+
+    def generate(self):
+        """Create the schema and stream every table. Refuses to fill a non-empty database."""
+        conn = self._connect()
+        try:
+            migrate(conn)
+            if conn.execute("SELECT COUNT(*) FROM restaurants").fetchone()[0]:
+                raise SystemExit(f"{self.path} already contains data; use a fresh file")
+
+            started = time.perf_counter()
+            print(f"Generating {self.counts} into {self.path} (seed={self.seed})")
+            _insert_stream(conn, """
+                INSERT INTO restaurants (
+                    name, location, food_type, prep_time,
+                    opening_time, closing_time,
+                    serves_breakfast, serves_lunch, serves_dinner,
+                    lat, lon
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, self._restaurants(), self.batch_size, "restaurants")
+            _insert_stream(conn, "INSERT INTO menus (restaurant_id, item_name, price) VALUES (?, ?, ?)",
+                           self._menus(), self.batch_size, "menus")
+            _insert_stream(conn, "INSERT INTO riders (name, location, is_available, lat, lon) VALUES (?, ?, ?, ?, ?)",
+                           self._riders(), self.batch_size, "riders")
+            _insert_stream(conn, "INSERT INTO users (name, location, lat, lon) VALUES (?, ?, ?, ?)",
+                           self._users(), self.batch_size, "users")
+            self._insert_orders(conn)
+            conn.execute("ANALYZE")
+            print(f"Done in {time.perf_counter() - started:.1f}s")
+        finally:
+            conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic food delivery dataset.")
+    parser.add_argument('--db', required=True, help="SQLite file to create")
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small', help="Preset row counts")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--batch-size', type=int, default=50_000, help="Rows per transaction")
+    parser.add_argument('--days', type=int, default=90, help="Days of order history")
+    for table in ('restaurants', 'menu_items', 'riders', 'users', 'orders'):
+        parser.add_argument(f"--{table.replace('_', '-')}", type=int, dest=table,
+                            help=f"Override the preset {table} count")
+    args = parser.parse_args(argv)
+
+    counts = dict(SCALES[args.scale])
+    for table in counts:
+        if getattr(args, table) is not None:
+            counts[table] = getattr(args, table)
+
+    DatasetGenerator(args.db, seed=args.seed, batch_size=args.batch_size, days=args.days, **counts).generate()
+
+
+if __name__ == '__main__':
+    main()
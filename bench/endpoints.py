@@ -0,0 +1,257 @@
+"""
+Endpoint benchmark suite.
+
+Drives the blueprint routes through the Flask test client against databases
+generated by bench.datagen, at one or more data sizes, and reports latency
+percentiles, throughput and SQL statements executed per request. Results
+are written as JSON; pass a previous run as --baseline to fail the run when
+a route regresses.
+
+Usage:
+    python -m bench.endpoints --sizes tiny,small --output bench_results.json
+    python -m bench.endpoints --sizes small --baseline bench_results.json --threshold 0.25
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+from bench.datagen import DATASET_VERSION, SCALES, DatasetGenerator
+
+
+def percentile(samples: list, pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not samples:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(samples)))
+    return samples[min(rank, len(samples)) - 1]
+
+
+class StatementCounter:
+    """SQL trace callback that counts executed statements."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, statement):
+        self.count += 1
+
+
+def _sample_ids(path: str, rng: random.Random, n: int) -> dict:
+    """Pick request targets from the benchmark database."""
+    conn = sqlite3.connect(path)
+    try:
+        def pick(sql):
+            ids = [row[0] for row in conn.execute(sql)]
+            return [rng.choice(ids) for _ in range(n)] if ids else []
+
+        # Orders and their owners are sampled through orders, so popular
+        # restaurants and heavy users show up as often as they do in traffic.
+        max_order = conn.execute("SELECT MAX(order_id) FROM orders").fetchone()[0] or 0
+        order_ids = [rng.randint(1, max_order) for _ in range(n)] if max_order else []
+        targets = {'orders': order_ids}
+        for key, column in (('users', 'user_id'), ('riders', 'rider_id'), ('restaurants', 'restaurant_id')):
+            targets[key] = [conn.execute(f"SELECT {column} FROM orders WHERE order_id = ?", (oid,)).fetchone()[0]
+                            for oid in order_ids]
+            targets[key] = [v for v in targets[key] if v is not None] or pick(f"SELECT {column} FROM {key}")
+        targets['menus'] = {}
+        for restaurant_id in set(targets['restaurants']):
+            targets['menus'][restaurant_id] = [
+                {"name": row[0], "price": row[1]}
+                for row in conn.execute(
+                    "SELECT item_name, price FROM menus WHERE restaurant_id = ? LIMIT 3", (restaurant_id,))
+            ]
+        return targets
+    finally:
+        conn.close()
+
+
+def build_scenarios(targets: dict) -> dict:
+    """
+    Map a route label to a function (client, i) -> response for request i.
+    """
+    def cycle(values, i):
+        return values[i % len(values)]
+
+    # Orders can only contain menu items, so only restaurants with a menu take orders
+    ordering = [r for r in targets['restaurants'] if targets['menus'].get(r)] or targets['restaurants']
+
+    def place_order(client, i):
+        restaurant_id = cycle(ordering, i)
+        return client.post('/api/orders', json={'restaurant_id': restaurant_id,
+                                                'items': targets['menus'].get(restaurant_id, [])})
+
+    def report_locations(client, i):
+        # One batch of pings from every sampled rider, moving a little each time
+        return client.post('/api/riders/locations', json={'locations': [
+            {'rider_id': rider_id, 'lat': 40.7 + (i % 100) * 1e-4, 'lon': -74.0 + j * 1e-5}
+            for j, rider_id in enumerate(targets['riders'][:100])
+        ]})
+
+    return {
+        'POST /api/orders': place_order,
+        'GET /api/orders/<id>': lambda c, i: c.get(f"/api/orders/{cycle(targets['orders'], i)}"),
+        'GET /user/<id>/orders': lambda c, i: c.get(f"/user/{cycle(targets['users'], i)}/orders"),
+        'GET /rider/<id>/orders': lambda c, i: c.get(f"/rider/{cycle(targets['riders'], i)}/orders"),
+        'GET /api/restaurants/search': lambda c, i: c.get('/api/restaurants/search'),
+        'GET /api/riders/available': lambda c, i: c.get('/api/riders/available'),
+        'GET /menu/<id>': lambda c, i: c.get(f"/menu/{cycle(targets['restaurants'], i)}"),
+        'PUT /update_rider_location': lambda c, i: c.put('/update_rider_location', json={
+            'rider_id': cycle(targets['riders'], i), 'location': 'Downtown',
+            'lat': 40.7 + (i % 100) * 1e-4, 'lon': -74.0}),
+        'POST /api/riders/locations (100 pings)': report_locations,
+    }
+
+
+def run_scenario(client, counter: StatementCounter, request_fn, requests: int, warmup: int) -> dict:
+    """Time one route and summarize its latency distribution."""
+    for i in range(warmup):
+        request_fn(client, i)
+
+    latencies = []
+    errors = 0
+    counter.count = 0
+    started = time.perf_counter()
+    for i in range(requests):
+        t0 = time.perf_counter()
+        response = request_fn(client, warmup + i)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        if response.status_code >= 500:
+            errors += 1
+    elapsed = time.perf_counter() - started
+    statements = counter.count
+
+    latencies.sort()
+    return {
+        'requests': requests,
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'max_ms': round(latencies[-1], 3) if latencies else 0.0,
+        'throughput_rps': round(requests / elapsed, 1) if elapsed else 0.0,
+        'sql_per_request': round(statements / requests, 2) if requests else 0.0,
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float, sql_slack: float) -> list:
+    """
+    List regressions of current results against a baseline run.
+
+    A route regresses when its p95 grows by more than `threshold` (a fraction)
+    or it issues more than `sql_slack` extra SQL statements per request.
+    """
+    regressions = []
+    for size, routes in current['results'].items():
+        for route, stats in routes.items():
+            before = baseline.get('results', {}).get(size, {}).get(route)
+            if not before:
+                continue
+            if before['p95_ms'] > 0 and stats['p95_ms'] > before['p95_ms'] * (1 + threshold):
+                regressions.append(f"{size} {route}: p95 {before['p95_ms']}ms -> {stats['p95_ms']}ms")
+            if stats['sql_per_request'] > before['sql_per_request'] + sql_slack:
+                regressions.append(
+                    f"{size} {route}: SQL/request {before['sql_per_request']} -> {stats['sql_per_request']}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Flask API routes.")
+    parser.add_argument('--sizes', default='tiny,small', help="Comma-separated bench.datagen presets")
+    parser.add_argument('--workdir', default='bench_data', help="Where generated databases are cached")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--requests', type=int, default=200, help="Timed requests per route")
+    parser.add_argument('--warmup', type=int, default=20, help="Untimed requests per route")
+    parser.add_argument('--routes', help="Only run routes whose label contains one of these comma-separated strings")
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--baseline', help="Previous results file to compare against")
+    parser.add_argument('--threshold', type=float, default=0.20, help="Allowed p95 growth, e.g. 0.20 for 20%%")
+    parser.add_argument('--sql-slack', type=float, default=0.5, help="Allowed growth in SQL statements per request")
+    args = parser.parse_args(argv)
+
+    sizes = [s for s in args.sizes.split(',') if s]
+    for size in sizes:
+        if size not in SCALES:
+            parser.error(f"unknown size {size!r}; choose from {sorted(SCALES)}")
+    os.makedirs(args.workdir, exist_ok=True)
+
+    # Each size runs against its own generated file, reused across runs.
+    # Writes made by the benchmark go to a scratch copy so runs stay comparable.
+    paths = {}
+    for size in sizes:
+        source = os.path.join(args.workdir, f"{size}_seed{args.seed}_v{DATASET_VERSION}.db")
+        if not os.path.exists(source):
+            DatasetGenerator(source, seed=args.seed, **SCALES[size]).generate()
+        scratch = os.path.join(args.workdir, f"{size}_seed{args.seed}_v{DATASET_VERSION}.run.db")
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(scratch + suffix):
+                os.remove(scratch + suffix)
+        src, dst = sqlite3.connect(source), sqlite3.connect(scratch)
+        src.backup(dst)
+        src.close()
+        dst.close()
+        paths[size] = scratch
+
+    # The app runs migrations against FOOD_DELIVERY_DB at import time
+    os.environ['FOOD_DELIVERY_DB'] = paths[sizes[0]]
+    import db
+    from app import app
+    from models import open_hours, rider_registry
+    logging.getLogger().setLevel(logging.WARNING)
+
+    results = {}
+    for size in sizes:
+        pool = db.configure_pool(paths[size])
+        counter = StatementCounter()
+        pool.set_trace_callback(counter)
+        db.init_db()
+        open_hours.refresh()
+        rider_registry.refresh()
+
+        targets = _sample_ids(paths[size], random.Random(args.seed), max(args.requests, 50))
+        client = app.test_client()
+        results[size] = {}
+        for route, request_fn in build_scenarios(targets).items():
+            if args.routes and not any(part in route for part in args.routes.split(',')):
+                continue
+            stats = run_scenario(client, counter, request_fn, args.requests, args.warmup)
+            results[size][route] = stats
+            print(f"[{size}] {route:32s} p50={stats['p50_ms']:8.3f}ms p95={stats['p95_ms']:8.3f}ms "
+                  f"p99={stats['p99_ms']:8.3f}ms {stats['throughput_rps']:9.1f} req/s "
+                  f"sql/req={stats['sql_per_request']}")
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'seed': args.seed,
+            'requests': args.requests,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold, args.sql_slack)
+        if regressions:
+            print("Regressions:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("No regressions against baseline.")
+
+
+if __name__ == '__main__':
+    main()
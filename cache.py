@@ -0,0 +1,219 @@
+"""
+In-process caches and data version counters.
+
+Writers call touch() for every key they change. That bumps the key's row in
+the data_versions table inside the writer's transaction, where every worker
+process sees it (HTTP ETags are built from these), and, once the write has
+committed, the in-process counter the caches here check. Cached entries
+remember the version they were loaded at and are dropped as soon as it
+changes. In-process counters only see this process's writes, so entries
+also carry a TTL that bounds how stale another worker's cache can get; a
+cache whose values back HTTP responses checks the shared data_versions row
+instead, so its body always matches the ETag built from that row.
+"""
+from collections import OrderedDict
+import threading
+import time
+
+from db import db_cursor, on_commit, on_configure_pool
+
+MENU_CACHE_SIZE = 2048
+MENU_CACHE_TTL = 300
+
+
+class VersionCounters:
+    """Thread-safe monotonic version counters keyed by arbitrary hashable keys."""
+
+    def __init__(self):
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key) -> int:
+        return self._versions.get(key, 0)
+
+    def bump(self, key) -> int:
+        with self._lock:
+            version = self._versions.get(key, 0) + 1
+            self._versions[key] = version
+            return version
+
+    def clear(self):
+        with self._lock:
+            self._versions.clear()
+
+
+class VersionedLRUCache:
+    """
+    Bounded LRU cache whose entries are invalidated by a version counter.
+
+    get() serves an entry only if it was loaded at the key's current version
+    and is younger than the TTL; otherwise it calls the loader and caches the
+    result (None results are cached too, so unknown keys stay cheap).
+    """
+
+    def __init__(self, namespace: str, versions: VersionCounters, max_entries: int, ttl: float,
+                 shared: bool = False):
+        """
+        Args:
+            namespace (str): Prefix of the version keys, e.g. 'menu'
+            versions (VersionCounters): Counters bumped by writers
+            max_entries (int): Maximum number of cached keys
+            ttl (float): Maximum age of an entry in seconds
+            shared (bool): Check entries against the committed data_versions
+                row, which sees every process's writes, at the cost of one
+                primary key lookup per get()
+        """
+        self.namespace = namespace
+        self.versions = versions
+        self.shared = shared
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def version(self, key) -> int:
+        """Current data version of a key."""
+        if self.shared:
+            return shared_versions([(self.namespace, key)])[(self.namespace, key)]
+        return self.versions.get((self.namespace, key))
+
+    def get(self, key, loader):
+        """
+        Return the cached value for key, loading it with loader(key) on a miss.
+        """
+        version = self.version(key)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version and now - entry[1] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        # Load outside the lock; remember the version seen *before* loading so a
+        # write that lands meanwhile makes this entry stale rather than hiding it.
+        value = loader(key)
+        with self._lock:
+            self._entries[key] = (version, now, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def invalidate(self, key):
+        """Bump the key's version and drop its entry. Call after the write has committed."""
+        self.versions.bump((self.namespace, key))
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations
+            }
+
+
+class BoundedDict:
+    """Small thread-safe mapping that forgets its least recently written keys."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        return self._items.get(key, default)
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+def version_key(key: tuple) -> str:
+    """Row key of a version key tuple in data_versions, e.g. 'order:42'."""
+    return ':'.join(str(part) for part in key)
+
+
+def touch(*key):
+    """
+    Record a change to key, e.g. touch('order', 42).
+
+    Call it inside the writer's db_cursor() or transaction() scope, after the
+    write, so the shared version commits (or rolls back) with the data.
+    """
+    with db_cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO data_versions (key, version) VALUES (?, 1)
+            ON CONFLICT (key) DO UPDATE SET version = version + 1
+        """, (version_key(key),))
+    on_commit(lambda: data_versions.bump(key))
+
+
+def touch_many(keys):
+    """Like touch(), for many key tuples with one executemany."""
+    keys = list(keys)
+    with db_cursor() as cursor:
+        cursor.executemany("""
+            INSERT INTO data_versions (key, version) VALUES (?, 1)
+            ON CONFLICT (key) DO UPDATE SET version = version + 1
+        """, [(version_key(key),) for key in keys])
+
+    def bump_all():
+        for key in keys:
+            data_versions.bump(key)
+    on_commit(bump_all)
+
+
+def shared_versions(keys) -> dict:
+    """
+    Committed data_versions of several key tuples with one query.
+
+    Returns:
+        dict: Mapping of each key tuple to its version (0 if never touched)
+    """
+    keys = list(keys)
+    names = [version_key(key) for key in keys]
+    with db_cursor() as cursor:
+        cursor.execute(f"SELECT key, version FROM data_versions WHERE key IN ({','.join('?' for _ in names)})",
+                       names)
+        found = dict(cursor.fetchall())
+    return {key: found.get(name, 0) for key, name in zip(keys, names)}
+
+
+data_versions = VersionCounters()
+
+# Menu bodies are served under ETags built from data_versions, so the cache
+# follows the shared row: another worker's write must never leave this one
+# answering a new tag with an old menu
+menu_cache = VersionedLRUCache('menu', data_versions, MENU_CACHE_SIZE, MENU_CACHE_TTL, shared=True)
+
+# Entries and counters describe one database; start over when the app is
+# pointed at another
+on_configure_pool(menu_cache.clear)
+on_configure_pool(data_versions.clear)
@@ -1,135 +1,543 @@
+from concurrent.futures import Future
 from contextlib import contextmanager
+import os
+import queue
 import sqlite3
+import threading
+import time
+
+from geo import geocode
+from migrations import migrate
+
+DB_PATH = os.environ.get('FOOD_DELIVERY_DB', 'food_delivery.db')
+
+# PRAGMAs applied once when a pooled connection is opened
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 134217728",
+    "PRAGMA temp_store = MEMORY",
+)
+
+
+class ConnectionPool:
+    """
+    Bounded pool of reusable SQLite connections.
+
+    Each thread checks out at most one connection at a time; nested
+    checkouts on the same thread reuse it, so a request that calls several
+    model methods keeps working against a single connection.
+    """
+
+    def __init__(self, path: str, max_size: int = 8, timeout: float = 10.0, cached_statements: int = 256):
+        """
+        Args:
+            path (str): Path to the SQLite database file
+            max_size (int): Maximum number of open connections
+            timeout (float): Seconds to wait for a free connection before failing
+            cached_statements (int): Size of each connection's prepared statement cache
+        """
+        self.path = path
+        self.max_size = max_size
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self._idle = queue.LifoQueue()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._checkouts = 0
+        self._reuses = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._max_wait = 0.0
+        self._closed = False
+        self._trace_callback = None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.timeout,
+            check_same_thread=False,
+            cached_statements=self.cached_statements
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        conn.set_trace_callback(self._trace_callback)
+        return conn
+
+    def set_trace_callback(self, callback):
+        """
+        Install an SQL trace callback on every connection this pool opens.
+
+        Must be called before the pool hands out connections (e.g. right after
+        configure_pool); used by the benchmarks to count statements per request.
+        """
+        self._trace_callback = callback
+
+    def acquire(self) -> sqlite3.Connection:
+        """
+        Check out a connection, opening a new one if the pool is not full.
+
+        Raises:
+            sqlite3.OperationalError: If no connection frees up within the timeout
+        """
+        started = time.perf_counter()
+        try:
+            conn = self._idle.get_nowait()
+            reused = True
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                if self._opened < self.max_size:
+                    self._opened += 1
+                    reused = False
+                    open_new = True
+                else:
+                    open_new = False
+            if open_new:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._opened -= 1
+                    raise
+            else:
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                    reused = True
+                except queue.Empty:
+                    raise sqlite3.OperationalError("Timed out waiting for a database connection")
+
+        waited = time.perf_counter() - started
+        with self._lock:
+            self._checkouts += 1
+            if reused:
+                self._reuses += 1
+            if waited > 0.001:
+                self._waits += 1
+            self._wait_time += waited
+            self._max_wait = max(self._max_wait, waited)
+        return conn
+
+    def release(self, conn: sqlite3.Connection):
+        """Return a connection to the pool, discarding any open transaction."""
+        if conn.in_transaction:
+            conn.rollback()
+        if self._closed:
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+            return
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Yield the connection bound to the current thread, checking one out if needed."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.depth += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+
+        conn = self.acquire()
+        self._local.conn = conn
+        self._local.depth = 1
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._local.depth = 0
+            self.release(conn)
+
+    def close_all(self):
+        """Close every idle connection. Checked-out connections are closed on release."""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+
+    def stats(self) -> dict:
+        """
+        Report pool usage counters.
+
+        Returns:
+            dict: Pool size, idle connections, checkouts, reuses and wait times
+        """
+        with self._lock:
+            return {
+                "path": self.path,
+                "max_size": self.max_size,
+                "open_connections": self._opened,
+                "idle_connections": self._idle.qsize(),
+                "checkouts": self._checkouts,
+                "reuses": self._reuses,
+                "waits": self._waits,
+                "total_wait_ms": round(self._wait_time * 1000, 3),
+                "max_wait_ms": round(self._max_wait * 1000, 3)
+            }
+
+
+_pool = ConnectionPool(DB_PATH)
+_pool_listeners = []
+
+
+def get_pool() -> ConnectionPool:
+    """Return the process-wide connection pool."""
+    return _pool
+
+
+def configure_pool(path: str = None, **kwargs) -> ConnectionPool:
+    """
+    Replace the process-wide pool, e.g. to point the app at another database file.
+
+    Args:
+        path (str): Database file path (defaults to the current one)
+        **kwargs: Extra ConnectionPool options (max_size, timeout, cached_statements)
+
+    Returns:
+        ConnectionPool: The new pool
+    """
+    global _pool, DB_PATH
+    old = _pool
+    DB_PATH = path or old.path
+    _pool = ConnectionPool(DB_PATH, **kwargs)
+    old.close_all()
+    for callback in _pool_listeners:
+        callback()
+    return _pool
+
+
+def on_configure_pool(callback):
+    """
+    Call callback() every time configure_pool replaces the pool.
+
+    In-process caches register here to drop what they loaded from the
+    previous database.
+    """
+    _pool_listeners.append(callback)
+
+
+def pool_stats() -> dict:
+    """Return usage counters of the process-wide connection pool."""
+    return _pool.stats()
+
+
+_unit_of_work = threading.local()
+
+
+def in_transaction() -> bool:
+    """Return True if the current thread is inside a transaction() scope."""
+    return getattr(_unit_of_work, 'depth', 0) > 0
+
 
 @contextmanager
 def db_cursor():
-    conn = sqlite3.connect('food_delivery.db')
-    conn.row_factory = sqlite3.Row  # Set BEFORE creating the cursor!
-    cursor = conn.cursor()
+    with _pool.connection() as conn:
+        cursor = conn.cursor()
+        if in_transaction():
+            # The enclosing unit of work decides whether to commit
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+            return
 
-    try:
-        yield cursor
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        cursor.close()
-        conn.close()
+        try:
+            yield cursor
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            cursor.close()
 
-def init_db():
+
+@contextmanager
+def transaction():
     """
-    Initialize the SQLite database with required tables.
+    Run a unit of work on one connection inside a single BEGIN IMMEDIATE transaction.
+
+    Every db_cursor() opened on this thread while the scope is active shares
+    the connection and defers to it, so the model calls made inside commit
+    or roll back together. Taking the write lock up front also serializes
+    concurrent units of work, e.g. two orders competing for the same rider.
+    Nested scopes join the outermost one.
     """
-    try:
-        with sqlite3.connect('food_delivery.db') as conn:
+    with _pool.connection() as conn:
+        cursor = conn.cursor()
+        if in_transaction():
+            _unit_of_work.depth += 1
+            try:
+                yield cursor
+            finally:
+                _unit_of_work.depth -= 1
+                cursor.close()
+            return
+
+        conn.execute("BEGIN IMMEDIATE")
+        _unit_of_work.depth = 1
+        _unit_of_work.callbacks = []
+        _unit_of_work.rollbacks = []
+        try:
+            yield cursor
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            for callback in _unit_of_work.rollbacks:
+                callback()
+            raise e
+        finally:
+            _unit_of_work.depth = 0
+            callbacks, _unit_of_work.callbacks = _unit_of_work.callbacks, []
+            _unit_of_work.rollbacks = []
+            cursor.close()
+        for callback in callbacks:
+            callback()
+
+
+def on_commit(callback):
+    """
+    Run callback once the current unit of work has committed.
+
+    Outside a transaction() scope the caller's writes are already committed,
+    so the callback runs immediately. Callbacks of a rolled back unit of work
+    are dropped. Used to invalidate caches only after the data is visible.
+    """
+    if in_transaction():
+        _unit_of_work.callbacks.append(callback)
+    else:
+        callback()
+
+
+def on_rollback(callback):
+    """
+    Run callback if the current unit of work rolls back.
+
+    Used to undo in-memory state taken for the unit of work, such as a rider
+    reservation. Outside a transaction() scope there is nothing to roll back
+    and the callback is ignored.
+    """
+    if in_transaction():
+        _unit_of_work.rollbacks.append(callback)
+
+
+# Operations the writer thread commits per transaction, and operations that
+# may wait in its queue before submit_write() blocks
+WRITE_BATCH_SIZE = int(os.environ.get('WRITE_BATCH_SIZE', '256'))
+WRITE_QUEUE_SIZE = int(os.environ.get('WRITE_QUEUE_SIZE', '4096'))
+# Seconds submit_write() waits for room in a full queue before failing
+WRITE_SUBMIT_TIMEOUT = 10.0
+# Tries at taking the write lock (each waiting up to busy_timeout) before a batch fails
+WRITE_BEGIN_ATTEMPTS = 3
+
+
+class _WriteOp:
+    __slots__ = ('fn', 'args', 'kwargs', 'future')
+
+    def __init__(self, fn, args, kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+
+
+class WriteQueue:
+    """
+    Single writer thread that group-commits the write operations submitted to it.
+
+    Request threads hand over an operation and wait on its future instead of
+    competing for the database write lock. The writer drains up to
+    batch_size queued operations into one BEGIN IMMEDIATE transaction and
+    runs each inside its own SAVEPOINT: an operation that raises is rolled
+    back on its own and its submitter gets the exception, while the others
+    commit together with a single fsync. Futures resolve only after the
+    commit, so a caller never sees a write that is not durable.
+
+    Operations run on the writer thread as a unit of work, so model code that
+    opens db_cursor() or transaction() joins the batch, and its on_commit /
+    on_rollback callbacks fire when the batch commits or the operation's
+    savepoint rolls back. Every write of the process goes through here, so
+    the writer only waits for the lock on other processes' writes. The
+    queue is bounded: when it is full, submitters
+    block, which slows request intake down to the writer's pace.
+    """
+
+    def __init__(self, batch_size: int = WRITE_BATCH_SIZE, max_queued: int = WRITE_QUEUE_SIZE):
+        self.batch_size = batch_size
+        self._queue = queue.Queue(max_queued)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.operations = 0
+        self.failed = 0
+        self.batches = 0
+        self.largest_batch = 0
+        self.rejected = 0
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """
+        Queue fn(cursor, *args, **kwargs) for the writer thread.
+
+        Raises:
+            sqlite3.OperationalError: If the queue stays full for WRITE_SUBMIT_TIMEOUT
+        """
+        self._start()
+        op = _WriteOp(fn, args, kwargs)
+        try:
+            self._queue.put(op, timeout=WRITE_SUBMIT_TIMEOUT)
+        except queue.Full:
+            self.rejected += 1
+            raise sqlite3.OperationalError("Write queue is full")
+        return op.future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._commit(batch)
+            except Exception as e:
+                # The connection itself failed; fail whatever is unresolved
+                for op in batch:
+                    if not op.future.done():
+                        op.future.set_exception(e)
+
+    def _commit(self, batch: list):
+        done = []
+        with _pool.connection() as conn:
             cursor = conn.cursor()
+            # No operation has run yet, so a lock held by another process is
+            # waited out again rather than failing the whole batch
+            for attempt in range(1, WRITE_BEGIN_ATTEMPTS + 1):
+                try:
+                    conn.execute("BEGIN IMMEDIATE")
+                    break
+                except sqlite3.OperationalError:
+                    if attempt == WRITE_BEGIN_ATTEMPTS:
+                        cursor.close()
+                        raise
+            _unit_of_work.depth = 1
+            try:
+                for op in batch:
+                    if not op.future.set_running_or_notify_cancel():
+                        continue
+                    _unit_of_work.callbacks = []
+                    _unit_of_work.rollbacks = []
+                    conn.execute("SAVEPOINT write_op")
+                    try:
+                        result = op.fn(cursor, *op.args, **op.kwargs)
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO write_op")
+                        conn.execute("RELEASE write_op")
+                        for callback in _unit_of_work.rollbacks:
+                            callback()
+                        self.failed += 1
+                        op.future.set_exception(e)
+                        continue
+                    conn.execute("RELEASE write_op")
+                    done.append((op, result, _unit_of_work.callbacks, _unit_of_work.rollbacks))
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                for op, _, _, rollbacks in done:
+                    for callback in rollbacks:
+                        callback()
+                    op.future.set_exception(e)
+                raise
+            finally:
+                _unit_of_work.depth = 0
+                _unit_of_work.callbacks = []
+                _unit_of_work.rollbacks = []
+                cursor.close()
 
-            # Optional: enable column access by name
-            conn.row_factory = sqlite3.Row
-
-            # Drop old tables if they exist
-            cursor.execute('DROP TABLE IF EXISTS users')
-            cursor.execute('DROP TABLE IF EXISTS riders')
-            cursor.execute('DROP TABLE IF EXISTS restaurants')
-            cursor.execute('DROP TABLE IF EXISTS menus')
-            cursor.execute('DROP TABLE IF EXISTS orders')
-            cursor.execute('DROP TABLE IF EXISTS notifications')
-
-            # Create users table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    location TEXT NOT NULL
-                )
-            ''')
-
-            # Create riders table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS riders (
-                    rider_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    location TEXT NOT NULL,
-                    is_available BOOLEAN DEFAULT TRUE
-                )
-            ''')
-
-            # Create restaurants table with additional fields (food_type, prep_time)
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS restaurants (
-                    restaurant_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    location TEXT NOT NULL,
-                    food_type TEXT DEFAULT 'Mixed',
-                    prep_time INTEGER DEFAULT 10,
-                    opening_time TIME DEFAULT '09:00:00',
-                    closing_time TIME DEFAULT '22:00:00',
-                    serves_breakfast BOOLEAN DEFAULT 1,
-                    serves_lunch BOOLEAN DEFAULT 1,
-                    serves_dinner BOOLEAN DEFAULT 1
-                )
-            ''')
-
-            # Create menus table (linked to restaurants)
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS menus (
-                    menu_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    restaurant_id INTEGER,
-                    item_name TEXT NOT NULL,
-                    price REAL NOT NULL,
-                    FOREIGN KEY (restaurant_id) REFERENCES restaurants (restaurant_id)
-                )
-            ''')
-
-            # Create orders table (linked to users, restaurants, and riders)
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS orders (
-                    order_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    restaurant_id INTEGER,
-                    rider_id INTEGER,
-                    items TEXT NOT NULL,
-                    total_price REAL NOT NULL,
-                    status TEXT DEFAULT 'pending',
-                    order_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    estimated_delivery_time INTEGER,
-                    delivery_location TEXT,
-                    FOREIGN KEY (user_id) REFERENCES users (user_id),
-                    FOREIGN KEY (restaurant_id) REFERENCES restaurants (restaurant_id),
-                    FOREIGN KEY (rider_id) REFERENCES riders (rider_id)
-                )
-            ''')
-
-            # Create notifications table (linked to users and orders)
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS notifications (
-                    notification_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    order_id INTEGER,
-                    message TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (user_id),
-                    FOREIGN KEY (order_id) REFERENCES orders (order_id)
-                )
-            ''')
-
-            # Create indexes for performance improvement
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders (user_id)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_rider_id ON orders (rider_id)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_menus_restaurant_id ON menus (restaurant_id)')
+        self.operations += len(done)
+        self.batches += 1
+        self.largest_batch = max(self.largest_batch, len(batch))
+        for op, result, callbacks, _ in done:
+            for callback in callbacks:
+                callback()
+            op.future.set_result(result)
 
-            conn.commit()
-            populate_sample_data()
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "operations": self.operations,
+            "failed": self.failed,
+            "batches": self.batches,
+            "average_batch": round(self.operations / self.batches, 2) if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+            "rejected": self.rejected
+        }
+
+
+write_queue = WriteQueue()
+
+
+def submit_write(fn, *args, **kwargs):
+    """
+    Run fn(cursor, *args, **kwargs) on the writer thread and return its result.
+
+    The call blocks until the batch holding the operation has committed, and
+    re-raises whatever fn raised (its writes are then rolled back). Inside a
+    transaction() scope, or on the writer thread itself, fn runs inline as
+    part of the current unit of work instead, since the caller already holds
+    the write lock.
+    """
+    if in_transaction():
+        with db_cursor() as cursor:
+            return fn(cursor, *args, **kwargs)
+    return write_queue.submit(fn, *args, **kwargs).result()
+
+
+def init_db():
+    """
+    Bring the database schema up to date without touching existing data.
 
-            print("Database initialized successfully.")
+    Safe to call from every worker at startup: once the schema is current
+    this is a single PRAGMA user_version read.
+    """
+    try:
+        with _pool.connection() as conn:
+            for version, description in migrate(conn):
+                print(f"Applied migration {version}: {description}")
     except sqlite3.Error as e:
         print(f"Error initializing database: {e}")
 
 
 def populate_sample_data():
+    """
+    Insert the demo restaurants, menus, riders, users and orders.
+
+    Opt-in (see the seed-db command); skipped when restaurants already exist
+    because the sample menus and orders refer to restaurant IDs 1-10.
+    """
     try:
         with db_cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM restaurants")
+            if cursor.fetchone()[0]:
+                print("Sample data already present, skipping.")
+                return
+
             restaurants = [
                 ("Pizza Palace", "123 Main St", "Italian", 20, "00:00", "23:00", 0, 1, 1),
                 ("Sushi Wave", "456 Oak Ave", "Japanese", 15, "11:00", "22:00", 0, 1, 1),
@@ -146,9 +554,10 @@ def populate_sample_data():
                 INSERT INTO restaurants (
                     name, location, food_type, prep_time,
                     opening_time, closing_time,
-                    serves_breakfast, serves_lunch, serves_dinner
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, restaurants)
+                    serves_breakfast, serves_lunch, serves_dinner,
+                    lat, lon
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, [row + geocode(row[1]) for row in restaurants])
             # Sample Menu Items for each restaurant
             menus = [
                 # 1. Pizza Palace
@@ -212,7 +621,8 @@ def populate_sample_data():
                 ("Lisa Quick", "Eastside", True),
                 ("Tom Swift", "Central Area", True)
             ]
-            cursor.executemany("INSERT INTO riders (name, location, is_available) VALUES (?, ?, ?)", riders)
+            cursor.executemany("INSERT INTO riders (name, location, is_available, lat, lon) VALUES (?, ?, ?, ?, ?)",
+                               [row + geocode(row[1]) for row in riders])
 
             # Sample Users
             users = [
@@ -229,7 +639,8 @@ def populate_sample_data():
             ]
 
 
-            cursor.executemany("INSERT INTO users (name, location) VALUES (?, ?)", users)
+            cursor.executemany("INSERT INTO users (name, location, lat, lon) VALUES (?, ?, ?, ?)",
+                               [row + geocode(row[1]) for row in users])
 
             sample_orders = [
                 (1, 1, None, '[{"name":"Margherita Pizza","price":12.99}]', 12.99, 'pending', '123 Park Ave'),
@@ -243,6 +654,14 @@ def populate_sample_data():
                     total_price, status, delivery_location
                 ) VALUES (?, ?, ?, ?, ?, ?, ?)
             """, sample_orders)
+            cursor.executemany("""
+                INSERT INTO order_items (order_id, menu_id, item_name, quantity, unit_price)
+                VALUES (?, ?, ?, ?, ?)
+            """, [
+                (1, 1, "Margherita Pizza", 1, 12.99),
+                (2, 5, "California Roll", 1, 8.99),
+                (3, None, "Butter Chicken", 1, 14.99)
+            ])
             print("Sample data populated successfully.")
     except sqlite3.Error as e:
         print(f"Error populating sample data: {e}")
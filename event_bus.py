@@ -0,0 +1,191 @@
+"""
+In-process publish/subscribe bus for order events.
+
+Writers publish an event when an order changes (placed, assigned, status
+updated); Server-Sent Events streams subscribe to the topics they follow,
+('order', id), ('user', id) or ('rider', id), and push each event to the
+client as it arrives. An idle stream waits on its queue and costs no
+database work.
+
+publish_order_event() defers publishing until the writer's transaction
+commits, so subscribers never see a change that is rolled back. Each
+subscriber has a bounded queue; one that falls MAX_QUEUED_EVENTS behind is
+closed so a stalled client cannot hold memory, and reconnects to catch up.
+
+The bus only reaches subscribers in the publishing process. Under several
+worker processes a client sees the changes made by its own worker.
+"""
+import json
+import queue
+import threading
+import time
+
+from db import on_commit
+
+MAX_QUEUED_EVENTS = 100
+# Seconds between keep-alive comments on an idle stream; a write to a
+# disconnected client fails, which is how the stream notices it is gone
+HEARTBEAT_SECONDS = 15.0
+
+_CLOSED = object()
+
+
+class Subscription:
+    """Queue of the events published to a set of topics."""
+
+    def __init__(self, bus, topics):
+        self._bus = bus
+        self.topics = topics
+        self._queue = queue.Queue(MAX_QUEUED_EVENTS)
+        self.closed = False
+
+    def _deliver(self, event: dict) -> bool:
+        try:
+            self._queue.put_nowait(event)
+            return True
+        except queue.Full:
+            return False
+
+    def get(self, timeout: float = None):
+        """
+        Next event, or None if none arrived within timeout.
+
+        Raises:
+            EOFError: Once the subscription is closed
+        """
+        if self.closed:
+            raise EOFError("Subscription closed")
+        try:
+            event = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if event is _CLOSED:
+            raise EOFError("Subscription closed")
+        return event
+
+    def close(self):
+        """Unsubscribe; safe to call more than once."""
+        if not self.closed:
+            self.closed = True
+            self._bus._remove(self)
+            try:
+                self._queue.put_nowait(_CLOSED)
+            except queue.Full:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class EventBus:
+    """Thread-safe topic -> subscribers map; see the module docstring."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._topics = {}
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, *topics) -> Subscription:
+        """Subscribe to one or more topic tuples, e.g. subscribe(('order', 42))."""
+        subscription = Subscription(self, topics)
+        with self._lock:
+            for topic in topics:
+                self._topics.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def _remove(self, subscription: Subscription):
+        with self._lock:
+            for topic in subscription.topics:
+                subscribers = self._topics.get(topic)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._topics[topic]
+
+    def publish(self, topics, event: dict) -> int:
+        """
+        Deliver event to every subscriber of any of topics, once each.
+
+        Returns:
+            int: Number of subscribers reached
+        """
+        with self._lock:
+            subscribers = set()
+            for topic in topics:
+                subscribers.update(self._topics.get(topic, ()))
+        self.published += 1
+        reached = 0
+        for subscription in subscribers:
+            if subscription._deliver(event):
+                reached += 1
+            else:
+                # Too far behind: cut it loose rather than buffer without bound
+                self.dropped += 1
+                subscription.close()
+        return reached
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "topics": len(self._topics),
+                "subscriptions": len({s for subscribers in self._topics.values() for s in subscribers}),
+                "published": self.published,
+                "dropped": self.dropped
+            }
+
+
+bus = EventBus()
+
+
+def publish_order_event(order_id: int, status: str, user_id: int = None, rider_id: int = None, **fields):
+    """
+    Publish an order change to its order, user and rider topics.
+
+    Call it inside the writer's db_cursor() or transaction() scope; the
+    event goes out once the write commits.
+
+    Args:
+        order_id (int): Order's ID
+        status (str): Order status after the change
+        user_id (int, optional): Ordering user, to reach their stream
+        rider_id (int, optional): Assigned rider, to reach their stream
+        **fields: Extra event fields, e.g. estimated_delivery_time
+    """
+    event = dict(fields, type='order', order_id=order_id, status=status, user_id=user_id,
+                 rider_id=rider_id, at=time.time())
+    topics = [('order', order_id)]
+    if user_id is not None:
+        topics.append(('user', user_id))
+    if rider_id is not None:
+        topics.append(('rider', rider_id))
+    on_commit(lambda: bus.publish(topics, event))
+
+
+def sse_stream(subscription: Subscription, first_events=(), heartbeat: float = None):
+    """
+    Generate the text/event-stream body for a subscription.
+
+    first_events are sent before anything published, e.g. a snapshot of the
+    current state. The subscription is closed when the client disconnects
+    (the WSGI server closes the generator) or the bus drops it.
+    """
+    heartbeat = heartbeat or HEARTBEAT_SECONDS
+    try:
+        for event in first_events:
+            yield _sse_message(event)
+        while True:
+            try:
+                event = subscription.get(timeout=heartbeat)
+            except EOFError:
+                return
+            yield _sse_message(event) if event is not None else ": keep-alive\n\n"
+    finally:
+        subscription.close()
+
+
+def _sse_message(event: dict) -> str:
+    return f"event: {event.get('type', 'message')}\ndata: {json.dumps(event)}\n\n"
@@ -0,0 +1,205 @@
+"""
+Coordinates, distances and a uniform-grid spatial index.
+
+Riders, restaurants and users carry lat/lon columns. Clients may send
+coordinates; when they only send a free-text address, geocode() places it
+deterministically inside the service area, so every worker process derives
+the same point from the same address (unlike hash(), which is salted per
+process).
+"""
+from math import asin, cos, radians, sin, sqrt
+import heapq
+import threading
+import time
+import zlib
+
+# Service area the pseudo-geocoder spreads addresses over
+CITY_CENTER = (40.7306, -73.9866)
+CITY_SPAN_KM = 20.0
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEG_LAT = 110.574
+KM_PER_DEG_LON_EQUATOR = 111.320
+
+
+def geocode(address: str) -> tuple:
+    """
+    Deterministic stand-in for a geocoder: map an address to (lat, lon).
+
+    Equal addresses (ignoring case and spacing) always map to the same point
+    inside the CITY_SPAN_KM square around CITY_CENTER.
+    """
+    key = ' '.join(str(address).lower().split()).encode()
+    u = zlib.crc32(key) / 0xFFFFFFFF
+    v = zlib.crc32(key, 0x9E3779B9) / 0xFFFFFFFF
+    lat = CITY_CENTER[0] + (u - 0.5) * CITY_SPAN_KM / KM_PER_DEG_LAT
+    lon = CITY_CENTER[1] + (v - 0.5) * CITY_SPAN_KM / (KM_PER_DEG_LON_EQUATOR * cos(radians(CITY_CENTER[0])))
+    return round(lat, 6), round(lon, 6)
+
+
+def resolve(location: str, lat=None, lon=None) -> tuple:
+    """
+    Coordinates for a location: the given lat/lon if any, else geocode(location).
+
+    Raises:
+        ValueError: If only one of lat and lon is given or either is out of range
+    """
+    if lat is None and lon is None:
+        return geocode(location)
+    if lat is None or lon is None:
+        raise ValueError("Latitude and longitude must be given together")
+    lat, lon = float(lat), float(lon)
+    if not -90 <= lat <= 90 or not -180 <= lon <= 180:
+        raise ValueError("Latitude or longitude out of range")
+    return lat, lon
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance between two points in kilometres."""
+    dlat = radians(lat2 - lat1)
+    dlon = radians(lon2 - lon1)
+    a = sin(dlat / 2) ** 2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * asin(sqrt(a))
+
+
+class GridIndex:
+    """
+    Points bucketed into square cells of cell_km on a side.
+
+    Coordinates are projected onto a local plane around ref_lat, which is
+    accurate to well under a percent at city scale. nearest() searches the
+    query's cell and then rings of cells around it, stopping once no cell
+    further out can hold a closer point, so its cost depends on how many
+    points are nearby rather than on the total. Once a ring would hold more
+    cells than there are occupied cells left to visit, e.g. because a few
+    points lie far from the rest, it scans the remaining occupied cells
+    instead, so a query never costs more than a pass over the points.
+    """
+
+    def __init__(self, cell_km: float = 0.5, ref_lat: float = CITY_CENTER[0]):
+        self.cell_km = cell_km
+        self._km_per_deg_lon = KM_PER_DEG_LON_EQUATOR * cos(radians(ref_lat))
+        self._lock = threading.Lock()
+        self._cells = {}
+        self._points = {}
+        self.loaded_at = None
+
+    def _project(self, lat: float, lon: float) -> tuple:
+        return lon * self._km_per_deg_lon, lat * KM_PER_DEG_LAT
+
+    def _cell(self, x: float, y: float) -> tuple:
+        return int(x // self.cell_km), int(y // self.cell_km)
+
+    def _put(self, key, lat: float, lon: float):
+        """Insert or move a point. Caller holds the lock."""
+        self._remove(key)
+        x, y = self._project(lat, lon)
+        cell = self._cell(x, y)
+        self._cells.setdefault(cell, {})[key] = (x, y)
+        self._points[key] = cell
+
+    def _remove(self, key):
+        """Drop a point if present. Caller holds the lock."""
+        cell = self._points.pop(key, None)
+        if cell is not None:
+            bucket = self._cells[cell]
+            del bucket[key]
+            if not bucket:
+                del self._cells[cell]
+
+    def put(self, key, lat: float, lon: float):
+        with self._lock:
+            self._put(key, lat, lon)
+
+    def remove(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def rebuild(self, points):
+        """Replace the contents with (key, lat, lon) tuples."""
+        with self._lock:
+            self._cells, self._points = {}, {}
+            for key, lat, lon in points:
+                self._put(key, lat, lon)
+            self.loaded_at = time.monotonic()
+
+    def __contains__(self, key) -> bool:
+        return key in self._points
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+    def nearest(self, lat: float, lon: float, k: int, max_km: float = None) -> list:
+        """
+        The k points closest to (lat, lon).
+
+        Args:
+            lat (float): Query latitude
+            lon (float): Query longitude
+            k (int): Number of points wanted
+            max_km (float, optional): Ignore points further away than this
+
+        Returns:
+            list: (distance_km, key) tuples, nearest first
+        """
+        qx, qy = self._project(lat, lon)
+        cx, cy = self._cell(qx, qy)
+        best = []  # max-heap of (-distance, key) holding the k closest so far
+
+        def consider(bucket):
+            for key, (x, y) in bucket.items():
+                distance = sqrt((x - qx) ** 2 + (y - qy) ** 2)
+                if max_km is not None and distance > max_km:
+                    continue
+                if len(best) < k:
+                    heapq.heappush(best, (-distance, key))
+                elif distance < -best[0][0]:
+                    heapq.heapreplace(best, (-distance, key))
+
+        with self._lock:
+            if not self._points or k <= 0:
+                return []
+            visited = 0
+            ring = 0
+            while visited < len(self._cells):
+                if 8 * ring > len(self._cells) - visited:
+                    # Sparse from here on: scan the occupied cells not visited yet
+                    for (x, y), bucket in self._cells.items():
+                        if max(abs(x - cx), abs(y - cy)) >= ring:
+                            consider(bucket)
+                    break
+                for cell in self._ring(cx, cy, ring):
+                    bucket = self._cells.get(cell)
+                    if bucket:
+                        visited += 1
+                        consider(bucket)
+                # Every point beyond this ring is at least ring * cell_km away
+                reach = ring * self.cell_km
+                if len(best) == k and -best[0][0] <= reach:
+                    break
+                if max_km is not None and reach > max_km:
+                    break
+                ring += 1
+        return sorted((-negative, key) for negative, key in best)
+
+    @staticmethod
+    def _ring(cx: int, cy: int, ring: int):
+        """Cells at Chebyshev distance ring from (cx, cy)."""
+        if ring == 0:
+            yield cx, cy
+            return
+        for dx in range(-ring, ring + 1):
+            yield cx + dx, cy - ring
+            yield cx + dx, cy + ring
+        for dy in range(-ring + 1, ring):
+            yield cx - ring, cy + dy
+            yield cx + ring, cy + dy
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "points": len(self._points),
+                "cells": len(self._cells),
+                "cell_km": self.cell_km,
+                "age_seconds": round(time.monotonic() - self.loaded_at, 1) if self.loaded_at else None
+            }
@@ -0,0 +1,58 @@
+"""
+Conditional GET support driven by data version counters.
+
+ETags are built from the data_versions table (bumped by writers in the same
+transaction as the write, see cache.touch) instead of hashing response
+bodies, so a matching If-None-Match is answered with 304 after one primary
+key lookup, before the view runs its queries or serializes anything. The
+table is shared by every worker process, so a write made through one worker
+changes the tags all of them hand out.
+"""
+from functools import wraps
+
+from flask import Response, make_response, request
+
+from cache import shared_versions
+
+# Random per-database value (see migration 6), so tags from another database
+# never match
+EPOCH_KEY = ('epoch',)
+
+
+def version_tag(*parts) -> str:
+    """
+    Build an entity tag from version keys and literal parts.
+
+    Tuples are looked up in data_versions; anything else is used as is.
+    """
+    versions = shared_versions([EPOCH_KEY] + [part for part in parts if isinstance(part, tuple)])
+    values = [str(versions[part]) if isinstance(part, tuple) else str(part) for part in parts]
+    return '-'.join([format(versions[EPOCH_KEY], 'x')] + values)
+
+
+def conditional(etag_for, cache_control: str = 'no-cache'):
+    """
+    Decorate a GET view with strong-ETag revalidation.
+
+    Args:
+        etag_for (callable): Called with the view's keyword arguments; returns
+            the entity tag (unquoted) or None to skip conditional handling
+        cache_control (str): Cache-Control header for 200 and 304 responses
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            tag = etag_for(**kwargs)
+            if tag is not None and request.if_none_match.contains(tag):
+                not_modified = Response(status=304)
+                not_modified.set_etag(tag)
+                not_modified.headers['Cache-Control'] = cache_control
+                return not_modified
+
+            response = make_response(view(*args, **kwargs))
+            if tag is not None and response.status_code == 200:
+                response.set_etag(tag)
+                response.headers['Cache-Control'] = cache_control
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,196 @@
+"""
+Idempotency-Key support for POST endpoints that create things.
+
+A client that times out and retries sends the same Idempotency-Key header
+again. The first request with a key claims it with a row in the
+idempotency_keys table, committed before the view runs so every worker
+process sees it. The view's own writes go through the writer thread as
+usual, and its response is stored right after. A retry finds the stored
+response and gets it replayed with an Idempotent-Replayed header, without
+running the view again.
+
+A duplicate that arrives while the first request is still in flight waits
+for it (woken directly in the same process, polling the table across
+processes) instead of racing it, up to IDEMPOTENCY_WAIT_SECONDS. A key
+reused with a different body is refused with 422. Server errors are not
+stored: their claim is dropped so a retry runs afresh. Keys expire after
+IDEMPOTENCY_TTL_SECONDS.
+
+An in-flight claim is a lease: a thread renews claimed_at for the requests
+running in this process, and a claim not renewed for
+IDEMPOTENCY_LEASE_SECONDS belonged to a request that died, so a retry takes
+it over. A process that dies after the view's writes committed but before
+its response was stored therefore runs the view again on that retry.
+"""
+import hashlib
+import os
+import threading
+import time
+from functools import wraps
+
+from flask import Response, jsonify, make_response, request
+
+from db import db_cursor, submit_write
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+IDEMPOTENCY_TTL_SECONDS = float(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 24 * 3600))
+# An in-flight claim not renewed for this long may be taken over
+IDEMPOTENCY_LEASE_SECONDS = float(os.environ.get('IDEMPOTENCY_LEASE_SECONDS', 10))
+# How long a duplicate waits for the request in flight before giving up with 409
+IDEMPOTENCY_WAIT_SECONDS = 30.0
+# Poll interval while waiting on a request running in another process
+POLL_SECONDS = 0.05
+# Expired keys are purged at most this often per process
+PURGE_INTERVAL_SECONDS = 60.0
+
+_lock = threading.Lock()
+# key -> Event set when the request in flight in this process finishes
+_inflight = {}
+_renewer = None
+_last_purge = 0.0
+
+
+def _purge_expired(cursor, now: float):
+    global _last_purge
+    if now - _last_purge >= PURGE_INTERVAL_SECONDS:
+        _last_purge = now
+        cursor.execute("DELETE FROM idempotency_keys WHERE created_at < ?", (now - IDEMPOTENCY_TTL_SECONDS,))
+
+
+def _claim_in(cursor, key: str, fingerprint: str):
+    now = time.time()
+    _purge_expired(cursor, now)
+    cursor.execute("""
+        INSERT INTO idempotency_keys (key, fingerprint, created_at, claimed_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT (key) DO UPDATE SET
+            fingerprint = excluded.fingerprint, status = NULL, content_type = NULL, body = NULL,
+            created_at = excluded.created_at, claimed_at = excluded.claimed_at
+        WHERE idempotency_keys.created_at < ?
+           OR (idempotency_keys.status IS NULL AND idempotency_keys.claimed_at < ?)
+    """, (key, fingerprint, now, now, now - IDEMPOTENCY_TTL_SECONDS, now - IDEMPOTENCY_LEASE_SECONDS))
+    if cursor.rowcount:
+        return None
+    cursor.execute("SELECT fingerprint, status, content_type, body FROM idempotency_keys WHERE key = ?", (key,))
+    return cursor.fetchone()
+
+
+def _claim(key: str, fingerprint: str):
+    """Claim key for this request; returns None if claimed, else the existing row."""
+    return submit_write(_claim_in, key, fingerprint)
+
+
+def _release(key: str):
+    submit_write(lambda cursor: cursor.execute(
+        "DELETE FROM idempotency_keys WHERE key = ? AND status IS NULL", (key,)
+    ))
+
+
+def _store(key: str, response):
+    submit_write(lambda cursor: cursor.execute(
+        "UPDATE idempotency_keys SET status = ?, content_type = ?, body = ? WHERE key = ?",
+        (response.status_code, response.content_type, response.get_data(), key)
+    ))
+
+
+def _renew_leases():
+    """Keep the claims of the requests in flight in this process from going stale."""
+    while True:
+        time.sleep(IDEMPOTENCY_LEASE_SECONDS / 3)
+        with _lock:
+            keys = list(_inflight)
+        if not keys:
+            continue
+        now = time.time()
+        try:
+            submit_write(lambda cursor: cursor.executemany(
+                "UPDATE idempotency_keys SET claimed_at = ? WHERE key = ? AND status IS NULL",
+                [(now, key) for key in keys]
+            ))
+        except Exception:
+            # Renewed again on the next round, well inside the lease
+            pass
+
+
+def _start_renewer():
+    global _renewer
+    with _lock:
+        if _renewer is None:
+            _renewer = threading.Thread(target=_renew_leases, name='idempotency-leases', daemon=True)
+            _renewer.start()
+
+
+def _run(key: str, view, args, kwargs):
+    """Run the view as the owner of key, then store its response."""
+    done = threading.Event()
+    _start_renewer()
+    with _lock:
+        _inflight[key] = done
+    try:
+        response = make_response(view(*args, **kwargs))
+        if response.status_code >= 500:
+            _release(key)
+        else:
+            _store(key, response)
+        return response
+    except Exception:
+        _release(key)
+        raise
+    finally:
+        with _lock:
+            _inflight.pop(key, None)
+        done.set()
+
+
+def _wait_remote(key: str, deadline: float):
+    """Poll until the claim of another process is resolved, dropped or stale, or the deadline passes."""
+    while time.monotonic() < deadline:
+        time.sleep(POLL_SECONDS)
+        with db_cursor() as cursor:
+            cursor.execute("SELECT status, claimed_at FROM idempotency_keys WHERE key = ?", (key,))
+            row = cursor.fetchone()
+        if (row is None or row['status'] is not None
+                or row['claimed_at'] < time.time() - IDEMPOTENCY_LEASE_SECONDS):
+            return
+
+
+def idempotent(view):
+    """
+    Decorate a POST view so requests carrying an Idempotency-Key run at most once.
+
+    Requests without the header run as usual.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        client_key = request.headers.get(HEADER)
+        if client_key is None:
+            return view(*args, **kwargs)
+        if not 0 < len(client_key) <= MAX_KEY_LENGTH:
+            return jsonify({"error": f"{HEADER} must be 1 to {MAX_KEY_LENGTH} characters"}), 400
+
+        key = f"{request.method} {request.path} {client_key}"
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()[:32]
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+        while True:
+            # A request in flight in this process is waited for, never taken over
+            with _lock:
+                done = _inflight.get(key)
+            if done is not None:
+                if not done.wait(max(0.0, deadline - time.monotonic())):
+                    return jsonify({"error": f"A request with this {HEADER} is still in progress"}), 409
+                continue
+            row = _claim(key, fingerprint)
+            if row is None:
+                return _run(key, view, args, kwargs)
+            if row['fingerprint'] != fingerprint:
+                return jsonify({"error": f"{HEADER} was already used for a different request"}), 422
+            if row['status'] is not None:
+                replay = Response(row['body'], status=row['status'], content_type=row['content_type'])
+                replay.headers['Idempotent-Replayed'] = 'true'
+                return replay
+            if time.monotonic() >= deadline:
+                return jsonify({"error": f"A request with this {HEADER} is still in progress"}), 409
+            # Wait for the request in flight in another process; if it fails or
+            # dies, its claim is gone or stale and the next round claims the key
+            _wait_remote(key, deadline)
+    return wrapper
@@ -0,0 +1,476 @@
+"""
+Versioned schema migrations.
+
+The schema version lives in the database header (PRAGMA user_version).
+Each migration is applied once, in order, inside a single BEGIN IMMEDIATE
+transaction, so several workers starting against the same file at the same
+time cannot apply a migration twice: the first one takes the write lock,
+the others wait for it and then find nothing left to do.
+"""
+import json
+import secrets
+import sqlite3
+
+from geo import geocode
+
+
+def _baseline_schema(cursor):
+    """Tables and indexes the app has shipped with since the first release."""
+    # Create users table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            location TEXT NOT NULL
+        )
+    ''')
+
+    # Create riders table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS riders (
+            rider_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            location TEXT NOT NULL,
+            is_available BOOLEAN DEFAULT TRUE
+        )
+    ''')
+
+    # Create restaurants table with additional fields (food_type, prep_time)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS restaurants (
+            restaurant_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            location TEXT NOT NULL,
+            food_type TEXT DEFAULT 'Mixed',
+            prep_time INTEGER DEFAULT 10,
+            opening_time TIME DEFAULT '09:00:00',
+            closing_time TIME DEFAULT '22:00:00',
+            serves_breakfast BOOLEAN DEFAULT 1,
+            serves_lunch BOOLEAN DEFAULT 1,
+            serves_dinner BOOLEAN DEFAULT 1
+        )
+    ''')
+
+    # Create menus table (linked to restaurants)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS menus (
+            menu_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            restaurant_id INTEGER,
+            item_name TEXT NOT NULL,
+            price REAL NOT NULL,
+            FOREIGN KEY (restaurant_id) REFERENCES restaurants (restaurant_id)
+        )
+    ''')
+
+    # Create orders table (linked to users, restaurants, and riders)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS orders (
+            order_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            restaurant_id INTEGER,
+            rider_id INTEGER,
+            items TEXT NOT NULL,
+            total_price REAL NOT NULL,
+            status TEXT DEFAULT 'pending',
+            order_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            estimated_delivery_time INTEGER,
+            delivery_location TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (user_id),
+            FOREIGN KEY (restaurant_id) REFERENCES restaurants (restaurant_id),
+            FOREIGN KEY (rider_id) REFERENCES riders (rider_id)
+        )
+    ''')
+
+    # Create notifications table (linked to users and orders)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS notifications (
+            notification_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            order_id INTEGER,
+            message TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id),
+            FOREIGN KEY (order_id) REFERENCES orders (order_id)
+        )
+    ''')
+
+    # Create indexes for performance improvement
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders (user_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_rider_id ON orders (rider_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_menus_restaurant_id ON menus (restaurant_id)')
+
+
+def _history_indexes(cursor):
+    """Composite indexes so each keyset page of order history and notifications is one range scan."""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_orders_user_time
+        ON orders (user_id, order_time DESC, order_id DESC)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_orders_rider_time
+        ON orders (rider_id, order_time DESC, order_id DESC)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_notifications_user_time
+        ON notifications (user_id, created_at DESC, notification_id DESC)
+    ''')
+    # The single-column indexes are prefixes of the composite ones
+    cursor.execute('DROP INDEX IF EXISTS idx_orders_user_id')
+    cursor.execute('DROP INDEX IF EXISTS idx_orders_rider_id')
+
+
+def _parse_legacy_items(items: str) -> list:
+    """
+    Split an orders.items blob into (item_name, price) pairs.
+
+    Orders placed through /api/orders stored a JSON list of {"name", "price"}
+    objects; orders placed through OrderService stored comma-joined names.
+    """
+    try:
+        parsed = json.loads(items)
+    except (TypeError, ValueError):
+        parsed = None
+    if isinstance(parsed, list):
+        return [(str(item.get('name') or item.get('item_name') or ''), item.get('price'))
+                for item in parsed if isinstance(item, dict)]
+    return [(name.strip(), None) for name in (items or '').split(',') if name.strip()]
+
+
+INSERT_ORDER_ITEM = '''
+    INSERT INTO order_items (order_id, menu_id, item_name, quantity, unit_price)
+    VALUES (?, ?, ?, ?, ?)
+'''
+
+
+def _order_items(cursor):
+    """Normalized order lines, backfilled from the orders.items text column."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS order_items (
+            order_item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER NOT NULL,
+            menu_id INTEGER,
+            item_name TEXT NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 1,
+            unit_price REAL NOT NULL,
+            FOREIGN KEY (order_id) REFERENCES orders (order_id),
+            FOREIGN KEY (menu_id) REFERENCES menus (menu_id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_order_items_order_id ON order_items (order_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_order_items_menu_id ON order_items (menu_id)')
+
+    # Backfill in restaurant order so each restaurant's menu is loaded once
+    read = cursor.connection.cursor()
+    read.execute('''
+        SELECT order_id, restaurant_id, items FROM orders
+        WHERE order_id NOT IN (SELECT order_id FROM order_items)
+        ORDER BY restaurant_id
+    ''')
+    menu_restaurant, menu = None, {}
+    batch = []
+    for order_id, restaurant_id, items in read:
+        if restaurant_id != menu_restaurant:
+            menu_restaurant = restaurant_id
+            menu = {name: (menu_id, price) for menu_id, name, price in cursor.execute(
+                "SELECT menu_id, item_name, price FROM menus WHERE restaurant_id = ?", (restaurant_id,)
+            ).fetchall()}
+        lines = {}
+        for name, price in _parse_legacy_items(items):
+            menu_id, menu_price = menu.get(name, (None, None))
+            unit_price = price if price is not None else (menu_price or 0)
+            key = (menu_id, name, unit_price)
+            lines[key] = lines.get(key, 0) + 1
+        batch.extend((order_id, menu_id, name, quantity, unit_price)
+                     for (menu_id, name, unit_price), quantity in lines.items())
+        if len(batch) >= 10000:
+            cursor.executemany(INSERT_ORDER_ITEM, batch)
+            batch = []
+    read.close()
+    if batch:
+        cursor.executemany(INSERT_ORDER_ITEM, batch)
+
+
+def _coordinates(cursor):
+    """lat/lon columns on riders, restaurants and users, geocoded from the location text."""
+    for table, key in (('riders', 'rider_id'), ('restaurants', 'restaurant_id'), ('users', 'user_id')):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN lat REAL")
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN lon REAL")
+        # Batches in key order: rows are never updated under an open SELECT
+        last = 0
+        while True:
+            rows = cursor.execute(
+                f"SELECT {key}, location FROM {table} WHERE {key} > ? ORDER BY {key} LIMIT 10000", (last,)
+            ).fetchall()
+            if not rows:
+                break
+            cursor.executemany(f"UPDATE {table} SET lat = ?, lon = ? WHERE {key} = ?",
+                               [geocode(location) + (row_id,) for row_id, location in rows])
+            last = rows[-1][0]
+
+
+def _dispatch_indexes(cursor):
+    """Partial indexes over the few orders that dispatch and rider load checks look at."""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_orders_pending
+        ON orders (order_id) WHERE status = 'pending'
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_orders_rider_active
+        ON orders (rider_id) WHERE status IN ('assigned', 'in_progress')
+    ''')
+
+
+def _data_versions(cursor):
+    """Change counters shared by every worker process, used to build ETags."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            key TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    # Random per-database epoch, so tags never match across databases even
+    # where their counters happen to agree
+    cursor.execute("INSERT OR IGNORE INTO data_versions (key, version) VALUES ('epoch', ?)",
+                   (secrets.randbits(48),))
+
+
+def _order_lifecycle(cursor):
+    """
+    Order lifecycle statuses and the rider / restaurant counters they drive.
+
+    Statuses written before the lifecycle map onto it (placed -> pending,
+    in_progress -> picked_up, completed -> delivered); any other value that
+    is not a lifecycle status was a free-form write and becomes cancelled.
+    The statuses below are frozen copies of models.order_status as of this
+    migration.
+    """
+    active, open_ = "'assigned', 'picked_up'", "'pending', 'assigned', 'picked_up'"
+    cursor.execute('''
+        UPDATE orders SET status = CASE
+            WHEN status = 'placed' AND rider_id IS NOT NULL THEN 'assigned'
+            WHEN status = 'placed' THEN 'pending'
+            WHEN status = 'in_progress' THEN 'picked_up'
+            WHEN status = 'completed' THEN 'delivered'
+            ELSE 'cancelled'
+        END
+        WHERE status IS NULL
+        OR status NOT IN ('pending', 'assigned', 'picked_up', 'delivered', 'cancelled')
+    ''')
+
+    cursor.execute("ALTER TABLE riders ADD COLUMN active_orders INTEGER NOT NULL DEFAULT 0")
+    cursor.execute("ALTER TABLE restaurants ADD COLUMN open_orders INTEGER NOT NULL DEFAULT 0")
+    cursor.execute(f'''
+        UPDATE riders SET active_orders = counts.n
+        FROM (SELECT rider_id, COUNT(*) AS n FROM orders
+              WHERE rider_id IS NOT NULL AND status IN ({active}) GROUP BY rider_id) AS counts
+        WHERE counts.rider_id = riders.rider_id
+    ''')
+    cursor.execute(f'''
+        UPDATE restaurants SET open_orders = counts.n
+        FROM (SELECT restaurant_id, COUNT(*) AS n FROM orders
+              WHERE status IN ({open_}) GROUP BY restaurant_id) AS counts
+        WHERE counts.restaurant_id = restaurants.restaurant_id
+    ''')
+
+    # Keep the counters in step with every write to orders. Each trigger only
+    # fires for rows that enter or leave a counted status, so bulk loads of
+    # finished orders pay nothing.
+    for name, event, when, body in (
+        ('rider_load_insert', 'INSERT', f"NEW.status IN ({active})",
+         "UPDATE riders SET active_orders = active_orders + 1 WHERE rider_id = NEW.rider_id;"),
+        ('rider_load_delete', 'DELETE', f"OLD.status IN ({active})",
+         "UPDATE riders SET active_orders = active_orders - 1 WHERE rider_id = OLD.rider_id;"),
+        ('rider_load_update', 'UPDATE OF status, rider_id',
+         f"OLD.status IN ({active}) OR NEW.status IN ({active})",
+         f"UPDATE riders SET active_orders = active_orders - 1"
+         f" WHERE rider_id = OLD.rider_id AND OLD.status IN ({active});"
+         f" UPDATE riders SET active_orders = active_orders + 1"
+         f" WHERE rider_id = NEW.rider_id AND NEW.status IN ({active});"),
+        ('restaurant_open_insert', 'INSERT', f"NEW.status IN ({open_})",
+         "UPDATE restaurants SET open_orders = open_orders + 1 WHERE restaurant_id = NEW.restaurant_id;"),
+        ('restaurant_open_delete', 'DELETE', f"OLD.status IN ({open_})",
+         "UPDATE restaurants SET open_orders = open_orders - 1 WHERE restaurant_id = OLD.restaurant_id;"),
+        ('restaurant_open_update', 'UPDATE OF status, restaurant_id',
+         f"OLD.status IN ({open_}) OR NEW.status IN ({open_})",
+         f"UPDATE restaurants SET open_orders = open_orders - 1"
+         f" WHERE restaurant_id = OLD.restaurant_id AND OLD.status IN ({open_});"
+         f" UPDATE restaurants SET open_orders = open_orders + 1"
+         f" WHERE restaurant_id = NEW.restaurant_id AND NEW.status IN ({open_});"),
+    ):
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON orders "
+                       f"WHEN {when} BEGIN {body} END")
+
+    # Rider load checks read the counter now; pending orders keep their index
+    cursor.execute('DROP INDEX IF EXISTS idx_orders_rider_active')
+
+
+def _search_index(cursor):
+    """
+    FTS5 full-text index over dishes and restaurants.
+
+    One document per menu item (rowid = menu_id) and one per restaurant
+    (rowid = -restaurant_id). A dish document carries its restaurant's name
+    and cuisine, so "margherita napoli" finds the dish at that restaurant.
+    Triggers keep it in step with every write to menus and restaurants.
+    """
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+            name, restaurant, food_type, restaurant_id UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    ''')
+    # Rank with bm25 weighted towards the document's own name
+    cursor.execute("INSERT INTO search_index (search_index, rank) VALUES ('rank', 'bm25(10.0, 4.0, 2.0)')")
+    cursor.execute('''
+        INSERT INTO search_index (rowid, name, restaurant, food_type, restaurant_id)
+        SELECT -restaurant_id, name, '', food_type, restaurant_id FROM restaurants
+    ''')
+    cursor.execute('''
+        INSERT INTO search_index (rowid, name, restaurant, food_type, restaurant_id)
+        SELECT m.menu_id, m.item_name, r.name, r.food_type, r.restaurant_id
+        FROM menus m JOIN restaurants r ON r.restaurant_id = m.restaurant_id
+    ''')
+
+    add_dish = ('''INSERT INTO search_index (rowid, name, restaurant, food_type, restaurant_id)
+                   SELECT NEW.menu_id, NEW.item_name, r.name, r.food_type, r.restaurant_id
+                   FROM restaurants r WHERE r.restaurant_id = NEW.restaurant_id;''')
+    add_restaurant = ('''INSERT INTO search_index (rowid, name, restaurant, food_type, restaurant_id)
+                         VALUES (-NEW.restaurant_id, NEW.name, '', NEW.food_type, NEW.restaurant_id);''')
+    for name, table, event, body in (
+        ('search_menu_insert', 'menus', 'INSERT', add_dish),
+        ('search_menu_delete', 'menus', 'DELETE', "DELETE FROM search_index WHERE rowid = OLD.menu_id;"),
+        ('search_menu_update', 'menus', 'UPDATE OF item_name, restaurant_id',
+         "DELETE FROM search_index WHERE rowid = OLD.menu_id; " + add_dish),
+        ('search_restaurant_insert', 'restaurants', 'INSERT', add_restaurant),
+        ('search_restaurant_delete', 'restaurants', 'DELETE',
+         "DELETE FROM search_index WHERE rowid = -OLD.restaurant_id;"),
+        # Renaming a restaurant or changing its cuisine rewrites its dishes too;
+        # they are found through idx_menus_restaurant_id, not a scan
+        ('search_restaurant_update', 'restaurants', 'UPDATE OF name, food_type',
+         "DELETE FROM search_index WHERE rowid = -OLD.restaurant_id; " + add_restaurant +
+         " UPDATE search_index SET restaurant = NEW.name, food_type = NEW.food_type"
+         " WHERE rowid IN (SELECT menu_id FROM menus WHERE restaurant_id = NEW.restaurant_id);"),
+    ):
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table} BEGIN {body} END")
+
+
+def _idempotency_keys(cursor):
+    """
+    Responses of requests sent with an Idempotency-Key, for replaying retries.
+
+    A row with a NULL status is a request still in flight. Rows are purged
+    once they are older than the TTL, oldest first through the created_at
+    index.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            key TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            status INTEGER,
+            content_type TEXT,
+            body BLOB,
+            created_at REAL NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys (created_at)')
+
+
+def _order_intake(cursor):
+    """
+    Asynchronous order intake: find the orders still waiting for a worker, and
+    record why an order was rejected.
+
+    'received' and 'rejected' are new statuses, so no existing order changes;
+    neither is counted by the open_orders triggers of migration 7.
+    """
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_orders_received
+        ON orders (order_id) WHERE status = 'received'
+    ''')
+    cursor.execute("ALTER TABLE orders ADD COLUMN rejection_reason TEXT")
+
+
+def _idempotency_leases(cursor):
+    """
+    In-flight lease of idempotency claims.
+
+    claimed_at is renewed while the claiming request runs, so a claim whose
+    request died can be taken over long before the key expires.
+    """
+    cursor.execute("ALTER TABLE idempotency_keys ADD COLUMN claimed_at REAL")
+    cursor.execute("UPDATE idempotency_keys SET claimed_at = created_at")
+
+
+def _intake_attempts(cursor):
+    """
+    Failed intake attempts per order, kept across retries, sweeps and
+    restarts so an order that can never be processed is eventually rejected.
+    """
+    cursor.execute("ALTER TABLE orders ADD COLUMN intake_attempts INTEGER NOT NULL DEFAULT 0")
+
+
+# Ordered list of (version, description, apply). Never edit or reorder an
+# entry that has shipped; append a new one instead.
+MIGRATIONS = [
+    (1, "baseline schema", _baseline_schema),
+    (2, "order history and notification keyset indexes", _history_indexes),
+    (3, "normalized order_items table", _order_items),
+    (4, "latitude and longitude columns", _coordinates),
+    (5, "pending order and active rider load indexes", _dispatch_indexes),
+    (6, "shared data version counters", _data_versions),
+    (7, "order lifecycle statuses with rider and restaurant counters", _order_lifecycle),
+    (8, "full-text search index over dishes and restaurants", _search_index),
+    (9, "idempotency keys with stored responses", _idempotency_keys),
+    (10, "received order index and rejection reasons for asynchronous intake", _order_intake),
+    (11, "in-flight leases for idempotency keys", _idempotency_leases),
+    (12, "failed intake attempt counts", _intake_attempts),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(conn: sqlite3.Connection) -> int:
+    """Return the schema version recorded in the database."""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection, target: int = LATEST_VERSION) -> list:
+    """
+    Apply pending migrations up to the target version.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the database to upgrade
+        target (int): Version to migrate to (defaults to the latest)
+
+    Returns:
+        list: (version, description) of each migration applied, empty if
+            the schema was already current
+
+    Raises:
+        sqlite3.Error: If a migration fails; the database is left at the
+            version it had before the call
+    """
+    # Fast path for an already migrated database: a single header read
+    if get_version(conn) >= target:
+        return []
+
+    applied = []
+    cursor = conn.cursor()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Another process may have migrated while we waited for the lock
+        current = get_version(conn)
+        for version, description, apply in MIGRATIONS:
+            if current < version <= target:
+                apply(cursor)
+                applied.append((version, description))
+                current = version
+        cursor.execute(f"PRAGMA user_version = {int(current)}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return applied
@@ -0,0 +1,89 @@
+import threading
+
+# Maximum number of bound parameters per IN (...) query
+BATCH_SIZE = 500
+
+_scope = threading.local()
+
+
+class IdentityMap:
+    """
+    Per-request cache of loaded model objects, keyed by model name and primary key.
+
+    Repeated lookups of the same row within one request are served from
+    memory, and batch loaders only query for the keys not seen yet.
+    """
+
+    def __init__(self):
+        self._objects = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind: str, key):
+        """Return the cached object or None. Cached misses are stored as None too."""
+        found = self._objects.get((kind, key))
+        if (kind, key) in self._objects:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return found
+
+    def contains(self, kind: str, key) -> bool:
+        return (kind, key) in self._objects
+
+    def put(self, kind: str, key, obj):
+        self._objects[(kind, key)] = obj
+
+    def discard(self, kind: str, key):
+        self._objects.pop((kind, key), None)
+
+
+def begin_scope() -> IdentityMap:
+    """Start an identity map for the current thread (e.g. at the start of a request)."""
+    _scope.current = IdentityMap()
+    return _scope.current
+
+
+def end_scope():
+    """Drop the current thread's identity map."""
+    _scope.current = None
+
+
+def current() -> IdentityMap:
+    """Return the active identity map, or None outside a request scope."""
+    return getattr(_scope, 'current', None)
+
+
+def load_many(kind: str, keys, fetch) -> dict:
+    """
+    Load objects by primary key through the identity map.
+
+    Args:
+        kind (str): Model name used as the cache namespace
+        keys (iterable): Primary keys to load; duplicates and None are ignored
+        fetch (callable): fetch(list_of_keys) -> dict of key to object, called
+            in chunks of at most BATCH_SIZE keys for the keys not cached yet
+
+    Returns:
+        dict: Mapping of key to object for every key that exists
+    """
+    identity_map = current()
+    wanted = {key for key in keys if key is not None}
+    found = {}
+    missing = []
+    for key in wanted:
+        if identity_map is not None and identity_map.contains(kind, key):
+            obj = identity_map.get(kind, key)
+            if obj is not None:
+                found[key] = obj
+        else:
+            missing.append(key)
+
+    for start in range(0, len(missing), BATCH_SIZE):
+        chunk = missing[start:start + BATCH_SIZE]
+        loaded = fetch(chunk)
+        found.update(loaded)
+        if identity_map is not None:
+            for key in chunk:
+                identity_map.put(kind, key, loaded.get(key))
+    return found
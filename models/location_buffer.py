@@ -0,0 +1,177 @@
+"""
+Write-behind buffer for rider location pings.
+
+Riders report their position every few seconds; writing each ping with its
+own UPDATE and commit costs an fsync per ping. Pings posted to the batch
+endpoint are instead kept here, one entry per rider (last write wins, so a
+rider pinging ten times between flushes is written once), and applied to
+the rider registry right away so matching sees the fresh position. A
+flusher thread writes the buffer to SQLite with one executemany every
+LOCATION_FLUSH_SECONDS, or as soon as LOCATION_FLUSH_SIZE riders are
+waiting, which bounds how far the database lags behind the registry.
+
+A ping still in the buffer is lost if the process dies; the window is at
+most LOCATION_FLUSH_SECONDS. Pending pings are flushed at interpreter exit.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+
+from cache import touch_many
+from db import on_configure_pool, submit_write
+from geo import resolve
+from models import rider_registry
+
+logger = logging.getLogger(__name__)
+
+LOCATION_FLUSH_SECONDS = float(os.environ.get('LOCATION_FLUSH_SECONDS', '1'))
+LOCATION_FLUSH_SIZE = int(os.environ.get('LOCATION_FLUSH_SIZE', '5000'))
+
+
+class LocationBuffer:
+    """Per-rider latest position awaiting a flush; see the module docstring."""
+
+    def __init__(self, flush_seconds: float = LOCATION_FLUSH_SECONDS, flush_size: int = LOCATION_FLUSH_SIZE):
+        self.flush_seconds = flush_seconds
+        self.flush_size = flush_size
+        self._lock = threading.Lock()
+        # Serializes flushes, so an older batch never commits after a newer one
+        self._flush_lock = threading.Lock()
+        self._pending = {}
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.received = 0
+        self.written = 0
+        self.flushes = 0
+        self.last_flush_ms = 0.0
+
+    def put(self, rider_id: int, location: str = None, lat=None, lon=None):
+        """
+        Record a rider's latest position.
+
+        Args:
+            rider_id (int): Rider's ID
+            location (str, optional): Location text; kept as is if omitted
+            lat (float, optional): Latitude; geocoded from location if omitted
+            lon (float, optional): Longitude; geocoded from location if omitted
+
+        Raises:
+            ValueError: If neither a location nor coordinates are given, or
+                the coordinates are invalid
+        """
+        if not location and (lat is None or lon is None):
+            raise ValueError("A location or lat and lon are required")
+        lat, lon = resolve(location, lat, lon)
+        with self._lock:
+            self._pending[rider_id] = (location or None, lat, lon)
+            self.received += 1
+            full = len(self._pending) >= self.flush_size
+        fields = {'lat': lat, 'lon': lon}
+        if location:
+            fields['location'] = location
+        rider_registry.registry.update(rider_id, **fields)
+        self.start()
+        if full:
+            self._wake.set()
+
+    def get(self, rider_id: int):
+        """Buffered (location, lat, lon) of a rider, or None if nothing is pending."""
+        return self._pending.get(rider_id)
+
+    def discard(self, rider_id: int):
+        """Drop a rider's pending ping, e.g. because a newer position is written directly."""
+        with self._lock:
+            self._pending.pop(rider_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._pending.clear()
+
+    def flush(self) -> int:
+        """
+        Write every pending ping to the database as one operation of the writer thread.
+
+        Returns:
+            int: Number of riders written
+
+        Raises:
+            sqlite3.Error: If the write fails; the pings stay buffered unless
+                a newer ping for the same rider arrived meanwhile
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            started = time.perf_counter()
+            def write(cursor):
+                cursor.executemany(
+                    "UPDATE riders SET location = COALESCE(?, location), lat = ?, lon = ? WHERE rider_id = ?",
+                    [(location, lat, lon, rider_id) for rider_id, (location, lat, lon) in pending.items()]
+                )
+                touch_many(('rider', rider_id) for rider_id in pending)
+
+            try:
+                submit_write(write)
+            except Exception:
+                with self._lock:
+                    for rider_id, ping in pending.items():
+                        self._pending.setdefault(rider_id, ping)
+                raise
+            self.written += len(pending)
+            self.flushes += 1
+            self.last_flush_ms = (time.perf_counter() - started) * 1000
+            return len(pending)
+
+    def start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='location-flusher', daemon=True)
+                    self._thread.start()
+
+    def stop(self):
+        """Stop the flusher thread after a last flush."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._stop.clear()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Location flush failed")
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "received": self.received,
+            "written": self.written,
+            "flushes": self.flushes,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "flush_seconds": self.flush_seconds,
+            "flush_size": self.flush_size
+        }
+
+
+buffer = LocationBuffer()
+
+# Pings for the previous database cannot be written to a new one
+on_configure_pool(buffer.clear)
+
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        buffer.flush()
+    except Exception:
+        logger.exception("Location flush at exit failed")
@@ -0,0 +1,259 @@
+"""
+In-memory index of restaurant opening hours and meal service.
+
+The day is cut into segments at every distinct opening and closing minute;
+each segment holds a bitset (a Python int, bit i = restaurant i) of the
+restaurants open during it, and each meal period has a bitset of the
+restaurants serving it. Finding who is open is a bisect for the current
+segment plus one AND of two bitsets; a search then walks the set bits from a
+keyset cursor and stops after one page, so it only builds rows for that
+page rather than for every restaurant serving the meal.
+
+Opening hours are the same every day (the schema has no weekday), so the
+buckets are minutes of the day. A window whose closing time is earlier than
+its opening time runs past midnight, e.g. 18:00-03:00.
+"""
+from bisect import bisect_right
+import threading
+import time
+
+from db import db_cursor
+
+MINUTES_PER_DAY = 24 * 60
+MEALS = ('breakfast', 'lunch', 'dinner')
+
+# Hours changed by another worker process show up here after at most this long
+OPEN_HOURS_TTL = 300
+
+
+def minute_of_day(value: str) -> int:
+    """
+    Parse 'HH:MM' or 'HH:MM:SS' into minutes since midnight.
+
+    Raises:
+        ValueError: If the value is not a valid time of day
+    """
+    try:
+        parts = [int(part) for part in str(value).split(':')]
+    except ValueError:
+        raise ValueError(f"Invalid time of day: {value!r}")
+    if len(parts) not in (2, 3) or not 0 <= parts[0] < 24 or not 0 <= parts[1] < 60:
+        raise ValueError(f"Invalid time of day: {value!r}")
+    return parts[0] * 60 + parts[1]
+
+
+def open_windows(opening_time: str, closing_time: str) -> list:
+    """
+    Half-open [start, end) minute ranges during which a restaurant is open.
+
+    Equal opening and closing times mean open around the clock.
+    """
+    start, end = minute_of_day(opening_time), minute_of_day(closing_time)
+    if start < end:
+        return [(start, end)]
+    if start == end:
+        return [(0, MINUTES_PER_DAY)]
+    windows = [(start, MINUTES_PER_DAY)]
+    if end > 0:
+        windows.append((0, end))
+    return windows
+
+
+def _bitset(ids) -> int:
+    """Build a bitset with the given restaurant ids set."""
+    ids = list(ids)
+    if not ids:
+        return 0
+    buf = bytearray(max(ids) // 8 + 1)
+    for i in ids:
+        buf[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(buf, 'little')
+
+
+def is_member(bits: int, restaurant_id: int) -> bool:
+    """Whether a restaurant's bit is set in a bitset."""
+    return bool(bits >> restaurant_id & 1)
+
+
+_WINDOW_BITS = 512
+_WINDOW_MASK = (1 << _WINDOW_BITS) - 1
+
+
+def _members(bits: int, start: int = 0, count: int = None, flags: int = 0) -> list:
+    """
+    Ids set in a bitset, ascending, from start on and at most count of them.
+
+    Returns:
+        list: (id, bit of flags at id) tuples
+    """
+    found = []
+    # Work through small windows of the bitset so each step shifts a few
+    # machine words rather than the whole int
+    while bits >> start and (count is None or len(found) < count):
+        window = (bits >> start) & _WINDOW_MASK
+        window_flags = (flags >> start) & _WINDOW_MASK
+        while window and (count is None or len(found) < count):
+            low = window & -window
+            offset = low.bit_length() - 1
+            found.append((start + offset, 1 if window_flags & low else 0))
+            window ^= low
+        start += _WINDOW_BITS
+    return found
+
+
+class OpenHoursIndex:
+    """Thread-safe open-hours index; see the module docstring."""
+
+    def __init__(self, ttl: float = OPEN_HOURS_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._rows = {}
+        self._windows = {}
+        self._starts = [0]
+        self._open = [0]
+        self._serves = dict.fromkeys(MEALS, 0)
+        self._loaded_at = None
+
+    def rebuild(self, rows):
+        """
+        Replace the index contents with the given restaurant rows.
+
+        Args:
+            rows (iterable): Mappings with at least restaurant_id,
+                opening_time, closing_time and the serves_* flags
+        """
+        records, windows = {}, {}
+        opening_at, closing_at = {}, {}
+        serving = {meal: [] for meal in MEALS}
+        for row in rows:
+            row = dict(row)
+            restaurant_id = row['restaurant_id']
+            records[restaurant_id] = row
+            windows[restaurant_id] = open_windows(row['opening_time'], row['closing_time'])
+            for start, end in windows[restaurant_id]:
+                opening_at.setdefault(start, []).append(restaurant_id)
+                closing_at.setdefault(end, []).append(restaurant_id)
+            for meal in MEALS:
+                if row[f'serves_{meal}']:
+                    serving[meal].append(restaurant_id)
+
+        # Sweep the day once, closing before opening at each boundary since
+        # the windows are half-open
+        starts = sorted({0} | {m for m in opening_at} | {m for m in closing_at if m < MINUTES_PER_DAY})
+        open_bits, current = [], 0
+        for minute in starts:
+            current = (current & ~_bitset(closing_at.get(minute, ()))) | _bitset(opening_at.get(minute, ()))
+            open_bits.append(current)
+
+        with self._lock:
+            self._rows = records
+            self._windows = windows
+            self._starts = starts
+            self._open = open_bits
+            self._serves = {meal: _bitset(ids) for meal, ids in serving.items()}
+            self._loaded_at = time.monotonic()
+
+    def _split(self, minute: int):
+        """Make minute a segment start. Caller holds the lock."""
+        if minute >= MINUTES_PER_DAY:
+            return
+        i = bisect_right(self._starts, minute) - 1
+        if self._starts[i] != minute:
+            self._starts.insert(i + 1, minute)
+            self._open.insert(i + 1, self._open[i])
+
+    def _mark(self, restaurant_id: int, windows: list, is_open: bool):
+        """Set or clear a restaurant's bit over its windows. Caller holds the lock."""
+        bit = 1 << restaurant_id
+        for start, end in windows:
+            i = bisect_right(self._starts, start) - 1
+            while i < len(self._starts) and self._starts[i] < end:
+                self._open[i] = self._open[i] | bit if is_open else self._open[i] & ~bit
+                i += 1
+
+    def put(self, row):
+        """Add a restaurant, or re-index one whose hours or meals changed."""
+        row = dict(row)
+        restaurant_id = row['restaurant_id']
+        windows = open_windows(row['opening_time'], row['closing_time'])
+        bit = 1 << restaurant_id
+        with self._lock:
+            self._mark(restaurant_id, self._windows.get(restaurant_id, []), False)
+            for start, end in windows:
+                self._split(start)
+                self._split(end)
+            self._mark(restaurant_id, windows, True)
+            for meal in MEALS:
+                if row[f'serves_{meal}']:
+                    self._serves[meal] |= bit
+                else:
+                    self._serves[meal] &= ~bit
+            self._rows[restaurant_id] = row
+            self._windows[restaurant_id] = windows
+
+    def is_stale(self) -> bool:
+        return self._loaded_at is None or time.monotonic() - self._loaded_at >= self.ttl
+
+    def serving(self, meal: str, minute: int, limit: int = None, after: int = None,
+                open_only: bool = False) -> list:
+        """
+        Restaurants serving a meal, flagged with whether they are open at a minute.
+
+        Args:
+            meal (str): 'breakfast', 'lunch' or 'dinner'
+            minute (int): Minute of the day, 0-1439
+            limit (int, optional): Maximum number of restaurants to return
+            after (int, optional): Only return restaurants with a higher id
+            open_only (bool): Only return restaurants open at minute
+
+        Returns:
+            list: Restaurant rows in id order, each with is_open and
+                serves_current_meal added
+        """
+        with self._lock:
+            serving = self._serves[meal]
+            open_now = self._open[bisect_right(self._starts, minute) - 1] & serving
+            rows = self._rows
+        start = 0 if after is None else after + 1
+        restaurants = []
+        for restaurant_id, is_open in _members(open_now if open_only else serving, start, limit, open_now):
+            row = dict(rows[restaurant_id])
+            row['is_open'] = is_open
+            row['serves_current_meal'] = 1
+            restaurants.append(row)
+        return restaurants
+
+    def open_at(self, minute: int, meal: str = None) -> int:
+        """
+        Bitset of the restaurants open at a minute, and serving meal if given.
+
+        Test a restaurant with is_member(bits, restaurant_id).
+        """
+        with self._lock:
+            bits = self._open[bisect_right(self._starts, minute) - 1]
+            return bits & self._serves[meal] if meal else bits
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "restaurants": len(self._rows),
+                "segments": len(self._starts),
+                "age_seconds": round(time.monotonic() - self._loaded_at, 1) if self._loaded_at else None
+            }
+
+
+index = OpenHoursIndex()
+
+
+def refresh():
+    """Rebuild the index from the restaurants table."""
+    with db_cursor() as cursor:
+        cursor.execute("SELECT * FROM restaurants ORDER BY restaurant_id")
+        index.rebuild(cursor.fetchall())
+
+
+def get_index() -> OpenHoursIndex:
+    """Return the index, rebuilding it first if it was never loaded or its TTL ran out."""
+    if index.is_stale():
+        refresh()
+    return index
@@ -1,4 +1,9 @@
 import sqlite3
+from cache import touch
+from db import db_cursor, submit_write
+from event_bus import publish_order_event
+from models import rider_registry
+from models.order_status import DELIVERED, MANAGED_STATUSES, PENDING, InvalidTransition, check_transition
 from datetime import datetime
 
 class Order:
@@ -13,7 +18,7 @@ class Order:
             rider_id (int): ID of the assigned rider (or None)
             items (str): Comma-separated list of item names
             total_price (float): Total price of the order
-            status (str): Order status (e.g., 'placed', 'assigned')
+            status (str): Order status (see models.order_status)
             order_time (str): Timestamp of when the order was placed
         """
         self.order_id = order_id
@@ -26,7 +31,7 @@ class Order:
         self.order_time = order_time
 
     @staticmethod
-    def place_order(user_id, restaurant_id, items, total_price):
+    def place_order(user_id, restaurant_id, items, total_price, line_items=None, status=PENDING):
         """
         Create a new order in the database.
 
@@ -35,6 +40,11 @@ class Order:
             restaurant_id (int): ID of the restaurant
             items (str): Comma-separated list of item names
             total_price (float): Total price of the order
+            line_items (list, optional): Order lines for order_items, each a dict
+                with menu_id, item_name, quantity and unit_price; written in the
+                same transaction as the order
+            status (str, optional): Initial status; orders start 'pending'
+                until a rider is assigned
 
         Returns:
             Order: Newly created Order object
@@ -48,102 +58,176 @@ class Order:
 
         try:
             now = datetime.now()
-            with sqlite3.connect('food_delivery.db') as conn:
-                cursor = conn.cursor()
+            with db_cursor() as cursor:
                 cursor.execute(
                     """
                     INSERT INTO orders (user_id, restaurant_id, items, total_price, status, order_time)
                     VALUES (?, ?, ?, ?, ?, ?)
                     """,
-                    (user_id, restaurant_id, items, total_price, 'placed', now)
+                    (user_id, restaurant_id, items, total_price, status, now)
                 )
-                conn.commit()
                 order_id = cursor.lastrowid
-                return Order(order_id, user_id, restaurant_id, None, items, total_price, 'placed', now)
+                if line_items:
+                    Order.add_items(order_id, line_items)
+                publish_order_event(order_id, status, user_id=user_id, restaurant_id=restaurant_id)
+                return Order(order_id, user_id, restaurant_id, None, items, total_price, status, now)
         except sqlite3.Error as e:
             raise sqlite3.Error(f"Database error: {str(e)}")
 
     @staticmethod
-    def get_user_orders(user_id):
+    def add_items(order_id, line_items):
         """
-        Retrieve all orders for a user.
+        Record the lines of an order in order_items.
 
         Args:
-            user_id (int): User's ID
-
-        Returns:
-            list: List of Order objects
+            order_id (int): Order's ID
+            line_items (list): Dicts with menu_id (or None), item_name,
+                quantity and unit_price
         """
         try:
-            with sqlite3.connect('food_delivery.db') as conn:
-                cursor = conn.cursor()
-                cursor.execute(
+            with db_cursor() as cursor:
+                cursor.executemany(
                     """
-                    SELECT o.order_id, o.user_id, o.restaurant_id, o.rider_id, o.items,
-                           o.total_price, o.status, o.order_time
-                    FROM orders o
-                    WHERE o.user_id = ?
+                    INSERT INTO order_items (order_id, menu_id, item_name, quantity, unit_price)
+                    VALUES (?, ?, ?, ?, ?)
                     """,
-                    (user_id,)
+                    [(order_id, line.get('menu_id'), line['item_name'], line.get('quantity', 1), line['unit_price'])
+                     for line in line_items]
                 )
-                results = cursor.fetchall()
-                return [Order(*result) for result in results]
         except sqlite3.Error as e:
             raise sqlite3.Error(f"Database error: {str(e)}")
 
     @staticmethod
-    def get_rider_orders(rider_id):
+    def get_items(order_ids):
         """
-        Retrieve all orders assigned to a rider.
+        Retrieve the lines of several orders with one indexed query.
 
         Args:
-            rider_id (int): Rider's ID
+            order_ids (iterable): Order IDs
 
         Returns:
-            list: List of Order objects
+            dict: Mapping of order_id to a list of line dicts
         """
+        order_ids = list({order_id for order_id in order_ids if order_id is not None})
+        lines = {order_id: [] for order_id in order_ids}
+        if not order_ids:
+            return lines
+        placeholders = ','.join('?' for _ in order_ids)
         try:
-            with sqlite3.connect('food_delivery.db') as conn:
-                cursor = conn.cursor()
+            with db_cursor() as cursor:
                 cursor.execute(
-                    """
-                    SELECT o.order_id, o.user_id, o.restaurant_id, o.rider_id, o.items,
-                           o.total_price, o.status, o.order_time
-                    FROM orders o
-                    WHERE o.rider_id = ?
+                    f"""
+                    SELECT order_id, menu_id, item_name, quantity, unit_price
+                    FROM order_items
+                    WHERE order_id IN ({placeholders})
+                    ORDER BY order_item_id
                     """,
-                    (rider_id,)
+                    order_ids
                 )
+                for row in cursor.fetchall():
+                    lines[row['order_id']].append({
+                        "menu_id": row['menu_id'],
+                        "item_name": row['item_name'],
+                        "quantity": row['quantity'],
+                        "unit_price": row['unit_price']
+                    })
+                return lines
+        except sqlite3.Error as e:
+            raise sqlite3.Error(f"Database error: {str(e)}")
+
+    @staticmethod
+    def _history(column, value, limit=None, after=None):
+        """
+        Newest-first orders where `column` equals `value`, optionally one keyset page.
+
+        Served by the (column, order_time DESC, order_id DESC) indexes, so every
+        page is a single index range scan however deep the client pages.
+        """
+        sql = f"""
+            SELECT o.order_id, o.user_id, o.restaurant_id, o.rider_id, o.items,
+                   o.total_price, o.status, o.order_time
+            FROM orders o
+            WHERE o.{column} = ?
+        """
+        params = [value]
+        if after:
+            sql += " AND (o.order_time, o.order_id) < (?, ?)"
+            params.extend(after)
+        sql += " ORDER BY o.order_time DESC, o.order_id DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        try:
+            with db_cursor() as cursor:
+                cursor.execute(sql, params)
                 results = cursor.fetchall()
                 return [Order(*result) for result in results]
         except sqlite3.Error as e:
             raise sqlite3.Error(f"Database error: {str(e)}")
 
+    @staticmethod
+    def get_user_orders(user_id, limit=None, after=None):
+        """
+        Retrieve a user's orders, newest first.
+
+        Args:
+            user_id (int): User's ID
+            limit (int, optional): Maximum number of orders to return
+            after (tuple, optional): (order_time, order_id) of the last order on the previous page
+
+        Returns:
+            list: List of Order objects
+        """
+        return Order._history('user_id', user_id, limit, after)
+
+    @staticmethod
+    def get_rider_orders(rider_id, limit=None, after=None):
+        """
+        Retrieve orders assigned to a rider, newest first.
+
+        Args:
+            rider_id (int): Rider's ID
+            limit (int, optional): Maximum number of orders to return
+            after (tuple, optional): (order_time, order_id) of the last order on the previous page
+
+        Returns:
+            list: List of Order objects
+        """
+        return Order._history('rider_id', rider_id, limit, after)
+
     @staticmethod
     def assign_rider(order_id, rider_id):
         """
         Assign a rider to an order.
 
+        Only pending orders can be assigned. The rider's slot should already
+        be reserved in the rider registry; the update is also guarded by the
+        rider's active_orders counter, which covers other worker processes.
+
         Args:
             order_id (int): Order's ID
             rider_id (int): Rider's ID
 
         Returns:
-            bool: True if successful
+            bool: True if successful, False if the order does not exist, is
+                not pending, or the rider is already at capacity
         """
         try:
-            with sqlite3.connect('food_delivery.db') as conn:
-                cursor = conn.cursor()
+            with db_cursor() as cursor:
                 cursor.execute(
-                    """
+                    f"""
                     UPDATE orders
                     SET rider_id = ?, status = 'assigned'
-                    WHERE order_id = ?
+                    WHERE order_id = ? AND status = ? AND {rider_registry.CAPACITY_GUARD}
+                    RETURNING user_id
                     """,
-                    (rider_id, order_id)
+                    (rider_id, order_id, PENDING, rider_id, rider_registry.MAX_ACTIVE_ORDERS)
                 )
-                conn.commit()
-                return cursor.rowcount > 0
+                row = cursor.fetchone()
+                if row:
+                    touch('order', order_id)
+                    publish_order_event(order_id, 'assigned', user_id=row['user_id'], rider_id=rider_id)
+            return row is not None
         except sqlite3.Error as e:
             raise sqlite3.Error(f"Database error: {str(e)}")
 
@@ -159,8 +243,7 @@ class Order:
             Order: Order object if found, None otherwise
         """
         try:
-            with sqlite3.connect('food_delivery.db') as conn:
-                cursor = conn.cursor()
+            with db_cursor() as cursor:
                 cursor.execute(
                     """
                     SELECT order_id, user_id, restaurant_id, rider_id, items,
@@ -177,29 +260,64 @@ class Order:
         except sqlite3.Error as e:
             raise sqlite3.Error(f"Database error: {str(e)}")
 
-@staticmethod
-def mark_as_completed(order_id):
-    """
-    Mark an order as completed.
-    
-    Args:
-        order_id (int): Order's ID
-        
-    Returns:
-        bool: True if update was successful
-    """
-    try:
-        with sqlite3.connect('food_delivery.db') as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                """
-                UPDATE orders
-                SET status = 'completed'
-                WHERE order_id = ?
-                """,
-                (order_id,)
-            )
-            conn.commit()
-            return cursor.rowcount > 0
-    except sqlite3.Error as e:
-        raise sqlite3.Error(f"Database error: {str(e)}")
+    @staticmethod
+    def update_status(order_id, status):
+        """
+        Move an order to another lifecycle status.
+
+        The transition is checked against models.order_status and written
+        in one transaction together with the rider and restaurant counters,
+        which triggers maintain. Once it commits, the rider's slot in the
+        rider registry is freed if the order left an active status, and the
+        change is published to event subscribers.
+
+        Args:
+            order_id (int): Order's ID
+            status (str): New status
+
+        Returns:
+            bool: True if updated, False if the order does not exist
+
+        Raises:
+            ValueError: If status is not a lifecycle status
+            InvalidTransition: If the order's current status cannot move to
+                status, or status is one of MANAGED_STATUSES
+            sqlite3.Error: If database operation fails
+        """
+        if status in MANAGED_STATUSES:
+            # An 'assigned' order without a rider would never be dispatched
+            raise InvalidTransition(f"Orders become '{status}' through rider assignment or intake, "
+                                    f"not a status change")
+
+        def write(cursor):
+            cursor.execute("SELECT user_id, rider_id, status FROM orders WHERE order_id = ?", (order_id,))
+            order = cursor.fetchone()
+            if not order:
+                return False
+            check_transition(order['status'], status)
+            cursor.execute("UPDATE orders SET status = ? WHERE order_id = ?", (status, order_id))
+            touch('order', order_id)
+            rider_registry.registry.status_changed(order['rider_id'], order['status'], status)
+            publish_order_event(order_id, status, user_id=order['user_id'], rider_id=order['rider_id'])
+            return True
+
+        try:
+            return submit_write(write)
+        except sqlite3.Error as e:
+            raise sqlite3.Error(f"Database error: {str(e)}")
+
+    @staticmethod
+    def mark_as_completed(order_id):
+        """
+        Mark an order as delivered.
+
+        Args:
+            order_id (int): Order's ID
+
+        Returns:
+            bool: True if update was successful
+
+        Raises:
+            InvalidTransition: If the order has not been picked up
+        """
+        return Order.update_status(order_id, DELIVERED)
@@ -0,0 +1,70 @@
+"""
+Order lifecycle: the statuses an order can have and the allowed transitions.
+
+    received -> pending -> assigned -> picked_up -> delivered
+        |  \\          \\          \\            \\
+        |   +----------+----------+------------+--> cancelled
+        +--> rejected
+
+Orders taken by asynchronous intake start as 'received' until a worker
+validates them, and become 'pending' or, if they cannot be priced,
+'rejected'; other orders start as 'pending'. An order waits as 'pending'
+until a rider is assigned. 'delivered', 'cancelled' and 'rejected' are
+final.
+
+Orders in ACTIVE_STATUSES count towards their rider's riders.active_orders
+and orders in OPEN_STATUSES towards their restaurant's
+restaurants.open_orders; SQL triggers keep both counters in step with
+every insert and update of orders (see migrations).
+"""
+
+RECEIVED = 'received'
+PENDING = 'pending'
+ASSIGNED = 'assigned'
+PICKED_UP = 'picked_up'
+DELIVERED = 'delivered'
+CANCELLED = 'cancelled'
+REJECTED = 'rejected'
+
+TRANSITIONS = {
+    RECEIVED: (PENDING, REJECTED, CANCELLED),
+    PENDING: (ASSIGNED, CANCELLED),
+    ASSIGNED: (PICKED_UP, CANCELLED),
+    PICKED_UP: (DELIVERED, CANCELLED),
+    DELIVERED: (),
+    CANCELLED: (),
+    REJECTED: (),
+}
+STATUSES = tuple(TRANSITIONS)
+
+# Statuses that only their own code paths set, never a plain status change:
+# rider assignment sets 'assigned' together with rider_id, and intake sets
+# 'pending' once it has priced the order
+MANAGED_STATUSES = (PENDING, ASSIGNED)
+
+# Orders a rider is carrying, and orders a restaurant still has to hand over
+ACTIVE_STATUSES = (ASSIGNED, PICKED_UP)
+OPEN_STATUSES = (PENDING, ASSIGNED, PICKED_UP)
+
+
+class InvalidTransition(ValueError):
+    """Raised when an order cannot move from its current status to the requested one."""
+
+
+def sql_list(statuses) -> str:
+    """Statuses as an SQL list literal, e.g. "'assigned', 'picked_up'"."""
+    return ', '.join(f"'{status}'" for status in statuses)
+
+
+def check_transition(current: str, new: str):
+    """
+    Validate a status change.
+
+    Raises:
+        ValueError: If new is not a known status
+        InvalidTransition: If the lifecycle does not allow current -> new
+    """
+    if new not in TRANSITIONS:
+        raise ValueError(f"Unknown status '{new}'; expected one of: {', '.join(STATUSES)}")
+    if new not in TRANSITIONS.get(current, ()):
+        raise InvalidTransition(f"Cannot change an order from '{current}' to '{new}'")
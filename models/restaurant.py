@@ -1,8 +1,12 @@
 import sqlite3
-from db import db_cursor
+from cache import menu_cache, touch
+from db import db_cursor, on_commit, submit_write
+from geo import resolve
+from models import identity_map, open_hours, suggestions
 
 class Restaurant:
-    def __init__(self, restaurant_id: int, name: str, location: str, food_type: str, prep_time: int):
+    def __init__(self, restaurant_id: int, name: str, location: str, food_type: str, prep_time: int,
+                 lat: float = None, lon: float = None):
         """
         Initialize a Restaurant object.
         
@@ -12,15 +16,20 @@ class Restaurant:
             location (str): Location of the restaurant
             food_type (str): Type of cuisine (e.g., Italian)
             prep_time (int): Food preparation time in minutes
+            lat (float, optional): Latitude of the restaurant
+            lon (float, optional): Longitude of the restaurant
         """
         self.restaurant_id = restaurant_id
         self.name = name
         self.location = location
         self.food_type = food_type
         self.prep_time = prep_time
+        self.lat = lat
+        self.lon = lon
 
     @staticmethod
-    def register(name: str, location: str, food_type: str, prep_time: int = 10, menu_items: list = None) -> 'Restaurant':
+    def register(name: str, location: str, food_type: str, prep_time: int = 10, menu_items: list = None,
+                 lat: float = None, lon: float = None) -> 'Restaurant':
         """
         Register a new restaurant with optional menu items.
         
@@ -30,33 +39,43 @@ class Restaurant:
             food_type (str): Type of cuisine
             prep_time (int): Food preparation time in minutes
             menu_items (list): List of menu items, each with 'item_name' and 'price'
+            lat (float, optional): Latitude; geocoded from location if omitted
+            lon (float, optional): Longitude; geocoded from location if omitted
         
         Returns:
             Restaurant: Newly created Restaurant object
         
         Raises:
-            ValueError: If name, location, or food_type is empty
+            ValueError: If name, location, or food_type is empty or the coordinates are invalid
             sqlite3.Error: If database operation fails
         """
         if not name or not location or not food_type:
             raise ValueError("Name, location, and food type are required")
+        lat, lon = resolve(location, lat, lon)
         
-        try:
-            with db_cursor() as cursor:
-                cursor.execute(
-                    "INSERT INTO restaurants (name, location, food_type, prep_time) VALUES (?, ?, ?, ?)",
-                    (name, location, food_type, prep_time)
+        def write(cursor):
+            cursor.execute(
+                "INSERT INTO restaurants (name, location, food_type, prep_time, lat, lon) VALUES (?, ?, ?, ?, ?, ?)",
+                (name, location, food_type, prep_time, lat, lon)
+            )
+            restaurant_id = cursor.lastrowid
+
+            if menu_items:
+                cursor.executemany(
+                    "INSERT INTO menus (restaurant_id, item_name, price) VALUES (?, ?, ?)",
+                    [(restaurant_id, item['item_name'], item['price']) for item in menu_items]
                 )
-                restaurant_id = cursor.lastrowid
-                
-                if menu_items:
-                    for item in menu_items:
-                        cursor.execute(
-                            "INSERT INTO menus (restaurant_id, item_name, price) VALUES (?, ?, ?)",
-                            (restaurant_id, item['item_name'], item['price'])
-                        )
-                
-                return Restaurant(restaurant_id, name, location, food_type, prep_time)
+
+            cursor.execute("SELECT * FROM restaurants WHERE restaurant_id = ?", (restaurant_id,))
+            row = cursor.fetchone()
+            touch('menu', restaurant_id)
+            touch('restaurants', 'all')
+            on_commit(lambda: open_hours.index.put(row))
+            on_commit(lambda: suggestions.index.put(row))
+            return Restaurant(restaurant_id, name, location, food_type, prep_time, lat, lon)
+
+        try:
+            return submit_write(write)
         except sqlite3.Error as e:
             raise sqlite3.Error(f"Database error: {str(e)}")
 
@@ -71,16 +90,34 @@ class Restaurant:
         Returns:
             Restaurant: Restaurant object if found, None otherwise
         """
-        try:
+        return Restaurant.get_many([restaurant_id]).get(restaurant_id)
+
+    @staticmethod
+    def get_many(restaurant_ids) -> dict:
+        """
+        Retrieve several restaurants with batched IN queries.
+
+        Restaurants already loaded during the current request are served from
+        the request's identity map.
+
+        Args:
+            restaurant_ids (iterable): Restaurant IDs; duplicates are ignored
+
+        Returns:
+            dict: Mapping of restaurant_id to Restaurant for the IDs that exist
+        """
+        def fetch(ids):
+            placeholders = ','.join('?' for _ in ids)
             with db_cursor() as cursor:
                 cursor.execute(
-                    "SELECT restaurant_id, name, location, food_type, prep_time FROM restaurants WHERE restaurant_id = ?",
-                    (restaurant_id,)
+                    f"SELECT restaurant_id, name, location, food_type, prep_time, lat, lon FROM restaurants "
+                    f"WHERE restaurant_id IN ({placeholders})",
+                    list(ids)
                 )
-                result = cursor.fetchone()
-                if result:
-                    return Restaurant(*result)
-                return None
+                return {row['restaurant_id']: Restaurant(*row) for row in cursor.fetchall()}
+
+        try:
+            return identity_map.load_many('restaurant', restaurant_ids, fetch)
         except sqlite3.Error as e:
             raise sqlite3.Error(f"Database error: {str(e)}")
 
@@ -100,20 +137,76 @@ class Restaurant:
         if not item_name or price <= 0:
             raise ValueError("Item name and valid price are required")
         
+        def write(cursor):
+            cursor.execute(
+                "SELECT restaurant_id FROM restaurants WHERE restaurant_id = ?",
+                (restaurant_id,)
+            )
+            if not cursor.fetchone():
+                return False
+
+            cursor.execute(
+                "INSERT INTO menus (restaurant_id, item_name, price) VALUES (?, ?, ?)",
+                (restaurant_id, item_name, price)
+            )
+            touch('menu', restaurant_id)
+            return True
+
         try:
-            with db_cursor() as cursor:
-                cursor.execute(
-                    "SELECT restaurant_id FROM restaurants WHERE restaurant_id = ?",
-                    (restaurant_id,)
-                )
-                if not cursor.fetchone():
-                    return False
-                
-                cursor.execute(
-                    "INSERT INTO menus (restaurant_id, item_name, price) VALUES (?, ?, ?)",
-                    (restaurant_id, item_name, price)
-                )
-                return True
+            return submit_write(write)
+        except sqlite3.Error as e:
+            raise sqlite3.Error(f"Database error: {str(e)}")
+
+    @staticmethod
+    def update_hours(restaurant_id: int, opening_time: str, closing_time: str,
+                     serves_breakfast: bool = None, serves_lunch: bool = None,
+                     serves_dinner: bool = None) -> bool:
+        """
+        Change a restaurant's opening hours and, optionally, the meals it serves.
+
+        A closing time earlier than the opening time means the restaurant
+        closes after midnight.
+
+        Args:
+            restaurant_id (int): Restaurant's ID
+            opening_time (str): Opening time, 'HH:MM' or 'HH:MM:SS'
+            closing_time (str): Closing time, 'HH:MM' or 'HH:MM:SS'
+            serves_breakfast (bool, optional): New breakfast flag; unchanged if None
+            serves_lunch (bool, optional): New lunch flag; unchanged if None
+            serves_dinner (bool, optional): New dinner flag; unchanged if None
+
+        Returns:
+            bool: True if the restaurant exists and was updated
+
+        Raises:
+            ValueError: If a time is not a valid time of day
+            sqlite3.Error: If database operation fails
+        """
+        opening = open_hours.minute_of_day(opening_time)
+        closing = open_hours.minute_of_day(closing_time)
+        flags = {'serves_breakfast': serves_breakfast, 'serves_lunch': serves_lunch, 'serves_dinner': serves_dinner}
+        assignments = ["opening_time = ?", "closing_time = ?"]
+        params = [f"{opening // 60:02d}:{opening % 60:02d}", f"{closing // 60:02d}:{closing % 60:02d}"]
+        for column, value in flags.items():
+            if value is not None:
+                assignments.append(f"{column} = ?")
+                params.append(1 if value else 0)
+
+        def write(cursor):
+            cursor.execute(
+                f"UPDATE restaurants SET {', '.join(assignments)} WHERE restaurant_id = ?",
+                params + [restaurant_id]
+            )
+            if cursor.rowcount == 0:
+                return False
+            cursor.execute("SELECT * FROM restaurants WHERE restaurant_id = ?", (restaurant_id,))
+            row = cursor.fetchone()
+            touch('restaurants', 'all')
+            on_commit(lambda: open_hours.index.put(row))
+            return True
+
+        try:
+            return submit_write(write)
         except sqlite3.Error as e:
             raise sqlite3.Error(f"Database error: {str(e)}")
 
@@ -121,6 +214,8 @@ class Restaurant:
     def get_menu(restaurant_id: int) -> list:
         """
         Retrieve the menu for a restaurant.
+
+        Served from the in-process menu cache; see get_cached_menu.
         
         Args:
             restaurant_id (int): Restaurant's ID
@@ -128,13 +223,84 @@ class Restaurant:
         Returns:
             list: List of menu items (dicts with menu_id, item_name, price)
         """
+        entry = Restaurant.get_cached_menu(restaurant_id)
+        return entry['menu'] if entry else []
+
+    @staticmethod
+    def get_cached_menu(restaurant_id: int) -> dict:
+        """
+        Retrieve a restaurant's name and menu through the menu cache.
+
+        Cached entries are dropped when register or add_menu_item bump the
+        restaurant's menu version in data_versions, in whichever process, so
+        hot menus are read from memory and only reloaded after they change,
+        and the menu always matches the ETag built from that version. Treat
+        the result as read-only.
+
+        Args:
+            restaurant_id (int): Restaurant's ID
+
+        Returns:
+            dict: restaurant_id, restaurant_name and menu, or None if the
+                restaurant does not exist
+        """
+        return menu_cache.get(restaurant_id, Restaurant._load_menu)
+
+    @staticmethod
+    def _load_menu(restaurant_id: int) -> dict:
         try:
             with db_cursor() as cursor:
+                cursor.execute(
+                    "SELECT name FROM restaurants WHERE restaurant_id = ?",
+                    (restaurant_id,)
+                )
+                restaurant = cursor.fetchone()
+                if not restaurant:
+                    return None
                 cursor.execute(
                     "SELECT menu_id, item_name, price FROM menus WHERE restaurant_id = ?",
                     (restaurant_id,)
                 )
                 results = cursor.fetchall()
-                return [{"menu_id": r['menu_id'], "item_name": r['item_name'], "price": r['price']} for r in results]
+                return {
+                    "restaurant_id": restaurant_id,
+                    "restaurant_name": restaurant['name'],
+                    "menu": [{"menu_id": r['menu_id'], "item_name": r['item_name'], "price": r['price']} for r in results]
+                }
+        except sqlite3.Error as e:
+            raise sqlite3.Error(f"Database error: {str(e)}")
+
+    @staticmethod
+    def get_top_items(restaurant_id: int, limit: int = 10) -> list:
+        """
+        Rank a restaurant's menu items by quantity ordered.
+
+        Aggregates order_items through the menu_id index, without reading orders.
+
+        Args:
+            restaurant_id (int): Restaurant's ID
+            limit (int): Number of items to return
+
+        Returns:
+            list: Dicts with menu_id, item_name, quantity, orders and revenue
+        """
+        try:
+            with db_cursor() as cursor:
+                cursor.execute(
+                    """
+                    SELECT m.menu_id, m.item_name,
+                           SUM(oi.quantity) AS quantity,
+                           COUNT(DISTINCT oi.order_id) AS orders,
+                           ROUND(SUM(oi.quantity * oi.unit_price), 2) AS revenue
+                    FROM menus m
+                    JOIN order_items oi ON oi.menu_id = m.menu_id
+                    WHERE m.restaurant_id = ?
+                    GROUP BY m.menu_id
+                    ORDER BY quantity DESC, m.menu_id
+                    LIMIT ?
+                    """,
+                    (restaurant_id, limit)
+                )
+                return [dict(row) for row in cursor.fetchall()]
         except sqlite3.Error as e:
-            raise sqlite3.Error(f"Database error: {str(e)}")
\ No newline at end of file
+            raise sqlite3.Error(f"Database error: {str(e)}")
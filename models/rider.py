@@ -1,7 +1,11 @@
 import sqlite3
+from cache import touch
+from db import db_cursor, on_commit, submit_write
+from geo import resolve
+from models import location_buffer, rider_registry
 
 class Rider:
-    def __init__(self, rider_id, name, location, is_available=True):
+    def __init__(self, rider_id, name, location, is_available=True, lat=None, lon=None):
         """
         Initialize a Rider object.
         
@@ -10,40 +14,59 @@ class Rider:
             name (str): Rider's name
             location (str): Rider's current location (e.g., 'Downtown')
             is_available (bool): Whether the rider is available for orders
+            lat (float, optional): Latitude of the rider's position
+            lon (float, optional): Longitude of the rider's position
         """
         self.rider_id = rider_id
         self.name = name
         self.location = location
         self.is_available = is_available
+        self.lat = lat
+        self.lon = lon
 
     @staticmethod
-    def register(name, location):
+    def _from_row(row):
+        """Build a Rider from a riders row, with any position still waiting in the location buffer."""
+        rider = Rider(*row)
+        ping = location_buffer.buffer.get(rider.rider_id)
+        if ping:
+            location, rider.lat, rider.lon = ping
+            rider.location = location or rider.location
+        return rider
+
+    @staticmethod
+    def register(name, location, lat=None, lon=None):
         """
         Register a new rider in the database.
         
         Args:
             name (str): Rider's name
             location (str): Rider's location
+            lat (float, optional): Latitude; geocoded from location if omitted
+            lon (float, optional): Longitude; geocoded from location if omitted
             
         Returns:
             Rider: Newly created Rider object
             
         Raises:
-            ValueError: If name or location is empty
+            ValueError: If name or location is empty or the coordinates are invalid
             sqlite3.Error: If database operation fails
         """
         if not name or not location:
             raise ValueError("Name and location are required")
+        lat, lon = resolve(location, lat, lon)
+        def write(cursor):
+            cursor.execute(
+                "INSERT INTO riders (name, location, is_available, lat, lon) VALUES (?, ?, ?, ?, ?)",
+                (name, location, True, lat, lon)
+            )
+            rider_id = cursor.lastrowid
+            on_commit(lambda: rider_registry.registry.update(rider_id, name=name, location=location,
+                                                             lat=lat, lon=lon, is_available=True))
+            return Rider(rider_id, name, location, True, lat, lon)
+
         try:
-            with sqlite3.connect('food_delivery.db') as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "INSERT INTO riders (name, location, is_available) VALUES (?, ?, ?)",
-                    (name, location, True)
-                )
-                conn.commit()
-                rider_id = cursor.lastrowid
-                return Rider(rider_id, name, location, True)
+            return submit_write(write)
         except sqlite3.Error as e:
             raise sqlite3.Error(f"Database error: {str(e)}")
 
@@ -59,42 +82,53 @@ class Rider:
             Rider: Rider object if found, None otherwise
         """
         try:
-            with sqlite3.connect('food_delivery.db') as conn:
-                cursor = conn.cursor()
+            with db_cursor() as cursor:
                 cursor.execute(
-                    "SELECT rider_id, name, location, is_available FROM riders WHERE rider_id = ?",
+                    "SELECT rider_id, name, location, is_available, lat, lon FROM riders WHERE rider_id = ?",
                     (rider_id,)
                 )
                 result = cursor.fetchone()
                 if result:
-                    return Rider(result[0], result[1], result[2], result[3])
+                    return Rider._from_row(result)
                 return None
         except sqlite3.Error as e:
             raise sqlite3.Error(f"Database error: {str(e)}")
 
     @staticmethod
-    def update_location(rider_id, new_location):
+    def update_location(rider_id, new_location, lat=None, lon=None):
         """
         Update a rider's location.
         
         Args:
             rider_id (int): Rider's ID
             new_location (str): New location
+            lat (float, optional): Latitude; geocoded from new_location if omitted
+            lon (float, optional): Longitude; geocoded from new_location if omitted
             
+        The position is written straight through; batches of pings go
+        through location_buffer instead.
+
         Returns:
             bool: True if update was successful, False otherwise
         """
         if not new_location:
             raise ValueError("New location is required")
+        lat, lon = resolve(new_location, lat, lon)
+        # This write is newer than any ping the buffer still holds
+        location_buffer.buffer.discard(rider_id)
+        def write(cursor):
+            cursor.execute(
+                "UPDATE riders SET location = ?, lat = ?, lon = ? WHERE rider_id = ?",
+                (new_location, lat, lon, rider_id)
+            )
+            if cursor.rowcount == 0:
+                return False
+            touch('rider', rider_id)
+            on_commit(lambda: rider_registry.registry.update(rider_id, location=new_location, lat=lat, lon=lon))
+            return True
+
         try:
-            with sqlite3.connect('food_delivery.db') as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "UPDATE riders SET location = ? WHERE rider_id = ?",
-                    (new_location, rider_id)
-                )
-                conn.commit()
-                return cursor.rowcount > 0
+            return submit_write(write)
         except sqlite3.Error as e:
             raise sqlite3.Error(f"Database error: {str(e)}")
 
@@ -107,11 +141,13 @@ class Rider:
             list: List of Rider objects
         """
         try:
-            with sqlite3.connect('food_delivery.db') as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT rider_id, name, location, is_available FROM riders WHERE is_available = ?", (True,))
+            with db_cursor() as cursor:
+                cursor.execute(
+                    "SELECT rider_id, name, location, is_available, lat, lon FROM riders WHERE is_available = ?",
+                    (True,)
+                )
                 results = cursor.fetchall()
-                return [Rider(result[0], result[1], result[2], result[3]) for result in results]
+                return [Rider._from_row(result) for result in results]
         except sqlite3.Error as e:
             raise sqlite3.Error(f"Database error: {str(e)}")
 
@@ -127,14 +163,17 @@ class Rider:
         Returns:
             bool: True if update was successful, False otherwise
         """
+        def write(cursor):
+            cursor.execute(
+                "UPDATE riders SET is_available = ? WHERE rider_id = ?",
+                (is_available, rider_id)
+            )
+            if cursor.rowcount == 0:
+                return False
+            on_commit(lambda: rider_registry.registry.update(rider_id, is_available=is_available))
+            return True
+
         try:
-            with sqlite3.connect('food_delivery.db') as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "UPDATE riders SET is_available = ? WHERE rider_id = ?",
-                    (is_available, rider_id)
-                )
-                conn.commit()
-                return cursor.rowcount > 0
+            return submit_write(write)
         except sqlite3.Error as e:
             raise sqlite3.Error(f"Database error: {str(e)}")
\ No newline at end of file
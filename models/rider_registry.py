@@ -0,0 +1,279 @@
+"""
+In-process registry of rider state: position, availability and active load.
+
+Matching reads riders from here instead of counting their orders in SQL, and
+takes a slot on a rider with reserve(), a compare-and-reserve under the
+registry lock: it only succeeds while the rider is available and below
+MAX_ACTIVE_ORDERS, so two requests in this process can never both take a
+rider's last slot. A reservation made inside a transaction() becomes part
+of the rider's load when that transaction commits and is released if it
+rolls back.
+
+Writes go to SQLite first and are applied here once they commit
+(write-through): Rider.register, update_location and set_availability
+report rider changes, and order writes report load changes with
+adjust_load(). The registry is rebuilt from the database at startup and,
+to pick up writes made by other worker processes, once REGISTRY_TTL has
+passed. Between rebuilds two processes could still each see a free slot,
+so order updates that assign a rider also check CAPACITY_GUARD in SQL.
+"""
+import threading
+import time
+
+from db import db_cursor, in_transaction, on_commit, on_configure_pool, on_rollback
+from geo import GridIndex
+from models.order_status import ACTIVE_STATUSES
+
+GRID_CELL_KM = 0.5
+REGISTRY_TTL = 60
+# A rider carries at most this many orders in ACTIVE_STATUSES
+MAX_ACTIVE_ORDERS = 3
+# Riders fetched from the spatial index per round of reserve_nearest
+NEAREST_CANDIDATES = 8
+
+# WHERE clause term for an order UPDATE that assigns a rider; its parameters
+# are the rider id and MAX_ACTIVE_ORDERS. Reads the riders.active_orders
+# counter, which triggers keep current within the writer's transaction.
+CAPACITY_GUARD = "(SELECT active_orders FROM riders WHERE rider_id = ?) < ?"
+
+
+class RiderState:
+    """Registry entry of one rider."""
+
+    __slots__ = ('rider_id', 'name', 'location', 'lat', 'lon', 'is_available', 'active_orders', 'reserved')
+
+    def __init__(self, rider_id, name, location, lat, lon, is_available, active_orders=0):
+        self.rider_id = rider_id
+        self.name = name
+        self.location = location
+        self.lat = lat
+        self.lon = lon
+        self.is_available = bool(is_available)
+        # Committed active orders, and slots reserved by uncommitted work
+        self.active_orders = active_orders
+        self.reserved = 0
+
+    @property
+    def load(self) -> int:
+        return self.active_orders + self.reserved
+
+    def has_capacity(self) -> bool:
+        return self.is_available and self.lat is not None and self.load < MAX_ACTIVE_ORDERS
+
+    def to_dict(self) -> dict:
+        return {
+            "rider_id": self.rider_id,
+            "name": self.name,
+            "location": self.location,
+            "lat": self.lat,
+            "lon": self.lon,
+            "is_available": 1 if self.is_available else 0,
+            "active_orders": self.load
+        }
+
+
+class RiderRegistry:
+    """Thread-safe rider registry; see the module docstring."""
+
+    def __init__(self, cell_km: float = GRID_CELL_KM, ttl: float = REGISTRY_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._riders = {}
+        # Spatial index of the riders that are available and have a position
+        self.grid = GridIndex(cell_km)
+        self._loaded_at = None
+        self.reservations = 0
+        self.refusals = 0
+
+    def rebuild(self, rows):
+        """
+        Replace the registry contents.
+
+        Args:
+            rows (iterable): Mappings with rider_id, name, location, lat,
+                lon, is_available and active_orders
+        """
+        riders = {row['rider_id']: RiderState(row['rider_id'], row['name'], row['location'], row['lat'],
+                                              row['lon'], row['is_available'], row['active_orders'])
+                  for row in rows}
+        with self._lock:
+            # Reservations still in flight are not in the database yet
+            for rider_id, state in self._riders.items():
+                if state.reserved and rider_id in riders:
+                    riders[rider_id].reserved = state.reserved
+            self._riders = riders
+            self.grid.rebuild((state.rider_id, state.lat, state.lon) for state in riders.values()
+                              if state.is_available and state.lat is not None)
+            self._loaded_at = time.monotonic()
+
+    def is_stale(self) -> bool:
+        return self._loaded_at is None or time.monotonic() - self._loaded_at >= self.ttl
+
+    def expire(self):
+        """Force a rebuild on next use, e.g. after the database disagreed with the registry."""
+        self._loaded_at = None
+
+    def update(self, rider_id: int, **fields):
+        """
+        Apply a committed change to a rider's name, location, lat, lon or is_available.
+
+        Unknown riders are added, with no active orders.
+        """
+        with self._lock:
+            state = self._riders.get(rider_id)
+            if state is None:
+                state = self._riders[rider_id] = RiderState(rider_id, None, None, None, None, False)
+            for field, value in fields.items():
+                setattr(state, field, bool(value) if field == 'is_available' else value)
+            if state.is_available and state.lat is not None:
+                self.grid.put(rider_id, state.lat, state.lon)
+            else:
+                self.grid.remove(rider_id)
+
+    def get(self, rider_id: int) -> dict:
+        """Snapshot of a rider's state, or None if unknown."""
+        with self._lock:
+            state = self._riders.get(rider_id)
+            return state.to_dict() if state else None
+
+    def available(self) -> list:
+        """Snapshots of the available riders with spare capacity, by rider id."""
+        with self._lock:
+            return [state.to_dict() for _, state in sorted(self._riders.items()) if state.has_capacity()]
+
+    def reserve(self, rider_id: int) -> bool:
+        """
+        Take one slot on a rider if it is available and below capacity.
+
+        Inside a transaction() the slot counts towards the rider's active
+        orders once the transaction commits and is freed if it rolls back.
+        Outside one the caller's write is assumed to follow immediately, and
+        the caller must release() the slot if that write does not happen.
+
+        Returns:
+            bool: True if the slot was taken
+        """
+        with self._lock:
+            state = self._riders.get(rider_id)
+            if state is None or not state.has_capacity():
+                self.refusals += 1
+                return False
+            state.reserved += 1
+            self.reservations += 1
+        if in_transaction():
+            on_commit(lambda: self._settle(rider_id, 1))
+            on_rollback(lambda: self._settle(rider_id, 0))
+        else:
+            self._settle(rider_id, 1)
+        return True
+
+    def release(self, rider_id: int):
+        """
+        Give back a slot taken with reserve() whose order write did not happen.
+
+        Inside a transaction() the slot stays taken until the transaction
+        ends, and is then freed whether it commits or rolls back.
+        """
+        if in_transaction():
+            # reserve()'s commit hook still adds the slot to the load; offset it
+            on_commit(lambda: self.adjust_load(rider_id, -1))
+        else:
+            self.adjust_load(rider_id, -1)
+
+    def _settle(self, rider_id: int, committed: int):
+        with self._lock:
+            state = self._riders.get(rider_id)
+            if state is not None:
+                state.reserved = max(0, state.reserved - 1)
+                state.active_orders += committed
+
+    def adjust_load(self, rider_id: int, delta: int):
+        """Apply a committed change to a rider's active order count, e.g. -1 once an order is delivered."""
+        with self._lock:
+            state = self._riders.get(rider_id)
+            if state is not None:
+                state.active_orders = max(0, state.active_orders + delta)
+
+    def status_changed(self, rider_id, old_status: str, new_status: str):
+        """
+        Record an order of rider_id moving between statuses.
+
+        Call inside the writer's scope; the rider's load changes once the
+        write commits, if the order entered or left ACTIVE_STATUSES.
+        """
+        delta = (new_status in ACTIVE_STATUSES) - (old_status in ACTIVE_STATUSES)
+        if rider_id is not None and delta:
+            on_commit(lambda: self.adjust_load(rider_id, delta))
+
+    def reserve_nearest(self, lat: float, lon: float) -> dict:
+        """
+        Reserve a slot on the closest available rider with spare capacity.
+
+        Candidates come from the grid, nearest first, in growing rounds.
+
+        Args:
+            lat (float): Pickup latitude
+            lon (float): Pickup longitude
+
+        Returns:
+            dict: Snapshot of the reserved rider plus distance_km, or None
+        """
+        k = NEAREST_CANDIDATES
+        checked = set()
+        while True:
+            candidates = [(distance, rider_id) for distance, rider_id in self.grid.nearest(lat, lon, k)
+                          if rider_id not in checked]
+            if not candidates:
+                return None
+            for distance, rider_id in candidates:
+                if self.reserve(rider_id):
+                    return dict(self.get(rider_id), distance_km=round(distance, 3))
+            if len(checked) + len(candidates) >= len(self.grid):
+                return None
+            checked.update(rider_id for _, rider_id in candidates)
+            k *= 4
+
+    def nearest(self, lat: float, lon: float) -> dict:
+        """Like reserve_nearest, but only looks: nothing is reserved."""
+        k = NEAREST_CANDIDATES
+        while True:
+            candidates = self.grid.nearest(lat, lon, k)
+            with self._lock:
+                for distance, rider_id in candidates:
+                    state = self._riders.get(rider_id)
+                    if state is not None and state.has_capacity():
+                        return dict(state.to_dict(), distance_km=round(distance, 3))
+            if len(candidates) < k:
+                return None
+            k *= 4
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "riders": len(self._riders),
+                "with_capacity": sum(1 for state in self._riders.values() if state.has_capacity()),
+                "reserved": sum(state.reserved for state in self._riders.values()),
+                "reservations": self.reservations,
+                "refusals": self.refusals,
+                "grid": self.grid.stats(),
+                "age_seconds": round(time.monotonic() - self._loaded_at, 1) if self._loaded_at else None
+            }
+
+
+registry = RiderRegistry()
+# A new pool may point at another database
+on_configure_pool(registry.expire)
+
+
+def refresh():
+    """Rebuild the registry from the riders table and its active_orders counters."""
+    with db_cursor() as cursor:
+        cursor.execute("SELECT rider_id, name, location, lat, lon, is_available, active_orders FROM riders")
+        registry.rebuild(cursor.fetchall())
+
+
+def get_registry() -> RiderRegistry:
+    """Return the registry, rebuilding it first if it was never loaded or its TTL ran out."""
+    if registry.is_stale():
+        refresh()
+    return registry
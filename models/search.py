@@ -0,0 +1,120 @@
+"""
+Full-text search over dishes and restaurants.
+
+Queries run against the search_index FTS5 table (see migrations), which
+holds one document per menu item and one per restaurant and is kept in
+step with menus and restaurants by triggers. Every word of a query is
+matched as a prefix, so "marg pizz" finds "Margherita Pizza"; prefix
+indexes on 2 and 3 characters keep short prefixes cheap.
+
+Results come in bm25 rank order (dish or restaurant name weighted above
+restaurant name, above cuisine), ties broken by rowid, so a page ends on a
+(rank, rowid) keyset cursor.
+"""
+import re
+import sqlite3
+
+from db import db_cursor
+
+DISH = 'dish'
+RESTAURANT = 'restaurant'
+KINDS = (DISH, RESTAURANT)
+
+# Longer queries are cut to this many words
+MAX_QUERY_TERMS = 8
+
+_WORD = re.compile(r'\w+')
+
+
+def match_expression(query: str) -> str:
+    """
+    Turn free text into an FTS5 MATCH expression of quoted prefix terms.
+
+    Raises:
+        ValueError: If the query has no words
+    """
+    words = _WORD.findall(query or '')[:MAX_QUERY_TERMS]
+    if not words:
+        raise ValueError("A search query with at least one word is required")
+    # Words hold no quotes or operators, so quoting them is enough to escape them
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def cursor_key(result: dict) -> tuple:
+    """(rank, rowid) sort key of a search result."""
+    if result['type'] == DISH:
+        return result['rank'], result['menu_id']
+    return result['rank'], -result['restaurant_id']
+
+
+def search(query: str, kind: str = None, limit: int = 50, after: tuple = None) -> list:
+    """
+    Dishes and restaurants matching a query, best first.
+
+    Args:
+        query (str): Free text; each word matches as a prefix
+        kind (str, optional): 'dish' or 'restaurant' to search only one kind
+        limit (int): Maximum number of results
+        after (tuple, optional): cursor_key() of the last result of the previous page
+
+    Returns:
+        list: Result dicts with type, rank and the dish or restaurant fields
+
+    Raises:
+        ValueError: If the query has no words or kind is unknown
+        sqlite3.Error: If database operation fails
+    """
+    if kind is not None and kind not in KINDS:
+        raise ValueError(f"type must be one of: {', '.join(KINDS)}")
+
+    conditions = ["search_index MATCH ?"]
+    params = [match_expression(query)]
+    if kind == DISH:
+        conditions.append("rowid > 0")
+    elif kind == RESTAURANT:
+        conditions.append("rowid < 0")
+    if after is not None:
+        conditions.append("(rank > ? OR (rank = ? AND rowid > ?))")
+        params += [after[0], after[0], after[1]]
+
+    try:
+        with db_cursor() as cursor:
+            # Rank and page inside the FTS table; prices are joined for the page only
+            cursor.execute(f'''
+                SELECT s.doc, s.name, s.restaurant, s.food_type, s.restaurant_id, s.rank, m.price
+                FROM (
+                    SELECT rowid AS doc, name, restaurant, food_type, restaurant_id, rank
+                    FROM search_index
+                    WHERE {' AND '.join(conditions)}
+                    ORDER BY rank, rowid
+                    LIMIT ?
+                ) s
+                LEFT JOIN menus m ON s.doc > 0 AND m.menu_id = s.doc
+                ORDER BY s.rank, s.doc
+            ''', (*params, limit))
+            rows = cursor.fetchall()
+    except sqlite3.Error as e:
+        raise sqlite3.Error(f"Database error: {str(e)}")
+
+    results = []
+    for row in rows:
+        if row['doc'] > 0:
+            results.append({
+                "type": DISH,
+                "menu_id": row['doc'],
+                "item_name": row['name'],
+                "price": row['price'],
+                "restaurant_id": row['restaurant_id'],
+                "restaurant_name": row['restaurant'],
+                "food_type": row['food_type'],
+                "rank": row['rank']
+            })
+        else:
+            results.append({
+                "type": RESTAURANT,
+                "restaurant_id": row['restaurant_id'],
+                "name": row['name'],
+                "food_type": row['food_type'],
+                "rank": row['rank']
+            })
+    return results
@@ -0,0 +1,239 @@
+"""
+In-memory top-k restaurant suggestions by delivery ETA.
+
+A restaurant's ETA to a user is its prep time plus the zone-to-zone travel
+time of travel.get_model(), so every restaurant of a cuisine in the same
+zone shares the travel part. The index keeps, per cuisine (and for all
+cuisines together), one candidate list per zone sorted by (prep_time,
+restaurant_id). A query orders the zones by the lower bound
+ceil(travel) + shortest prep in the zone, then runs a best-first merge over
+the zone lists with a heap: a zone is only opened once its lower bound can
+still beat the best candidate waiting in the heap. Finding the first k
+restaurants costs O(zones + k log zones), independent of how many
+restaurants a cuisine has.
+
+Results come in (eta, restaurant_id) order, so a page ends on a keyset
+cursor; the next page starts each zone list at its first entry past the
+cursor with a bisect. Restaurants that are closed (open_hours) are skipped
+while merging, and the merge stops at the maximum delivery time.
+"""
+from bisect import bisect_right, insort
+import heapq
+import threading
+import time
+
+import numpy as np
+
+from db import db_cursor, on_configure_pool
+from travel import get_model
+
+# Cuisine key of the list holding every restaurant
+ALL_CUISINES = None
+# Restaurants registered by another worker process show up after at most this long
+SUGGESTIONS_TTL = 300
+
+
+class _Cuisine:
+    """Per-zone candidate lists of one cuisine."""
+
+    __slots__ = ('zones', '_arrays')
+
+    def __init__(self):
+        # zone -> sorted list of (prep_time, restaurant_id)
+        self.zones = {}
+        self._arrays = None
+
+    def add(self, zone: int, prep: int, restaurant_id: int):
+        insort(self.zones.setdefault(zone, []), (prep, restaurant_id))
+        self._arrays = None
+
+    def remove(self, zone: int, prep: int, restaurant_id: int):
+        entries = self.zones.get(zone)
+        if entries and (prep, restaurant_id) in entries:
+            entries.remove((prep, restaurant_id))
+            if not entries:
+                del self.zones[zone]
+            self._arrays = None
+
+    def arrays(self) -> tuple:
+        """(zone ids, shortest prep time per zone, candidate lists) as aligned sequences."""
+        if self._arrays is None:
+            zone_ids = sorted(self.zones)
+            lists = [self.zones[zone] for zone in zone_ids]
+            self._arrays = (np.array(zone_ids, dtype=np.intp),
+                            np.array([entries[0][0] for entries in lists], dtype=np.int64), lists)
+        return self._arrays
+
+
+class SuggestionIndex:
+    """Thread-safe suggestion index; see the module docstring."""
+
+    def __init__(self, ttl: float = SUGGESTIONS_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._cuisines = {}
+        self._rows = {}
+        self._loaded_at = None
+
+    def _add(self, row, zone: int):
+        prep = int(row['prep_time'] or 0)
+        restaurant_id = row['restaurant_id']
+        for key in (row['food_type'], ALL_CUISINES):
+            self._cuisines.setdefault(key, _Cuisine()).add(zone, prep, restaurant_id)
+        self._rows[restaurant_id] = {
+            "restaurant_id": restaurant_id,
+            "name": row['name'],
+            "location": row['location'],
+            "food_type": row['food_type'],
+            "prep_time": prep,
+            "zone": zone
+        }
+
+    def rebuild(self, rows):
+        """
+        Replace the index contents.
+
+        Args:
+            rows (iterable): Mappings with restaurant_id, name, location,
+                food_type, prep_time, lat and lon
+        """
+        rows = [row for row in rows if row['lat'] is not None]
+        zones = get_model().zones([row['lat'] for row in rows], [row['lon'] for row in rows]).tolist()
+        fresh = SuggestionIndex(self.ttl)
+        for row, zone in zip(rows, zones):
+            fresh._add(row, zone)
+        for cuisine in fresh._cuisines.values():
+            cuisine.arrays()
+        with self._lock:
+            self._cuisines = fresh._cuisines
+            self._rows = fresh._rows
+            self._loaded_at = time.monotonic()
+
+    def put(self, row):
+        """Add a restaurant, or re-index one whose cuisine, position or prep time changed."""
+        if row['lat'] is None:
+            return
+        zone = int(get_model().zones(row['lat'], row['lon']))
+        with self._lock:
+            old = self._rows.get(row['restaurant_id'])
+            if old:
+                for key in (old['food_type'], ALL_CUISINES):
+                    self._cuisines[key].remove(old['zone'], old['prep_time'], old['restaurant_id'])
+            self._add(row, zone)
+
+    def is_stale(self) -> bool:
+        return self._loaded_at is None or time.monotonic() - self._loaded_at >= self.ttl
+
+    def expire(self):
+        """Force a rebuild on next use."""
+        self._loaded_at = None
+
+    def cuisines(self) -> list:
+        with self._lock:
+            return sorted(key for key in self._cuisines if key is not ALL_CUISINES)
+
+    def suggest(self, lat: float, lon: float, food_types=None, max_minutes: int = None, limit: int = None,
+                after: tuple = None, is_open=None) -> list:
+        """
+        Restaurants in increasing delivery ETA to a point.
+
+        Args:
+            lat (float): Delivery latitude
+            lon (float): Delivery longitude
+            food_types (iterable, optional): Cuisines to include; all if omitted
+            max_minutes (int, optional): Only restaurants with an ETA up to this
+            limit (int, optional): Maximum number of restaurants to return
+            after (tuple, optional): (eta, restaurant_id) of the last
+                restaurant of the previous page
+            is_open (callable, optional): Predicate on restaurant_id; others are skipped
+
+        Returns:
+            list: Restaurant dicts with estimated_delivery_time, ordered by
+                (estimated_delivery_time, restaurant_id)
+        """
+        model = get_model()
+        travel = np.ceil(model.minutes[:, int(model.zones(lat, lon))]).astype(np.int64)
+        with self._lock:
+            keys = [ALL_CUISINES] if not food_types else list(dict.fromkeys(food_types))
+            parts = [self._cuisines[key].arrays() for key in keys if key in self._cuisines]
+            rows = self._rows
+        if not parts or (limit is not None and limit <= 0):
+            return []
+
+        # One stream per (cuisine, zone), ordered by its lower bound
+        lists = [entries for _, _, cuisine_lists in parts for entries in cuisine_lists]
+        zone_travel = np.concatenate([travel[zone_ids] for zone_ids, _, _ in parts])
+        bounds = zone_travel + np.concatenate([min_prep for _, min_prep, _ in parts])
+        if max_minutes is not None:
+            within = np.nonzero(bounds <= max_minutes)[0]
+        else:
+            within = np.arange(len(bounds))
+        order = within[np.argsort(bounds[within], kind='stable')]
+        bounds = bounds[order].tolist()
+        zone_travel = zone_travel[order].tolist()
+        order = order.tolist()
+
+        heap, results = [], []
+        opened = 0
+
+        def push(stream: int, position: int):
+            entries = lists[order[stream]]
+            if position < len(entries):
+                prep, restaurant_id = entries[position]
+                heapq.heappush(heap, (zone_travel[stream] + prep, restaurant_id, stream, position))
+
+        while limit is None or len(results) < limit:
+            # Open every stream whose best entry could come before the heap's top
+            while opened < len(order) and (not heap or bounds[opened] <= heap[0][0]):
+                start = 0
+                if after is not None:
+                    # First entry past the cursor: eta > after_eta, or equal with a higher id
+                    start = bisect_right(lists[order[opened]],
+                                         (after[0] - zone_travel[opened], after[1]))
+                push(opened, start)
+                opened += 1
+            if not heap:
+                break
+            eta, restaurant_id, stream, position = heapq.heappop(heap)
+            if max_minutes is not None and eta > max_minutes:
+                break
+            push(stream, position + 1)
+            if is_open is not None and not is_open(restaurant_id):
+                continue
+            row = rows[restaurant_id]
+            results.append({
+                "restaurant_id": restaurant_id,
+                "name": row['name'],
+                "location": row['location'],
+                "food_type": row['food_type'],
+                "estimated_delivery_time": eta
+            })
+        return results
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "restaurants": len(self._rows),
+                "cuisines": len(self._cuisines) - (ALL_CUISINES in self._cuisines),
+                "zones": len(self._cuisines[ALL_CUISINES].zones) if ALL_CUISINES in self._cuisines else 0,
+                "age_seconds": round(time.monotonic() - self._loaded_at, 1) if self._loaded_at else None
+            }
+
+
+index = SuggestionIndex()
+# A new pool may point at another database
+on_configure_pool(index.expire)
+
+
+def refresh():
+    """Rebuild the index from the restaurants table."""
+    with db_cursor() as cursor:
+        cursor.execute("SELECT restaurant_id, name, location, food_type, prep_time, lat, lon FROM restaurants")
+        index.rebuild(cursor.fetchall())
+
+
+def get_index() -> SuggestionIndex:
+    """Return the index, rebuilding it first if it was never loaded or its TTL ran out."""
+    if index.is_stale():
+        refresh()
+    return index
@@ -1,7 +1,10 @@
 import sqlite3
+from db import db_cursor, submit_write
+from geo import resolve
+from models import identity_map
 
 class User:
-    def __init__(self, user_id, name, location):
+    def __init__(self, user_id, name, location, lat=None, lon=None):
         """
         Initialize a User object.
 
@@ -9,39 +12,45 @@ class User:
             user_id (int): Unique identifier for the user
             name (str): User's name
             location (str): User's location (e.g., 'Downtown')
+            lat (float, optional): Latitude of the user's address
+            lon (float, optional): Longitude of the user's address
         """
         self.user_id = user_id
         self.name = name
         self.location = location
+        self.lat = lat
+        self.lon = lon
 
     @staticmethod
-    def register(name, location):
+    def register(name, location, lat=None, lon=None):
         """
         Register a new user in the database.
 
         Args:
             name (str): User's name
             location (str): User's location
+            lat (float, optional): Latitude; geocoded from location if omitted
+            lon (float, optional): Longitude; geocoded from location if omitted
 
         Returns:
             User: Newly created User object
 
         Raises:
-            ValueError: If name or location is empty
+            ValueError: If name or location is empty or the coordinates are invalid
             sqlite3.Error: If database operation fails
         """
         if not name or not location:
             raise ValueError("Name and location are required")
+        lat, lon = resolve(location, lat, lon)
+        def write(cursor):
+            cursor.execute(
+                "INSERT INTO users (name, location, lat, lon) VALUES (?, ?, ?, ?)",
+                (name, location, lat, lon)
+            )
+            return User(cursor.lastrowid, name, location, lat, lon)
+
         try:
-            with sqlite3.connect('food_delivery.db') as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "INSERT INTO users (name, location) VALUES (?, ?)",
-                    (name, location)
-                )
-                conn.commit()
-                user_id = cursor.lastrowid
-                return User(user_id, name, location)
+            return submit_write(write)
         except sqlite3.Error as e:
             raise sqlite3.Error(f"Database error: {str(e)}")
 
@@ -56,13 +65,32 @@ class User:
         Returns:
             User: User object if found, None otherwise
         """
+        return User.get_many([user_id]).get(user_id)
+
+    @staticmethod
+    def get_many(user_ids):
+        """
+        Retrieve several users with batched IN queries.
+
+        Users already loaded during the current request are served from the
+        request's identity map.
+
+        Args:
+            user_ids (iterable): User IDs; duplicates are ignored
+
+        Returns:
+            dict: Mapping of user_id to User for the IDs that exist
+        """
+        def fetch(ids):
+            placeholders = ','.join('?' for _ in ids)
+            with db_cursor() as cursor:
+                cursor.execute(
+                    f"SELECT user_id, name, location, lat, lon FROM users WHERE user_id IN ({placeholders})",
+                    list(ids)
+                )
+                return {row['user_id']: User(*row) for row in cursor.fetchall()}
+
         try:
-            with sqlite3.connect('food_delivery.db') as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-                result = cursor.fetchone()
-                if result:
-                    return User(result[0], result[1], result[2])
-                return None
+            return identity_map.load_many('user', user_ids, fetch)
         except sqlite3.Error as e:
             raise sqlite3.Error(f"Database error: {str(e)}")
@@ -1,5 +1,6 @@
 from flask import Blueprint, request, jsonify
-from db import db_cursor
+from db import db_cursor, submit_write
+from utils import next_cursor, parse_page_args
 
 notification_routes = Blueprint('notification_routes', __name__)
 
@@ -25,25 +26,29 @@ def notify_user():
         order_id = data.get('order_id')
         message = data['message']
         
-        # Validate user
-        with db_cursor() as cursor:
+        def write(cursor):
+            # Validate user
             cursor.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,))
             if not cursor.fetchone():
-                return jsonify({'message': f'User with ID {user_id} not found'}), 404
-            
+                return None, f'User with ID {user_id} not found'
+
             # Validate order if provided
             if order_id:
                 cursor.execute("SELECT order_id FROM orders WHERE order_id = ?", (order_id,))
                 if not cursor.fetchone():
-                    return jsonify({'message': f'Order with ID {order_id} not found'}), 404
-            
+                    return None, f'Order with ID {order_id} not found'
+
             # Insert notification
             cursor.execute(
                 "INSERT INTO notifications (user_id, order_id, message) VALUES (?, ?, ?)",
                 (user_id, order_id, message)
             )
-            notification_id = cursor.lastrowid
-        
+            return cursor.lastrowid, None
+
+        notification_id, missing = submit_write(write)
+        if missing:
+            return jsonify({'message': missing}), 404
+
         return jsonify({
             'notification_id': notification_id,
             'message': 'Notification logged successfully'
@@ -58,9 +63,11 @@ def list_user_notifications():
     
     Request Body:
         - user_id (int): ID of the user
+        - limit (int, optional): Page size (default 50, max 200)
+        - after (str, optional): next_cursor from the previous page
     
     Returns:
-        JSON: List of notifications
+        JSON: One page of notifications, newest first, and next_cursor
     """
     try:
         data = request.get_json()
@@ -68,6 +75,10 @@ def list_user_notifications():
             return jsonify({'message': 'User ID is required'}), 400
         
         user_id = data['user_id']
+        try:
+            limit, after = parse_page_args(data, key_size=2)
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
         
         # Validate user
         with db_cursor() as cursor:
@@ -76,16 +87,22 @@ def list_user_notifications():
                 return jsonify({'message': f'User with ID {user_id} not found'}), 404
             
             # Get notifications
-            cursor.execute(
-                """
+            sql = """
                 SELECT notification_id, user_id, order_id, message, created_at
                 FROM notifications
                 WHERE user_id = ?
-                ORDER BY created_at DESC
-                """,
-                (user_id,)
+            """
+            params = [user_id]
+            if after:
+                sql += " AND (created_at, notification_id) < (?, ?)"
+                params.extend(after)
+            sql += " ORDER BY created_at DESC, notification_id DESC LIMIT ?"
+            params.append(limit + 1)
+            cursor.execute(sql, params)
+            notifications, cursor_token = next_cursor(
+                cursor.fetchall(), limit,
+                key=lambda n: (n['created_at'], n['notification_id'])
             )
-            notifications = cursor.fetchall()
         
         notifications_list = [
             {
@@ -100,6 +117,7 @@ def list_user_notifications():
         return jsonify({
             'user_id': user_id,
             'notifications': notifications_list,
+            'next_cursor': cursor_token,
             'message': 'Notifications retrieved successfully'
         }), 200
     except Exception as e:
@@ -1,15 +1,44 @@
-from flask import Blueprint, json, request, jsonify
+from flask import Blueprint, Response, json, request, jsonify, url_for
 from datetime import datetime
-from services.matching_service import MatchingService
+from services.dispatch_service import DispatchService
+from services.intake_service import IntakeService, intake, intake_enabled
 from models.order import Order
-from db import db_cursor
+from models.restaurant import Restaurant
+from models.order_status import ASSIGNED, InvalidTransition, PENDING, RECEIVED
+from services.order_service import OrderService
+from cache import BoundedDict, touch
+from event_bus import bus, publish_order_event, sse_stream
+from db import db_cursor, on_configure_pool, submit_write
+from models import rider_registry
+from http_cache import conditional, version_tag
+from idempotency import idempotent
+from utils import next_cursor, parse_page_args
 
 order_routes = Blueprint('order_routes', __name__)
 @order_routes.route('/api/orders', methods=['POST'])
+@idempotent
 def place_order():
     try:
         data = request.json
-        with db_cursor() as cursor:
+        if intake_enabled():
+            return _receive_order(data)
+        if not isinstance(data, dict) or not isinstance(data.get('restaurant_id'), int):
+            return jsonify({'error': 'restaurant_id and items are required'}), 400
+        restaurant = Restaurant.get_by_id(data['restaurant_id'])
+        if not restaurant:
+            return jsonify({'error': 'Restaurant not found'}), 404
+        try:
+            line_items = OrderService.price_items(restaurant.restaurant_id, data.get('items'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        # Find the rider before handing the write over, so a slow match does
+        # not hold up the writer thread every other request waits on
+        rider = OrderService.reserve_rider(restaurant.lat, restaurant.lon)
+
+        # The order, its lines and the rider assignment commit together, as one
+        # operation of the writer thread's next group commit
+        def write(cursor):
             # Create order
             cursor.execute("""
                 INSERT INTO orders (
@@ -22,58 +51,112 @@ def place_order():
             """, (
                 data['restaurant_id'],
                 json.dumps(data['items']),
-                sum(item['price'] for item in data['items'])
+                sum(line['unit_price'] * line['quantity'] for line in line_items)
             ))
 
             order_id = cursor.fetchone()['order_id']
+            cursor.executemany("""
+                INSERT INTO order_items (order_id, menu_id, item_name, quantity, unit_price)
+                VALUES (?, ?, ?, ?, ?)
+            """, [(order_id, line['menu_id'], line['item_name'], line['quantity'], line['unit_price'])
+                  for line in line_items])
 
-            # Get restaurant prep time
-            cursor.execute("""
-                SELECT prep_time FROM restaurants
-                WHERE restaurant_id = ?
-            """, (data['restaurant_id'],))
-            prep_time = cursor.fetchone()['prep_time']
+            return OrderService.assign_reserved_rider(cursor, order_id, restaurant.prep_time, rider)
 
-            # Find available rider
-            cursor.execute("""
-                SELECT * FROM riders
-                WHERE is_available = 1
-                LIMIT 1
-            """)
-            rider = cursor.fetchone()
-
-            if rider:
-                estimated_time = prep_time + 15  # Base delivery time
-
-                # Update order with rider and estimated time
-                cursor.execute("""
-                    UPDATE orders
-                    SET rider_id = ?,
-                        estimated_delivery_time = ?,
-                        status = 'assigned'
-                    WHERE order_id = ?
-                """, (rider['rider_id'], estimated_time, order_id))
-
-                return jsonify({
-                    'order_id': order_id,
-                    'status': 'assigned',
-                    'estimated_time': estimated_time,
-                    'rider': {
-                        'name': rider['name'],
-                        'id': rider['rider_id']
-                    }
-                })
-
-            return jsonify({
-                'order_id': order_id,
-                'status': 'pending'
-            })
+        try:
+            return jsonify(submit_write(write))
+        except Exception:
+            # Rolled back: the order was not placed, so free the rider again
+            OrderService.release_rider(rider)
+            raise
 
     except Exception as e:
         print(f"Error placing order: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def _receive_order(data):
+    """
+    Asynchronous intake of POST /api/orders: store the order and answer 202.
+
+    Only the shape of the body and the restaurant are checked here; pricing,
+    rider assignment and the user's notification happen on an intake worker.
+    The client follows the order through its Location or its event stream,
+    where it moves from 'received' to 'pending'/'assigned' or 'rejected'.
+    """
+    if (not isinstance(data, dict) or not isinstance(data.get('restaurant_id'), int)
+            or not isinstance(data.get('items'), list) or not data['items']
+            or not all(isinstance(item, dict) for item in data['items'])
+            or not isinstance(data.get('user_id'), (int, type(None)))):
+        return jsonify({'error': 'restaurant_id, a non-empty items list and an optional user_id are required'}), 400
+    if intake.full():
+        response = jsonify({'error': 'Too many orders waiting to be processed, retry shortly'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+
+    order_id = IntakeService.receive(data['restaurant_id'], data['items'], data.get('user_id'))
+    if order_id is None:
+        return jsonify({'error': 'Restaurant not found'}), 400
+    location = url_for('order_routes.get_order', order_id=order_id)
+    response = jsonify({
+        'order_id': order_id,
+        'status': RECEIVED,
+        'order_url': location,
+        'events_url': url_for('order_routes.order_events', order_id=order_id)
+    })
+    response.headers['Location'] = location
+    return response, 202
+
+# Largest number of orders accepted in one batch request
+MAX_BATCH_ORDERS_PER_REQUEST = 500
+
+@order_routes.route('/api/orders/batch', methods=['POST'])
+@idempotent
+def place_orders_batch():
+    """
+    Place many orders in one request, e.g. from an aggregator or a catering job.
+
+    Request Body:
+        - orders (list): Orders, each with restaurant_id, items (menu_id or
+          name, optional quantity) and optional user_id
+
+    Valid orders are inserted with one write and then dispatched together as
+    one plan; invalid ones are rejected individually.
+
+    Returns:
+        JSON: One result per order in request order (order_id and status, or
+            error), plus the number placed and rejected
+    """
+    data = request.get_json(silent=True)
+    orders = data.get('orders') if isinstance(data, dict) else None
+    if not isinstance(orders, list) or not orders:
+        return jsonify({'error': "A non-empty 'orders' list is required"}), 400
+    if len(orders) > MAX_BATCH_ORDERS_PER_REQUEST:
+        return jsonify({'error': f"At most {MAX_BATCH_ORDERS_PER_REQUEST} orders per request"}), 400
+
+    try:
+        results = OrderService.place_orders(orders)
+        rejected = sum(result['status'] == 'rejected' for result in results)
+        return jsonify({'orders': results, 'placed': len(results) - rejected, 'rejected': rejected})
+    except Exception as e:
+        print(f"Error placing order batch: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+# Rider of each recently served order, so an order's ETag can also cover the
+# rider name and location that the order details embed.
+_order_riders = BoundedDict(100_000)
+_UNKNOWN = object()
+on_configure_pool(_order_riders.clear)
+
+
+def _order_etag(order_id):
+    rider_id = _order_riders.get(order_id, _UNKNOWN)
+    if rider_id is _UNKNOWN:
+        return None
+    return version_tag('order', order_id, ('order', order_id), ('rider', rider_id))
+
+
 @order_routes.route('/api/orders/<int:order_id>', methods=['GET'])
+@conditional(_order_etag, cache_control='private, no-cache')
 def get_order(order_id):
     """Get order details"""
     try:
@@ -90,43 +173,140 @@ def get_order(order_id):
             if not order:
                 return jsonify({'error': 'Order not found'}), 404
 
-            return jsonify(dict(order))
+            cursor.execute("""
+                SELECT menu_id, item_name, quantity, unit_price
+                FROM order_items
+                WHERE order_id = ?
+                ORDER BY order_item_id
+            """, (order_id,))
+            details = dict(order)
+            details['line_items'] = [dict(line) for line in cursor.fetchall()]
+            _order_riders.set(order_id, order['rider_id'])
+            return jsonify(details)
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@order_routes.route('/api/orders/<int:order_id>/status', methods=['PUT'])
-def update_order_status(order_id):
-    """Update order status"""
+def _event_stream(subscription, first_events):
+    """text/event-stream response that holds no database connection while idle."""
+    response = Response(sse_stream(subscription, first_events), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Keep reverse proxies from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@order_routes.route('/api/orders/<int:order_id>/events', methods=['GET'])
+def order_events(order_id):
+    """
+    Stream an order's changes as Server-Sent Events.
+
+    The first event is a snapshot of the order's current status; each later
+    'order' event carries the status after a change.
+    """
+    # Subscribe before reading the snapshot so no change falls in between
+    subscription = bus.subscribe(('order', order_id))
     try:
-        data = request.json
         with db_cursor() as cursor:
             cursor.execute("""
-                UPDATE orders
-                SET status = ?
-                WHERE order_id = ?
-            """, (data['status'], order_id))
+                SELECT order_id, user_id, rider_id, status, estimated_delivery_time, rejection_reason
+                FROM orders WHERE order_id = ?
+            """, (order_id,))
+            order = cursor.fetchone()
+    except Exception as e:
+        subscription.close()
+        return jsonify({'error': str(e)}), 500
+    if not order:
+        subscription.close()
+        return jsonify({'error': 'Order not found'}), 404
+    return _event_stream(subscription, [dict(order, type='snapshot')])
+
+
+@order_routes.route('/api/user/<int:user_id>/events', methods=['GET'])
+def user_events(user_id):
+    """Stream the changes to all of a user's orders as Server-Sent Events."""
+    return _event_stream(bus.subscribe(('user', user_id)), [{'type': 'ready', 'user_id': user_id}])
+
 
-            return jsonify({'message': 'Status updated'})
+@order_routes.route('/api/rider/<int:rider_id>/events', methods=['GET'])
+def rider_events(rider_id):
+    """Stream the changes to all of a rider's orders as Server-Sent Events."""
+    return _event_stream(bus.subscribe(('rider', rider_id)), [{'type': 'ready', 'rider_id': rider_id}])
 
+
+@order_routes.route('/api/orders/<int:order_id>/status', methods=['PUT'])
+def update_order_status(order_id):
+    """
+    Move an order along its lifecycle.
+
+    Request Body:
+        - status (str): One of picked_up, delivered, cancelled, rejected; only
+          the transitions in models.order_status are allowed. 'assigned' is
+          set by rider assignment and 'pending' by intake, never here
+
+    Returns:
+        JSON: Success message, 400 for an unknown status, 404 for an unknown
+        order, or 409 if the order cannot move to that status
+    """
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data.get('status'), str):
+        return jsonify({'error': 'A status is required'}), 400
+    try:
+        if not Order.update_status(order_id, data['status']):
+            return jsonify({'error': 'Order not found'}), 404
+        return jsonify({'message': 'Status updated', 'status': data['status']})
+
+    except InvalidTransition as e:
+        return jsonify({'error': str(e)}), 409
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @order_routes.route('/api/user/<int:user_id>/orders')
 def get_user_orders(user_id):
-    """Get user's order history"""
+    """
+    Get one page of a user's order history, newest first.
+
+    Query Parameters:
+        - limit (int, optional): Page size (default 50, max 200)
+        - after (str, optional): Cursor from the previous page's X-Next-Cursor header
+
+    The body stays a JSON list; the next page is advertised in the
+    X-Next-Cursor and Link headers.
+    """
+    try:
+        limit, after = parse_page_args(request.args, key_size=2)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
     try:
         with db_cursor() as cursor:
-            cursor.execute("""
+            sql = """
                 SELECT o.*, r.name as restaurant_name
                 FROM orders o
                 JOIN restaurants r ON o.restaurant_id = r.restaurant_id
                 WHERE o.user_id = ?
-                ORDER BY o.order_time DESC
-            """, (user_id,))
-            orders = cursor.fetchall()
+            """
+            params = [user_id]
+            if after:
+                sql += " AND (o.order_time, o.order_id) < (?, ?)"
+                params.extend(after)
+            sql += " ORDER BY o.order_time DESC, o.order_id DESC LIMIT ?"
+            params.append(limit + 1)
+            cursor.execute(sql, params)
+            orders, cursor_token = next_cursor(
+                cursor.fetchall(), limit,
+                key=lambda order: (order['order_time'], order['order_id'])
+            )
 
-            return jsonify([dict(order) for order in orders])
+            response = jsonify([dict(order) for order in orders])
+            if cursor_token:
+                response.headers['X-Next-Cursor'] = cursor_token
+                next_url = url_for('order_routes.get_user_orders', user_id=user_id,
+                                   after=cursor_token, limit=limit)
+                response.headers['Link'] = f'<{next_url}>; rel="next"'
+            return response
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -135,14 +315,18 @@ def get_user_orders(user_id):
 def assign_rider():
     try:
         data = request.json
-        with db_cursor() as cursor:
+        registry = rider_registry.get_registry()
+
+        # Checks and update run as one operation of the writer thread; it
+        # returns (error, status code), or (None, None) once assigned
+        def write(cursor):
             # Validate order exists
             cursor.execute("""
                 SELECT * FROM orders WHERE order_id = ?
             """, (data['order_id'],))
             order = cursor.fetchone()
             if not order:
-                return jsonify({'error': 'Order not found'}), 404
+                return 'Order not found', 404
 
             # Validate rider
             cursor.execute("""
@@ -150,44 +334,65 @@ def assign_rider():
             """, (data['rider_id'],))
             rider = cursor.fetchone()
             if not rider:
-                return jsonify({'error': 'Rider not found'}), 404
+                return 'Rider not found', 404
+
+            if order['status'] not in (PENDING, ASSIGNED):
+                return f"Cannot assign a rider to a {order['status']} order", 409
+
+            # Take a slot on the rider unless the order already counts towards its load
+            keeps_slot = order['rider_id'] == rider['rider_id'] and order['status'] == ASSIGNED
+            if not keeps_slot and not registry.reserve(rider['rider_id']):
+                return 'Rider is unavailable or at capacity', 409
 
             # Update order with rider assignment
-            cursor.execute("""
+            cursor.execute(f"""
                 UPDATE orders
                 SET rider_id = ?,
                     estimated_delivery_time = ?,
                     status = 'assigned'
-                WHERE order_id = ?
+                WHERE order_id = ? AND (? OR {rider_registry.CAPACITY_GUARD})
             """, (
                 data['rider_id'],
                 data['estimated_time'],
-                data['order_id']
+                data['order_id'],
+                keeps_slot,
+                rider['rider_id'],
+                rider_registry.MAX_ACTIVE_ORDERS
             ))
+            if cursor.rowcount == 0:
+                registry.release(rider['rider_id'])
+                registry.expire()
+                return 'Rider is unavailable or at capacity', 409
+            touch('order', data['order_id'])
+            publish_order_event(order['order_id'], 'assigned', user_id=order['user_id'], rider_id=rider['rider_id'],
+                                estimated_delivery_time=data['estimated_time'])
+            if not keeps_slot:
+                # The previous rider, if the order was active, gives up its slot
+                registry.status_changed(order['rider_id'], order['status'], 'unassigned')
+            return None, None
+
+        error, status = submit_write(write)
+        if error:
+            return jsonify({'error': error}), status
 
-            return jsonify({
-                'message': 'Rider assigned successfully',
-                'order_id': data['order_id'],
-                'rider_id': data['rider_id'],
-                'estimated_time': data['estimated_time']
-            })
+        return jsonify({
+            'message': 'Rider assigned successfully',
+            'order_id': data['order_id'],
+            'rider_id': data['rider_id'],
+            'estimated_time': data['estimated_time']
+        })
 
     except Exception as e:
         print(f"Error assigning rider: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 
-@order_routes.route('/api/riders/available', methods=['GET'])
-def get_available_riders():
-    with db_cursor() as cursor:
-        cursor.execute("""
-            SELECT r.*,
-                   COUNT(o.order_id) as active_orders
-            FROM riders r
-            LEFT JOIN orders o ON r.rider_id = o.rider_id
-            AND o.status = 'in_progress'
-            WHERE r.is_available = 1
-            GROUP BY r.rider_id
-            HAVING active_orders < 3
-        """)
-        return jsonify([dict(row) for row in cursor.fetchall()])
+@order_routes.route('/api/dispatch/run', methods=['POST'])
+def run_dispatch():
+    """Assign all pending orders to riders now, as one dispatch window would."""
+    try:
+        return jsonify(DispatchService.dispatch_pending())
+    except Exception as e:
+        print(f"Error dispatching orders: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
@@ -1,8 +1,15 @@
+import io
 from flask import Blueprint, request, jsonify,render_template
 from datetime import datetime
 from models.restaurant import Restaurant
 from models.restaurant import Restaurant  # ensure this is imported
 from db import db_cursor
+from models import open_hours, search
+from utils import next_cursor, parse_page_args
+from http_cache import conditional, version_tag
+from geo import resolve
+from services.import_service import FORMATS, ImportService
+from services.matching_service import MatchingService
 restaurant_routes = Blueprint('restaurant_routes', __name__)
 
 @restaurant_routes.route('/register_restaurant', methods=['POST'])
@@ -16,6 +23,7 @@ def register_restaurant():
         - food_type (str): Type of cuisine (e.g., 'Italian')
         - prep_time (int, optional): Food preparation time in minutes (default: 10)
         - menu_items (list, optional): List of menu items, each as a dict with 'item_name' and 'price'
+        - lat, lon (float, optional): Coordinates; geocoded from location if omitted
 
     Returns:
         JSON: Restaurant ID and success message, or error message
@@ -32,7 +40,8 @@ def register_restaurant():
             return jsonify({"error": "Menu items must be a list of dicts with 'item_name' and 'price'"}), 400
 
         # Register the restaurant along with its menu items
-        restaurant = Restaurant.register(data['name'], data['location'], data['food_type'], prep_time, menu_items)
+        restaurant = Restaurant.register(data['name'], data['location'], data['food_type'], prep_time, menu_items,
+                                         data.get('lat'), data.get('lon'))
 
         return jsonify({
             "restaurant_id": restaurant.restaurant_id,
@@ -70,7 +79,42 @@ def add_menu_item():
     except Exception as e:
         return jsonify({"error": "Internal server error"}), 500
 
+# Request Content-Types accepted by the bulk import, and their format
+IMPORT_CONTENT_TYPES = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+}
+
+@restaurant_routes.route('/api/restaurants/import', methods=['POST'])
+def import_restaurants():
+    """
+    Bulk import restaurants and menu items from a CSV or NDJSON body.
+
+    The body is streamed and written in chunks, so files of any size can be
+    sent; see ImportService.import_records for the record fields.
+
+    Query Parameters:
+        - format (str, optional): 'csv' or 'ndjson'; taken from the Content-Type if omitted
+
+    Returns:
+        JSON: Counts of records, restaurants and menu items created and
+            records failed, with the first errors and their line numbers
+    """
+    file_format = request.args.get('format') or IMPORT_CONTENT_TYPES.get(request.mimetype)
+    if file_format not in FORMATS:
+        return jsonify({"error": "Send text/csv or application/x-ndjson, or pass format=csv|ndjson"}), 415
+
+    try:
+        lines = io.TextIOWrapper(io.BufferedReader(request.stream), encoding='utf-8', newline='')
+        return jsonify(ImportService.import_records(FORMATS[file_format](lines)))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 @restaurant_routes.route('/menu/<int:restaurant_id>', methods=['GET'])
+@conditional(lambda restaurant_id: version_tag('menu-page', restaurant_id, ('menu', restaurant_id)),
+             cache_control='public, max-age=30')
 def get_menu(restaurant_id):
     """
     Fetch the menu for a restaurant.
@@ -82,15 +126,41 @@ def get_menu(restaurant_id):
         JSON: List of menu items with details
     """
     try:
-        restaurant = Restaurant.get_by_id(restaurant_id)
-        if not restaurant:
+        entry = Restaurant.get_cached_menu(restaurant_id)
+        if not entry:
             return jsonify({"error": "Restaurant not found"}), 404
 
-        menu = Restaurant.get_menu(restaurant_id)
         return jsonify({
             "restaurant_id": restaurant_id,
-            "restaurant_name": restaurant.name,
-            "menu": menu
+            "restaurant_name": entry['restaurant_name'],
+            "menu": entry['menu']
+        }), 200
+    except Exception as e:
+        return jsonify({"error": "Internal server error"}), 500
+
+
+@restaurant_routes.route('/api/restaurant/<int:restaurant_id>/top_items', methods=['GET'])
+def get_top_items(restaurant_id):
+    """
+    Best-selling menu items of a restaurant.
+
+    Query Parameters:
+        - limit (int, optional): Number of items (default 10, max 100)
+
+    Returns:
+        JSON: Items ranked by quantity ordered, with order count and revenue
+    """
+    try:
+        limit = min(int(request.args.get('limit', 10)), 100)
+        if limit <= 0:
+            raise ValueError
+    except ValueError:
+        return jsonify({"error": "limit must be a positive integer"}), 400
+
+    try:
+        return jsonify({
+            "restaurant_id": restaurant_id,
+            "top_items": Restaurant.get_top_items(restaurant_id, limit)
         }), 200
     except Exception as e:
         return jsonify({"error": "Internal server error"}), 500
@@ -100,27 +170,59 @@ def get_menu(restaurant_id):
 @restaurant_routes.route('/restaurants')
 def get_all_restaurants():
     try:
-        # Fetch all restaurants from the database
+        limit, after = parse_page_args(request.args)
+    except ValueError as e:
+        return render_template('restaurant.html', error=str(e))
+
+    try:
+        # Fetch one page of restaurants from the database, in primary key order
         with db_cursor() as cursor:
-            cursor.execute("SELECT * FROM restaurants")
-            restaurants = cursor.fetchall()
+            cursor.execute(
+                "SELECT * FROM restaurants WHERE restaurant_id > ? ORDER BY restaurant_id LIMIT ?",
+                (after[0] if after else 0, limit + 1)
+            )
+            restaurants, cursor_token = next_cursor(cursor.fetchall(), limit, key=lambda row: (row['restaurant_id'],))
 
         # If no restaurants are found, return an error message
         if not restaurants:
             return render_template('restaurant.html', error="No restaurants found.")
 
         # Render the restaurants page with restaurant data
-        return render_template('restaurant.html', restaurants=restaurants)
+        return render_template('restaurant.html', restaurants=restaurants, next_cursor=cursor_token, limit=limit)
 
     except Exception as e:
         print(f"Error: {e}")
         return render_template('restaurant.html', error="Error loading restaurants.")
 
 
+def _search_etag():
+    # Open/closed flags change with the clock, so the minute is part of the tag
+    page = [request.args.get(arg, '') for arg in ('limit', 'after', 'open_now')]
+    return version_tag('search', ('restaurants', 'all'), datetime.now().strftime('%Y%m%d%H%M'), *page)
+
+
 @restaurant_routes.route('/api/restaurants/search')
+@conditional(_search_etag)
 def search_restaurants():
-    current_hour = datetime.now().hour
-    current_time = datetime.now().strftime('%H:%M')
+    """
+    Restaurants serving the current meal period, flagged open or closed now.
+
+    Query Parameters:
+        - limit (int, optional): Page size (default 50, max 200)
+        - after (str, optional): next_cursor from the previous page
+        - open_now (bool, optional): Only restaurants open right now
+
+    Returns:
+        JSON: One page of restaurants in id order, and next_cursor
+    """
+    try:
+        limit, after = parse_page_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    open_only = request.args.get('open_now', '').lower() in ('1', 'true', 'yes')
+
+    now = datetime.now()
+    current_hour = now.hour
 
     # Determine meal period
     if 6 <= current_hour < 11:
@@ -130,21 +232,122 @@ def search_restaurants():
     else:
         meal_period = 'dinner'
 
-    with db_cursor() as cursor:
-        cursor.execute("""
-            SELECT r.*,
-                   CASE
-                       WHEN time(?) BETWEEN r.opening_time AND r.closing_time THEN 1
-                       ELSE 0
-                   END as is_open,
-                   CASE
-                       WHEN ? = 'breakfast' THEN r.serves_breakfast
-                       WHEN ? = 'lunch' THEN r.serves_lunch
-                       WHEN ? = 'dinner' THEN r.serves_dinner
-                   END as serves_current_meal
-            FROM restaurants r
-            WHERE serves_current_meal = 1
-        """, (current_time, meal_period, meal_period, meal_period))
-
-        restaurants = [dict(row) for row in cursor.fetchall()]
-        return jsonify(restaurants)
+    # One page of the restaurants serving the current meal, flagged open or closed right now
+    restaurants, cursor_token = next_cursor(
+        open_hours.get_index().serving(meal_period, current_hour * 60 + now.minute, limit=limit + 1,
+                                       after=after[0] if after else None, open_only=open_only),
+        limit,
+        key=lambda row: (row['restaurant_id'],)
+    )
+    return jsonify({"restaurants": restaurants, "next_cursor": cursor_token})
+
+
+@restaurant_routes.route('/api/search')
+def search_menu():
+    """
+    Full-text search over dishes and restaurants, best match first.
+
+    Query Parameters:
+        - q (str): Search words; each matches as a prefix
+        - type (str, optional): 'dish' or 'restaurant' to search one kind only
+        - limit (int, optional): Page size (default 50, max 200)
+        - after (str, optional): next_cursor from the previous page
+
+    Returns:
+        JSON: One page of results, and next_cursor
+    """
+    try:
+        limit, after = parse_page_args(request.args, key_size=2)
+        rows = search.search(request.args.get('q', ''), kind=request.args.get('type') or None,
+                             limit=limit + 1, after=tuple(after) if after else None)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    results, cursor_token = next_cursor(rows, limit, key=search.cursor_key)
+    return jsonify({"results": results, "next_cursor": cursor_token})
+
+
+# Default and largest accepted max_delivery_time, in minutes
+DEFAULT_MAX_DELIVERY_MINUTES = 45
+MAX_DELIVERY_MINUTES = 120
+
+
+@restaurant_routes.route('/suggest_restaurants', methods=['POST'])
+def suggest_restaurants():
+    """
+    Suggest restaurants that can deliver to a location, fastest first.
+
+    Request Body:
+        - location (str): Delivery address; or lat and lon (float)
+        - food_type (str or list, optional): Cuisine or cuisines; all if omitted
+        - max_delivery_time (int, optional): Maximum ETA in minutes (default 45, max 120)
+        - open_now (bool, optional): Only restaurants open now (default true)
+        - limit (int, optional): Page size (default 50, max 200)
+        - after (str, optional): next_cursor from the previous page
+
+    Returns:
+        JSON: One page of restaurants with estimated_delivery_time, and next_cursor
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "A JSON body is required"}), 400
+    if not data.get('location') and (data.get('lat') is None or data.get('lon') is None):
+        return jsonify({"error": "A location or lat and lon are required"}), 400
+    try:
+        limit, after = parse_page_args(data, key_size=2)
+        lat, lon = resolve(data.get('location'), data.get('lat'), data.get('lon'))
+        max_minutes = int(data.get('max_delivery_time', DEFAULT_MAX_DELIVERY_MINUTES))
+        if not 0 < max_minutes <= MAX_DELIVERY_MINUTES:
+            raise ValueError(f"max_delivery_time must be between 1 and {MAX_DELIVERY_MINUTES} minutes")
+        food_type = data.get('food_type')
+        if food_type is not None and not isinstance(food_type, (str, list)):
+            raise ValueError("food_type must be a string or a list of strings")
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        restaurants, cursor_token = next_cursor(
+            MatchingService.suggest_restaurants((lat, lon), food_type or None, max_minutes, limit=limit + 1,
+                                                after=tuple(after) if after else None,
+                                                open_now=bool(data.get('open_now', True))),
+            limit,
+            key=lambda row: (row['estimated_delivery_time'], row['restaurant_id'])
+        )
+        return jsonify({"restaurants": restaurants, "next_cursor": cursor_token})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@restaurant_routes.route('/api/restaurant/<int:restaurant_id>/hours', methods=['PUT'])
+def update_hours(restaurant_id):
+    """
+    Change a restaurant's opening hours.
+
+    Request Body:
+        - opening_time (str): Opening time, 'HH:MM'
+        - closing_time (str): Closing time, 'HH:MM'; earlier than opening_time
+          for windows that run past midnight
+        - serves_breakfast, serves_lunch, serves_dinner (bool, optional)
+
+    Returns:
+        JSON: Success message or error message
+    """
+    try:
+        data = request.get_json()
+        if not data or 'opening_time' not in data or 'closing_time' not in data:
+            return jsonify({"error": "Opening and closing times are required"}), 400
+
+        updated = Restaurant.update_hours(
+            restaurant_id, data['opening_time'], data['closing_time'],
+            data.get('serves_breakfast'), data.get('serves_lunch'), data.get('serves_dinner')
+        )
+        if not updated:
+            return jsonify({"error": "Restaurant not found"}), 404
+
+        return jsonify({"message": "Opening hours updated"}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": "Internal server error"}), 500
@@ -1,7 +1,8 @@
 from flask import Blueprint, request, jsonify, render_template
 from models.rider import Rider
+from models import location_buffer, rider_registry
 from models.order import Order
-from utils import format_order_details
+from utils import format_order_details, next_cursor, parse_page_args
 import logging
 from models.restaurant import Restaurant
 from db import db_cursor
@@ -25,13 +26,13 @@ def register_rider():
         if not name or not location:
             return jsonify({"error": "Name and location are required!"}), 400
 
-        # Insert the new rider into the database
-        with db_cursor() as cursor:
-            cursor.execute('''INSERT INTO riders (name, location) VALUES (?, ?)''', (name, location))
-            rider_id = cursor.lastrowid
+        # Insert the new rider; lat/lon are optional and geocoded from location otherwise
+        rider = Rider.register(name, location, data.get('lat'), data.get('lon'))
 
-        return jsonify({"message": "Rider registered!", "rider_id": rider_id})
+        return jsonify({"message": "Rider registered!", "rider_id": rider.rider_id})
 
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -50,16 +51,62 @@ def update_rider_location():
         rider_id = data['rider_id']
         location = data['location']
 
-        if Rider.update_location(rider_id, location):
+        if Rider.update_location(rider_id, location, data.get('lat'), data.get('lon')):
             logger.info(f"Rider location updated: ID={rider_id}, Location={location}")
             return jsonify({"message": "Rider location updated successfully"}), 200
         else:
             logger.warning(f"Rider not found: ID={rider_id}")
             return jsonify({"error": "Rider not found"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Unexpected error in update_rider_location: {str(e)}", exc_info=True)
         return jsonify({"error": "Internal server error"}), 500
 
+# Largest number of pings accepted in one batch
+MAX_LOCATION_BATCH = 10_000
+
+# Route to report many rider positions at once
+@rider_routes.route('/api/riders/locations', methods=['POST'])
+def report_rider_locations():
+    """
+    Buffer a batch of rider location pings.
+
+    Request Body:
+        - locations (list): Pings, each a dict with rider_id and lat/lon
+          and/or location (geocoded when lat/lon are omitted)
+
+    Pings are coalesced per rider and written to the database within
+    LOCATION_FLUSH_SECONDS; matching sees them immediately.
+
+    Returns:
+        JSON: Number of pings accepted and the rejected ones with a reason (202)
+    """
+    data = request.get_json(silent=True)
+    pings = data.get('locations') if isinstance(data, dict) else None
+    if not isinstance(pings, list):
+        return jsonify({"error": "A 'locations' list is required"}), 400
+    if len(pings) > MAX_LOCATION_BATCH:
+        return jsonify({"error": f"At most {MAX_LOCATION_BATCH} locations per request"}), 400
+
+    try:
+        registry = rider_registry.get_registry()
+        accepted, rejected = 0, []
+        for ping in pings:
+            rider_id = ping.get('rider_id') if isinstance(ping, dict) else None
+            if registry.get(rider_id) is None:
+                rejected.append({"rider_id": rider_id, "error": "Rider not found"})
+                continue
+            try:
+                location_buffer.buffer.put(rider_id, ping.get('location'), ping.get('lat'), ping.get('lon'))
+                accepted += 1
+            except (TypeError, ValueError) as e:
+                rejected.append({"rider_id": rider_id, "error": str(e)})
+        return jsonify({"accepted": accepted, "rejected": rejected}), 202
+    except Exception as e:
+        logger.error(f"Unexpected error in report_rider_locations: {str(e)}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
+
 # Route to fetch orders for a rider
 @rider_routes.route('/rider/<int:rider_id>/orders', methods=['GET'])
 def get_rider_orders(rider_id):
@@ -70,10 +117,21 @@ def get_rider_orders(rider_id):
             logger.warning(f"Rider not found: rider_id={rider_id}")
             return jsonify({"error": "Rider not found"}), 404
 
-        orders = Order.get_rider_orders(rider_id)
+        try:
+            limit, after = parse_page_args(request.args, key_size=2)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        orders, cursor = next_cursor(
+            Order.get_rider_orders(rider_id, limit=limit + 1, after=after),
+            limit,
+            key=lambda order: (order.order_time, order.order_id)
+        )
+        # One batched lookup for every restaurant in the history instead of one per order
+        restaurants = Restaurant.get_many(order.restaurant_id for order in orders)
         formatted_orders = []
         for order in orders:
-            restaurant = Restaurant.get_by_id(order.restaurant_id)
+            restaurant = restaurants.get(order.restaurant_id)
             order_dict = {
                 "order_id": order.order_id,
                 "restaurant_name": restaurant.name if restaurant else "Unknown",
@@ -87,7 +145,8 @@ def get_rider_orders(rider_id):
         logger.info(f"Retrieved {len(orders)} orders for rider_id={rider_id}")
         return jsonify({
             "rider_id": rider_id,
-            "orders": formatted_orders
+            "orders": formatted_orders,
+            "next_cursor": cursor
         }), 200
     except Exception as e:
         logger.error(f"Unexpected error in get_rider_orders: {str(e)}", exc_info=True)
@@ -97,17 +156,25 @@ def get_rider_orders(rider_id):
 @rider_routes.route('/riders')
 def get_all_riders():
     try:
-        # Fetch all riders from the database
+        limit, after = parse_page_args(request.args)
+    except ValueError as e:
+        return render_template('riders.html', error=str(e))
+
+    try:
+        # Fetch one page of riders from the database, in primary key order
         with db_cursor() as cursor:
-            cursor.execute("SELECT * FROM riders")
-            riders = cursor.fetchall()
+            cursor.execute(
+                "SELECT * FROM riders WHERE rider_id > ? ORDER BY rider_id LIMIT ?",
+                (after[0] if after else 0, limit + 1)
+            )
+            riders, cursor_token = next_cursor(cursor.fetchall(), limit, key=lambda row: (row['rider_id'],))
 
         # If no riders are found, return an error message
         if not riders:
             return render_template('riders.html', error="No riders found.")
 
         # Render the riders page with rider data
-        return render_template('riders.html', riders=riders)
+        return render_template('riders.html', riders=riders, next_cursor=cursor_token, limit=limit)
 
     except Exception as e:
         print(f"Error: {e}")
@@ -115,9 +182,5 @@ def get_all_riders():
 
 @rider_routes.route('/api/riders/available')
 def get_available_riders():
-    with db_cursor() as cursor:
-        cursor.execute("""
-            SELECT * FROM riders
-            WHERE is_available = 1
-        """)
-        return jsonify([dict(row) for row in cursor.fetchall()])
+    """Available riders with spare capacity, read from the rider registry's counters."""
+    return jsonify(rider_registry.get_registry().available())
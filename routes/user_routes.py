@@ -1,7 +1,7 @@
 from flask import Blueprint, request, jsonify, render_template
 from models.user import User
 from models.order import Order
-from utils import format_order_details
+from utils import format_order_details, next_cursor, parse_page_args
 import logging
 from models.restaurant import Restaurant
 from models.user import User
@@ -20,6 +20,7 @@ def register_user():
     Request Body:
         - name (str): User's name
         - location (str): User's location (e.g., 'Downtown')
+        - lat, lon (float, optional): Coordinates; geocoded from location if omitted
 
     Returns:
         JSON: User ID and success message, or error message
@@ -33,7 +34,7 @@ def register_user():
             logger.warning("Missing name or location in request")
             return jsonify({"error": "Name and location are required"}), 400
 
-        user = User.register(data['name'], data['location'])
+        user = User.register(data['name'], data['location'], data.get('lat'), data.get('lon'))
         logger.info(f"User registered successfully: ID={user.user_id}")
         return jsonify({
             "user_id": user.user_id,
@@ -53,9 +54,13 @@ def get_user_orders(user_id):
     
     Path Parameters:
         - user_id (int): User's ID
+
+    Query Parameters:
+        - limit (int, optional): Page size (default 50, max 200)
+        - after (str, optional): next_cursor from the previous page
     
     Returns:
-        JSON: List of user's orders with details
+        JSON: One page of the user's orders, newest first, and next_cursor
     """
     try:
         logger.debug(f"Fetching orders for user_id={user_id}")
@@ -64,10 +69,21 @@ def get_user_orders(user_id):
             logger.warning(f"User not found: user_id={user_id}")
             return jsonify({"error": "User not found"}), 404
         
-        orders = Order.get_user_orders(user_id)
+        try:
+            limit, after = parse_page_args(request.args, key_size=2)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        orders, cursor = next_cursor(
+            Order.get_user_orders(user_id, limit=limit + 1, after=after),
+            limit,
+            key=lambda order: (order.order_time, order.order_id)
+        )
+        # One batched lookup for every restaurant in the history instead of one per order
+        restaurants = Restaurant.get_many(order.restaurant_id for order in orders)
         formatted_orders = []
         for order in orders:
-            restaurant = Restaurant.get_by_id(order.restaurant_id)
+            restaurant = restaurants.get(order.restaurant_id)
             order_dict = {
                 "order_id": order.order_id,
                 "restaurant_name": restaurant.name if restaurant else "Unknown",
@@ -81,7 +97,8 @@ def get_user_orders(user_id):
         logger.info(f"Retrieved {len(orders)} orders for user_id={user_id}")
         return jsonify({
             "user_id": user_id,
-            "orders": formatted_orders
+            "orders": formatted_orders,
+            "next_cursor": cursor
         }), 200
     except Exception as e:
         logger.error(f"Unexpected error in get_user_orders: {str(e)}", exc_info=True)
@@ -90,17 +107,25 @@ def get_user_orders(user_id):
 @user_routes.route('/users')
 def get_all_users():
     try:
-        # Fetch all users from the database
+        limit, after = parse_page_args(request.args)
+    except ValueError as e:
+        return render_template('users.html', error=str(e))
+
+    try:
+        # Fetch one page of users from the database, in primary key order
         with db_cursor() as cursor:
-            cursor.execute("SELECT * FROM users")
-            users = cursor.fetchall()  # Fetch all rows as a list of dictionaries
+            cursor.execute(
+                "SELECT * FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                (after[0] if after else 0, limit + 1)
+            )
+            users, cursor_token = next_cursor(cursor.fetchall(), limit, key=lambda row: (row['user_id'],))  # Fetch all rows as a list of dictionaries
 
         # If no users are found, return an error message
         if not users:
             return render_template('users.html', error="No users found.")
 
         # Render the users page with user data
-        return render_template('users.html', users=users)
+        return render_template('users.html', users=users, next_cursor=cursor_token, limit=limit)
 
     except Exception as e:
         print(f"Error: {e}")
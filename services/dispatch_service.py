@@ -0,0 +1,341 @@
+"""
+Windowed batch dispatch of pending orders to riders.
+
+Instead of handing each order to the nearest free rider the moment it is
+placed, orders are left pending and a dispatcher thread wakes up every
+DISPATCH_WINDOW_SECONDS to assign everything that accumulated at once. The
+assignment is a min-cost matching between orders and free rider slots (a
+rider with capacity for c more orders offers c slots, each later slot
+waiting longer), solved with an auction algorithm vectorized with NumPy.
+An order may also stay unassigned at a fixed penalty, in which case it
+waits for the next window.
+
+Batch dispatch is opt-in: set DISPATCH_WINDOW_SECONDS (e.g. 2-10) to enable
+it; with the default of 0 orders are assigned immediately as before.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from cache import touch
+from db import db_cursor, submit_write
+from event_bus import publish_order_event
+from models import rider_registry
+from travel import get_model
+
+logger = logging.getLogger(__name__)
+
+DISPATCH_WINDOW_SECONDS = float(os.environ.get('DISPATCH_WINDOW_SECONDS', '0'))
+MAX_BATCH_ORDERS = 20_000
+# Extra minutes an order waits for each order already in the rider's bag
+STACK_MINUTES = 10.0
+# Cost of leaving an order for the next window
+DEFER_PENALTY_MINUTES = 90.0
+# Bid increment in minutes; the plan is within this much per order of optimal
+AUCTION_EPSILON = 0.5
+
+
+def batch_dispatch_enabled() -> bool:
+    """True if order placement should leave rider assignment to the dispatcher."""
+    return DISPATCH_WINDOW_SECONDS > 0
+
+
+def auction(benefit: np.ndarray, bidder_class: np.ndarray, capacity: np.ndarray, reserve: float,
+            epsilon: float = AUCTION_EPSILON) -> np.ndarray:
+    """
+    Maximum-benefit assignment of bidders to multi-unit objects by auction.
+
+    Object t has capacity[t] identical units; while all of them are held its
+    price is the lowest bid holding one. Bidders of the same class value
+    objects the same way, so benefits are stored once per class. All
+    unassigned bidders bid in each round (Jacobi auction); the result is
+    within len(bidder_class) * epsilon of the optimum.
+
+    Args:
+        benefit (np.ndarray): (classes, objects) benefit of a unit of each
+            object to a bidder of each class
+        bidder_class (np.ndarray): (n,) class of each bidder
+        capacity (np.ndarray): (objects,) units of each object
+        reserve (float): Benefit of staying unassigned
+        epsilon (float): Bid increment
+
+    Returns:
+        np.ndarray: (n,) object assigned to each bidder, or -1
+    """
+    n = len(bidder_class)
+    n_objects = benefit.shape[1]
+    prices = np.zeros(n_objects)
+    assigned = np.full(n, -1)
+    holding_bid = np.zeros(n)
+    bidders = np.arange(n)
+    while bidders.size:
+        values = benefit[bidder_class[bidders]] - prices
+        rows = np.arange(bidders.size)
+        best = values.argmax(axis=1)
+        best_value = values[rows, best]
+        values[rows, best] = -np.inf
+        second_value = np.maximum(values.max(axis=1), reserve) if n_objects > 1 else np.full(rows.size, reserve)
+
+        # Staying unassigned beats every object: the bidder drops out for
+        # good, since prices never fall
+        keep = best_value > reserve
+        bidders, best = bidders[keep], best[keep]
+        if not bidders.size:
+            break
+        bids = prices[best] + (best_value[keep] - second_value[keep]) + epsilon
+
+        # Current holders and new bidders of each object compete for its units
+        holders = np.nonzero(np.isin(assigned, np.unique(best)))[0]
+        contenders = np.concatenate((holders, bidders))
+        wanted = np.concatenate((assigned[holders], best))
+        offered = np.concatenate((holding_bid[holders], bids))
+        order = np.lexsort((-offered, wanted))
+        wanted, offered, contenders = wanted[order], offered[order], contenders[order]
+        first = np.r_[True, wanted[1:] != wanted[:-1]]
+        rank = np.arange(wanted.size) - np.maximum.accumulate(np.where(first, np.arange(wanted.size), 0))
+        wins = rank < capacity[wanted]
+
+        assigned[contenders[~wins]] = -1
+        assigned[contenders[wins]] = wanted[wins]
+        holding_bid[contenders[wins]] = offered[wins]
+        full = np.bincount(wanted[wins], minlength=n_objects) >= capacity
+        lowest = np.full(n_objects, np.inf)
+        np.minimum.at(lowest, wanted[wins], offered[wins])
+        touched = np.unique(wanted)
+        prices[touched] = np.where(full[touched], lowest[touched], 0.0)
+        bidders = contenders[~wins]
+    return assigned
+
+
+def plan_assignments(order_zones, prep_times, delivery_minutes, rider_zones, rider_free, rider_load,
+                     model=None) -> tuple:
+    """
+    Solve one dispatch window.
+
+    Free rider slots with the same zone and queue position are
+    interchangeable, and so are orders from the same restaurant zone with
+    the same preparation time, so the auction runs between those classes
+    rather than individual slots: its size is bounded by the number of zones,
+    not by the number of orders and riders.
+
+    Args:
+        order_zones (array): Travel-model zone of each order's restaurant
+        prep_times (array): Preparation minutes of each order
+        delivery_minutes (array): Restaurant-to-customer minutes of each order
+        rider_zones (array): Travel-model zone of each rider
+        rider_free (array): Orders each rider can still take
+        rider_load (array): Orders each rider already carries
+        model (TravelModel, optional): Travel model; the shared one by default
+
+    Returns:
+        tuple: (rider index per order or -1, delivery minutes per order),
+            both arrays indexed like the orders
+    """
+    model = model or get_model()
+    order_zones = np.asarray(order_zones)
+    n = len(order_zones)
+    rider_free = np.asarray(rider_free)
+    if not n or not (rider_free > 0).any():
+        return np.full(n, -1), np.zeros(n)
+
+    # One slot per order a rider can still take; its k-th free slot queues
+    # behind the k orders ahead of it
+    slot_rider = np.repeat(np.arange(len(rider_free)), np.maximum(rider_free, 0))
+    first_slot = np.repeat(np.cumsum(np.maximum(rider_free, 0)) - np.maximum(rider_free, 0), np.maximum(rider_free, 0))
+    slot_stack = np.asarray(rider_load)[slot_rider] + np.arange(len(slot_rider)) - first_slot
+    slot_types, slot_type = np.unique(np.stack((np.asarray(rider_zones)[slot_rider], slot_stack), axis=1),
+                                      axis=0, return_inverse=True)
+    slot_type = slot_type.ravel()
+    capacity = np.bincount(slot_type, minlength=len(slot_types))
+
+    order_classes, order_class = np.unique(np.stack((order_zones, np.asarray(prep_times, dtype=np.int64)), axis=1),
+                                           axis=0, return_inverse=True)
+    order_class = order_class.ravel()
+
+    # Minutes until the order is picked up: the later of the food being
+    # ready and the rider reaching the restaurant after its earlier orders
+    arrival = model.minutes[slot_types[:, 0][None, :], order_classes[:, 0][:, None]] \
+        + STACK_MINUTES * slot_types[:, 1][None, :]
+    ready = np.maximum(order_classes[:, 1][:, None], arrival)
+
+    # Delivery minutes are the same whichever rider is chosen, so they do not
+    # enter the auction; an order is only left for the next window if every
+    # rider would take longer than the penalty
+    won = auction(-ready, order_class, capacity, -DEFER_PENALTY_MINUTES)
+
+    riders = np.full(n, -1)
+    minutes = np.zeros(n)
+    slots_by_type = np.argsort(slot_type, kind='stable')
+    type_start = np.r_[0, np.cumsum(capacity)[:-1]]
+    for t in np.unique(won[won >= 0]):
+        winners = np.nonzero(won == t)[0]
+        riders[winners] = slot_rider[slots_by_type[type_start[t]:type_start[t] + len(winners)]]
+        minutes[winners] = ready[order_class[winners], t] + np.asarray(delivery_minutes)[winners]
+    return riders, minutes
+
+
+class DispatchService:
+    """Service to assign pending orders to riders in batches."""
+
+    @staticmethod
+    def _pending_orders(limit: int, order_ids=None) -> list:
+        only = "AND o.order_id IN (SELECT value FROM json_each(?))" if order_ids is not None else ""
+        with db_cursor() as cursor:
+            cursor.execute(f"""
+                SELECT o.order_id, o.user_id, r.lat, r.lon, r.prep_time,
+                       COALESCE(u.lat, r.lat) AS to_lat, COALESCE(u.lon, r.lon) AS to_lon
+                FROM orders o
+                JOIN restaurants r ON r.restaurant_id = o.restaurant_id
+                LEFT JOIN users u ON u.user_id = o.user_id
+                WHERE o.status = 'pending' AND +o.rider_id IS NULL  -- "+": scan idx_orders_pending
+                {only}
+                ORDER BY o.order_id
+                LIMIT ?
+            """, ((json.dumps(list(order_ids)),) if order_ids is not None else ()) + (limit,))
+            return cursor.fetchall()
+
+    @staticmethod
+    def _assign(orders: list) -> tuple:
+        """
+        Plan and commit rider assignments for pending order rows.
+
+        Returns:
+            tuple: (riders considered, {order_id: (rider_id, estimated_time)}
+                of the orders assigned, solver time in milliseconds)
+        """
+        registry = rider_registry.get_registry()
+        riders = registry.available()
+
+        model = get_model()
+        started = time.process_time()
+        capacity = rider_registry.MAX_ACTIVE_ORDERS
+        load = np.array([row['active_orders'] for row in riders], dtype=np.int64)
+        order_columns = list(zip(*((o['lat'], o['lon'], o['prep_time'], o['to_lat'], o['to_lon']) for o in orders)))
+        rider_columns = list(zip(*((r['lat'], r['lon']) for r in riders))) or [(), ()]
+        order_zones = model.zones(order_columns[0], order_columns[1])
+        delivery = model.minutes[order_zones, model.zones(order_columns[3], order_columns[4])]
+        chosen, minutes = plan_assignments(
+            order_zones, order_columns[2], delivery,
+            model.zones(rider_columns[0], rider_columns[1]), np.maximum(capacity - load, 0), load, model
+        )
+        solve_ms = (time.process_time() - started) * 1000
+
+        users = {order['order_id']: order['user_id'] for order in orders}
+        plan = sorted(((float(minutes[i]), orders[i]['order_id'], riders[chosen[i]]['rider_id'])
+                       for i in np.nonzero(chosen >= 0)[0]))
+
+        def write(cursor):
+            assigned = {}
+            for eta, order_id, rider_id in plan:
+                if not registry.reserve(rider_id):
+                    continue
+                estimated_time = int(np.ceil(eta))
+                # Skip orders assigned or cancelled since they were read, and
+                # riders another worker filled up
+                cursor.execute(f"""
+                    UPDATE orders
+                    SET rider_id = ?, estimated_delivery_time = ?, status = 'assigned'
+                    WHERE order_id = ? AND status = 'pending' AND rider_id IS NULL
+                    AND {rider_registry.CAPACITY_GUARD}
+                """, (rider_id, estimated_time, order_id, rider_id, capacity))
+                if cursor.rowcount:
+                    assigned[order_id] = (rider_id, estimated_time)
+                    touch('order', order_id)
+                    publish_order_event(order_id, 'assigned', user_id=users[order_id], rider_id=rider_id,
+                                        estimated_delivery_time=estimated_time)
+                else:
+                    registry.release(rider_id)
+            return assigned
+
+        # Only the plan's updates run on the writer thread; the solve above does not hold it up
+        return len(riders), submit_write(write), solve_ms
+
+    @staticmethod
+    def dispatch_pending(limit: int = MAX_BATCH_ORDERS) -> dict:
+        """
+        Assign the pending orders of one window to riders.
+
+        Riders and their loads come from the rider registry, and the plan is
+        solved outside any transaction. It is then committed as one operation
+        of the writer thread that reserves each slot in the registry and re-checks
+        the rider's load in SQL, so a rider that filled up in the meantime
+        is never overbooked, and only counts orders that were still pending
+        and unassigned; the orders that no longer fit stay pending for the
+        next window.
+
+        Args:
+            limit (int): Maximum number of pending orders to consider
+
+        Returns:
+            dict: Counts of pending orders, riders, assigned and deferred
+                orders, and the solver time in milliseconds
+        """
+        orders = DispatchService._pending_orders(limit)
+        if not orders:
+            return {"pending": 0, "riders": 0, "assigned": 0, "deferred": 0, "solve_ms": 0.0}
+        riders, assigned, solve_ms = DispatchService._assign(orders)
+        return {
+            "pending": len(orders),
+            "riders": riders,
+            "assigned": len(assigned),
+            "deferred": len(orders) - len(assigned),
+            "solve_ms": round(solve_ms, 1)
+        }
+
+    @staticmethod
+    def dispatch_orders(order_ids) -> dict:
+        """
+        Assign riders to a group of pending orders right away, as one plan.
+
+        The plan is solved on the calling thread and committed through the
+        writer thread. Orders that get no rider stay pending for the next
+        window.
+
+        Args:
+            order_ids (iterable): IDs of the orders to dispatch
+
+        Returns:
+            dict: {order_id: (rider_id, estimated_time)} of the orders assigned
+        """
+        order_ids = list(order_ids)
+        orders = DispatchService._pending_orders(len(order_ids), order_ids) if order_ids else []
+        if not orders:
+            return {}
+        return DispatchService._assign(orders)[1]
+
+
+class Dispatcher:
+    """Background thread running DispatchService.dispatch_pending every window."""
+
+    def __init__(self, window_seconds: float = DISPATCH_WINDOW_SECONDS):
+        self.window_seconds = window_seconds
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_run = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='dispatcher', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.window_seconds):
+            try:
+                self.last_run = DispatchService.dispatch_pending()
+                if self.last_run['pending']:
+                    logger.info("Dispatch window: %s", self.last_run)
+            except Exception:
+                logger.exception("Dispatch window failed")
+
+
+dispatcher = Dispatcher()
@@ -0,0 +1,226 @@
+import csv
+import json
+import sqlite3
+from cache import touch_many
+from db import on_commit, on_rollback, submit_write
+from geo import resolve
+from models import open_hours, suggestions
+
+# Records validated and written per write operation
+IMPORT_CHUNK_SIZE = 1000
+# Errors listed in a report; later ones are only counted
+MAX_REPORTED_ERRORS = 100
+
+_RESTAURANT_COLUMNS = ('name', 'location', 'food_type', 'prep_time', 'lat', 'lon', 'opening_time', 'closing_time',
+                       'serves_breakfast', 'serves_lunch', 'serves_dinner')
+
+
+def parse_csv(lines):
+    """
+    Records of a CSV file with a header row.
+
+    Args:
+        lines (iterable): Text lines, e.g. an open file
+
+    Yields:
+        tuple: (line number, record dict without empty cells)
+    """
+    reader = csv.DictReader(lines)
+    for row in reader:
+        yield reader.line_num, {key: value.strip() for key, value in row.items()
+                                if key and isinstance(value, str) and value.strip()}
+
+
+def parse_ndjson(lines):
+    """
+    Records of a newline-delimited JSON file, one object per line.
+
+    Yields:
+        tuple: (line number, record dict), or (line number, ValueError) for
+            a line that is not a JSON object
+    """
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_number, ValueError(f"Invalid JSON: {e}")
+            continue
+        if not isinstance(record, dict):
+            yield line_number, ValueError("Each line must be a JSON object")
+            continue
+        yield line_number, record
+
+
+# Parser of each supported file format
+FORMATS = {'csv': parse_csv, 'ndjson': parse_ndjson}
+
+
+def _flag(value) -> int:
+    if isinstance(value, str):
+        value = value.strip().lower() in ('1', 'true', 'yes')
+    return 1 if value else 0
+
+
+class ImportService:
+    """Bulk import of restaurants and menu items."""
+
+    @staticmethod
+    def import_records(records, chunk_size: int = IMPORT_CHUNK_SIZE) -> dict:
+        """
+        Create restaurants and menu items from a stream of records.
+
+        A record names its restaurant by restaurant_id (an existing one) or by
+        name and location. The first record with a new name and location
+        creates the restaurant, so it also needs food_type and may carry
+        prep_time, lat/lon, opening_time/closing_time and serves_* flags;
+        later records with the same name and location add to it. A record
+        adds a menu item when it has item_name and price, and NDJSON records
+        may list several under menu_items.
+
+        Records are validated and written chunk_size at a time, each chunk as
+        one write operation with one executemany for its menu items. A record
+        that fails validation is reported and skipped; a chunk the database
+        rejects is rolled back, reported and the import moves on. Memory use
+        does not grow with the number of records, only with the number of
+        restaurants created.
+
+        Args:
+            records (iterable): (line number, record dict or ValueError) pairs,
+                e.g. from parse_csv or parse_ndjson
+            chunk_size (int): Records per write operation
+
+        Returns:
+            dict: Counts of records read, restaurants and menu items created and
+                records failed, plus up to MAX_REPORTED_ERRORS errors with their line
+        """
+        report = {"records": 0, "restaurants_created": 0, "menu_items_created": 0, "failed": 0, "errors": []}
+        # (name, location) -> restaurant_id of the restaurants this import created
+        created = {}
+        chunk, line = [], 0
+        try:
+            for record in records:
+                chunk.append(record)
+                line = record[0]
+                if len(chunk) >= chunk_size:
+                    ImportService._import_chunk(chunk, created, report)
+                    chunk = []
+        except (UnicodeDecodeError, csv.Error) as e:
+            # Unreadable input: keep what was read so far and stop there
+            ImportService._report_error(report, line + 1, f"Stopped reading: {str(e)}")
+        if chunk:
+            ImportService._import_chunk(chunk, created, report)
+        return report
+
+    @staticmethod
+    def _report_error(report: dict, line: int, error: str):
+        report['failed'] += 1
+        if len(report['errors']) < MAX_REPORTED_ERRORS:
+            report['errors'].append({"line": line, "error": error})
+
+    @staticmethod
+    def _menu_items(record: dict) -> list:
+        """(item_name, price) pairs of a record; raises ValueError if one is invalid."""
+        items = record.get('menu_items') or []
+        if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+            raise ValueError("menu_items must be a list of objects with item_name and price")
+        if record.get('item_name') is not None or record.get('price') is not None:
+            items = [record] + items
+        pairs = []
+        for item in items:
+            name = str(item.get('item_name') or '').strip()
+            try:
+                price = float(item.get('price'))
+            except (TypeError, ValueError):
+                price = 0
+            if not name or not price > 0:
+                raise ValueError("Menu items need an item_name and a positive price")
+            pairs.append((name, price))
+        return pairs
+
+    @staticmethod
+    def _restaurant_values(record: dict) -> tuple:
+        """Column values of a new restaurant, in _RESTAURANT_COLUMNS order; raises ValueError if invalid."""
+        if not record.get('food_type'):
+            raise ValueError("A new restaurant needs name, location and food_type")
+        prep_time = int(record.get('prep_time', 10))
+        if prep_time <= 0:
+            raise ValueError("prep_time must be positive")
+        lat, lon = resolve(record['location'], record.get('lat'), record.get('lon'))
+        hours = []
+        for column, default in (('opening_time', '09:00'), ('closing_time', '22:00')):
+            minute = open_hours.minute_of_day(record.get(column, default))
+            hours.append(f"{minute // 60:02d}:{minute % 60:02d}")
+        flags = [_flag(record.get(f'serves_{meal}', True)) for meal in open_hours.MEALS]
+        return (str(record['name']), str(record['location']), str(record['food_type']), prep_time, lat, lon,
+                *hours, *flags)
+
+    @staticmethod
+    def _import_chunk(chunk: list, created: dict, report: dict):
+        report['records'] += len(chunk)
+        failed_before = report['failed']
+        restaurant_ids = {record['restaurant_id'] for _, record in chunk
+                          if isinstance(record, dict) and isinstance(record.get('restaurant_id'), (int, str))}
+        new_rows, items = [], []
+
+        # The chunk is validated and written as one operation of the writer thread
+        def write(cursor):
+            existing = set()
+            ids = [int(value) for value in restaurant_ids if str(value).isdigit()]
+            if ids:
+                cursor.execute(
+                    f"SELECT restaurant_id FROM restaurants WHERE restaurant_id IN ({','.join('?' for _ in ids)})",
+                    ids
+                )
+                existing = {row['restaurant_id'] for row in cursor.fetchall()}
+
+            for line, record in chunk:
+                try:
+                    if isinstance(record, Exception):
+                        raise record
+                    pairs = ImportService._menu_items(record)
+                    if record.get('restaurant_id') is not None:
+                        restaurant_id = int(record['restaurant_id'])
+                        if restaurant_id not in existing:
+                            raise ValueError(f"Restaurant {restaurant_id} not found")
+                    elif record.get('name') and record.get('location'):
+                        key = (str(record['name']), str(record['location']))
+                        restaurant_id = created.get(key)
+                        if restaurant_id is None:
+                            values = ImportService._restaurant_values(record)
+                            cursor.execute(
+                                f"INSERT INTO restaurants ({', '.join(_RESTAURANT_COLUMNS)}) "
+                                f"VALUES ({', '.join('?' for _ in _RESTAURANT_COLUMNS)}) RETURNING *",
+                                values
+                            )
+                            row = cursor.fetchone()
+                            restaurant_id = created[key] = row['restaurant_id']
+                            new_rows.append(row)
+                            on_rollback(lambda key=key: created.pop(key, None))
+                    else:
+                        raise ValueError("A record needs a restaurant_id, or a name and location")
+                except (TypeError, ValueError) as e:
+                    ImportService._report_error(report, line, str(e))
+                    continue
+                items.extend((restaurant_id, name, price) for name, price in pairs)
+
+            cursor.executemany("INSERT INTO menus (restaurant_id, item_name, price) VALUES (?, ?, ?)", items)
+            keys = [('menu', restaurant_id) for restaurant_id in {item[0] for item in items}]
+            if new_rows:
+                keys.append(('restaurants', 'all'))
+            touch_many(keys)
+            for row in new_rows:
+                on_commit(lambda row=row: open_hours.index.put(row))
+                on_commit(lambda row=row: suggestions.index.put(row))
+
+        try:
+            submit_write(write)
+        except sqlite3.Error as e:
+            # The whole chunk rolled back; count its valid records as failed too
+            first, last = chunk[0][0], chunk[-1][0]
+            report['failed'] = failed_before + len(chunk) - 1
+            ImportService._report_error(report, first, f"Lines {first}-{last} not imported: {str(e)}")
+            return
+        report['restaurants_created'] += len(new_rows)
+        report['menu_items_created'] += len(items)
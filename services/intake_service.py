@@ -0,0 +1,363 @@
+"""
+Asynchronous order intake.
+
+With ORDER_INTAKE_WORKERS set, POST /api/orders only stores the order as
+'received' and answers 202 Accepted with its ID; a pool of worker threads
+then prices it against the menu, moves it to 'pending' (or 'rejected' with
+a reason), assigns the nearest rider and notifies the user, all off the
+request path. A slow matcher or a busy writer thread therefore no longer
+shows up in the placement latency, only in how long an order stays
+'received'. Clients follow progress through GET /api/orders/<id> or the
+order's event stream.
+
+The queue is bounded: while INTAKE_QUEUE_SIZE orders are waiting, new ones
+are refused with 503 instead of piling up. A worker that hits a database
+error retries the order with exponential backoff, up to
+INTAKE_MAX_ATTEMPTS times. Orders left 'received' by a full queue, failed
+retries or a restart are picked up again by a sweep every
+INTAKE_SWEEP_SECONDS; the guarded status update makes processing an order
+twice harmless. Every failed attempt is counted on the order itself, and
+once INTAKE_GIVE_UP_ATTEMPTS have failed the order is rejected, so one that
+can never be processed does not come back with every sweep.
+
+Asynchronous intake is opt-in; with the default of 0 workers orders are
+placed synchronously as before.
+"""
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+
+from cache import touch
+from db import db_cursor, on_commit, submit_write
+from event_bus import publish_order_event
+from models.order_status import RECEIVED, REJECTED
+from services.order_service import OrderService
+
+logger = logging.getLogger(__name__)
+
+ORDER_INTAKE_WORKERS = int(os.environ.get('ORDER_INTAKE_WORKERS', '0'))
+# Received orders waiting for a worker before new ones are refused
+INTAKE_QUEUE_SIZE = int(os.environ.get('INTAKE_QUEUE_SIZE', '10000'))
+INTAKE_MAX_ATTEMPTS = 5
+# Failed attempts, over all retries and sweeps, after which an order is rejected
+INTAKE_GIVE_UP_ATTEMPTS = 15
+# Delay before the first retry; doubled for each later one
+INTAKE_RETRY_SECONDS = 0.5
+# How often orders still 'received' are queued again
+INTAKE_SWEEP_SECONDS = 30
+
+
+def intake_enabled() -> bool:
+    """True if order placement should answer 202 and leave the order to the intake workers."""
+    return ORDER_INTAKE_WORKERS > 0
+
+
+class IntakeService:
+    """Receiving orders and processing them in the background."""
+
+    @staticmethod
+    def receive(restaurant_id: int, items: list, user_id: int = None) -> int:
+        """
+        Store an order as 'received' and queue it for the intake workers.
+
+        Only the restaurant's existence is checked here; the items are priced
+        by the worker that processes the order.
+
+        Args:
+            restaurant_id (int): Restaurant's ID
+            items (list): Cart items, as accepted by OrderService.price_items
+            user_id (int, optional): Ordering user, notified once the order is accepted
+
+        Returns:
+            int: ID of the received order, or None if the restaurant does not exist
+
+        Raises:
+            sqlite3.Error: If database operation fails
+        """
+        def write(cursor):
+            cursor.execute("""
+                INSERT INTO orders (user_id, restaurant_id, items, total_price, status)
+                SELECT ?, restaurant_id, ?, 0, 'received' FROM restaurants WHERE restaurant_id = ?
+                RETURNING order_id
+            """, (user_id, json.dumps(items), restaurant_id))
+            row = cursor.fetchone()
+            if not row:
+                return None
+            order_id = row['order_id']
+            publish_order_event(order_id, RECEIVED, user_id=user_id)
+            # Workers must not see the order before it is committed
+            on_commit(lambda: intake.enqueue(order_id))
+            return order_id
+
+        try:
+            return submit_write(write)
+        except sqlite3.Error as e:
+            raise sqlite3.Error(f"Database error: {str(e)}")
+
+    @staticmethod
+    def process(order_id: int) -> dict:
+        """
+        Validate a received order, then accept and dispatch it or reject it.
+
+        The nearest rider is reserved first; accepting the order, writing its
+        order_items, assigning the rider and the user's notification then
+        commit together as one write. An order that was cancelled
+        or already processed in the meantime is left alone.
+
+        Args:
+            order_id (int): Received order's ID
+
+        Returns:
+            dict: order_id and the new status (plus rejection_reason, or the
+                rider assignment as from OrderService.assign_reserved_rider),
+                or None if the order was no longer 'received'
+
+        Raises:
+            sqlite3.Error: If database operation fails
+        """
+        with db_cursor() as cursor:
+            cursor.execute("""
+                SELECT o.order_id, o.user_id, o.restaurant_id, o.items, o.status, r.prep_time, r.lat, r.lon
+                FROM orders o
+                JOIN restaurants r ON o.restaurant_id = r.restaurant_id
+                WHERE o.order_id = ?
+            """, (order_id,))
+            order = cursor.fetchone()
+        if not order or order['status'] != RECEIVED:
+            return None
+
+        try:
+            line_items = OrderService.price_items(order['restaurant_id'], json.loads(order['items']))
+        except sqlite3.Error:
+            raise
+        except Exception as e:
+            # Whatever the stored cart makes pricing trip over, it will again
+            return IntakeService._reject(order, str(e))
+
+        # Find the rider before handing the write over, so a slow match holds
+        # up this worker only, not the writer thread every request waits on
+        rider = OrderService.reserve_rider(order['lat'], order['lon'])
+
+        def write(cursor):
+            if order['user_id'] is not None:
+                cursor.execute("SELECT user_id FROM users WHERE user_id = ?", (order['user_id'],))
+                if not cursor.fetchone():
+                    OrderService.release_rider(rider)
+                    return IntakeService._reject_in(cursor, order, "User not found")
+            cursor.execute("""
+                UPDATE orders SET status = 'pending', total_price = ?
+                WHERE order_id = ? AND status = 'received'
+            """, (sum(line['unit_price'] * line['quantity'] for line in line_items), order_id))
+            if cursor.rowcount == 0:
+                OrderService.release_rider(rider)
+                return None
+            cursor.executemany("""
+                INSERT INTO order_items (order_id, menu_id, item_name, quantity, unit_price)
+                VALUES (?, ?, ?, ?, ?)
+            """, [(order_id, line['menu_id'], line['item_name'], line['quantity'], line['unit_price'])
+                  for line in line_items])
+            result = OrderService.assign_reserved_rider(cursor, order_id, order['prep_time'], rider,
+                                                        order['user_id'])
+            if order['user_id'] is not None:
+                cursor.execute(
+                    "INSERT INTO notifications (user_id, order_id, message) VALUES (?, ?, ?)",
+                    (order['user_id'], order_id, f"Order {order_id} accepted")
+                )
+            touch('order', order_id)
+            return result
+
+        try:
+            return submit_write(write)
+        except sqlite3.Error as e:
+            # Rolled back: the order is still received, so free the rider again
+            OrderService.release_rider(rider)
+            raise sqlite3.Error(f"Database error: {str(e)}")
+        except Exception:
+            OrderService.release_rider(rider)
+            raise
+
+    @staticmethod
+    def record_failure(order_id: int, give_up_attempts: int = INTAKE_GIVE_UP_ATTEMPTS) -> dict:
+        """
+        Count a failed attempt to process a received order, and reject the
+        order once give_up_attempts have failed.
+
+        Args:
+            order_id (int): Received order's ID
+            give_up_attempts (int): Failed attempts after which the order is rejected
+
+        Returns:
+            dict: order_id, status 'rejected' and rejection_reason if the order
+                was given up on, else None
+
+        Raises:
+            sqlite3.Error: If database operation fails
+        """
+        def write(cursor):
+            cursor.execute("""
+                UPDATE orders SET intake_attempts = intake_attempts + 1
+                WHERE order_id = ? AND status = 'received'
+                RETURNING order_id, user_id, intake_attempts
+            """, (order_id,))
+            order = cursor.fetchone()
+            if not order or order['intake_attempts'] < give_up_attempts:
+                return None
+            return IntakeService._reject_in(cursor, order, "Order could not be processed")
+
+        try:
+            return submit_write(write)
+        except sqlite3.Error as e:
+            raise sqlite3.Error(f"Database error: {str(e)}")
+
+    @staticmethod
+    def _reject(order, reason: str) -> dict:
+        try:
+            return submit_write(IntakeService._reject_in, order, reason)
+        except sqlite3.Error as e:
+            raise sqlite3.Error(f"Database error: {str(e)}")
+
+    @staticmethod
+    def _reject_in(cursor, order, reason: str) -> dict:
+        cursor.execute("""
+            UPDATE orders SET status = 'rejected', rejection_reason = ?
+            WHERE order_id = ? AND status = 'received'
+        """, (reason, order['order_id']))
+        if cursor.rowcount == 0:
+            return None
+        publish_order_event(order['order_id'], REJECTED, user_id=order['user_id'], rejection_reason=reason)
+        touch('order', order['order_id'])
+        return {'order_id': order['order_id'], 'status': REJECTED, 'rejection_reason': reason}
+
+
+class IntakeWorkers:
+    """Worker threads running IntakeService.process on queued orders, plus the sweep."""
+
+    def __init__(self, workers: int = ORDER_INTAKE_WORKERS, queue_size: int = INTAKE_QUEUE_SIZE,
+                 max_attempts: int = INTAKE_MAX_ATTEMPTS, retry_seconds: float = INTAKE_RETRY_SECONDS,
+                 sweep_seconds: float = INTAKE_SWEEP_SECONDS, give_up_attempts: int = INTAKE_GIVE_UP_ATTEMPTS):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.give_up_attempts = give_up_attempts
+        self.retry_seconds = retry_seconds
+        self.sweep_seconds = sweep_seconds
+        self._queue = queue.Queue(queue_size)
+        self._lock = threading.Lock()
+        # Orders queued, waiting for a retry or being processed
+        self._queued = set()
+        self._stop = threading.Event()
+        self._threads = []
+        self._counts = {"accepted": 0, "rejected": 0, "skipped": 0, "retried": 0, "failed": 0, "given_up": 0, "swept": 0}
+
+    def start(self):
+        if self._threads:
+            return
+        self._stop.clear()
+        self._threads = [threading.Thread(target=self._work, name=f'intake-{n}', daemon=True)
+                         for n in range(self.workers)]
+        self._threads.append(threading.Thread(target=self._sweep, name='intake-sweep', daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stop.set()
+        for _ in range(self.workers):
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def full(self) -> bool:
+        """True if new orders should be refused until the workers catch up."""
+        return self._queue.full()
+
+    def enqueue(self, order_id: int, attempt: int = 1) -> bool:
+        """
+        Queue an order for processing.
+
+        Returns:
+            bool: False if the queue is full; the sweep queues the order later
+        """
+        with self._lock:
+            if attempt == 1 and order_id in self._queued:
+                return True
+            try:
+                self._queue.put_nowait((order_id, attempt))
+            except queue.Full:
+                self._queued.discard(order_id)
+                return False
+            self._queued.add(order_id)
+            return True
+
+    def _work(self):
+        while True:
+            entry = self._queue.get()
+            if entry is None or self._stop.is_set():
+                return
+            order_id, attempt = entry
+            try:
+                result = IntakeService.process(order_id)
+            except Exception:
+                try:
+                    given_up = IntakeService.record_failure(order_id, self.give_up_attempts)
+                except Exception:
+                    logger.exception("Could not record the failed intake of order %s", order_id)
+                    given_up = None
+                if given_up is not None:
+                    logger.exception("Intake of order %s failed %s times; rejected", order_id,
+                                     self.give_up_attempts)
+                    self._count('given_up')
+                elif attempt < self.max_attempts:
+                    logger.warning("Intake of order %s failed, retrying (attempt %s)", order_id, attempt,
+                                   exc_info=True)
+                    self._count('retried')
+                    delay = self.retry_seconds * 2 ** (attempt - 1)
+                    timer = threading.Timer(delay, self.enqueue, (order_id, attempt + 1))
+                    timer.daemon = True
+                    timer.start()
+                    continue
+                else:
+                    logger.exception("Intake of order %s failed; left for the next sweep", order_id)
+                    self._count('failed')
+            else:
+                if result is None:
+                    self._count('skipped')
+                else:
+                    self._count('rejected' if result['status'] == REJECTED else 'accepted')
+            with self._lock:
+                self._queued.discard(order_id)
+
+    def _sweep(self):
+        # The first sweep picks up what an earlier process left received
+        while True:
+            try:
+                with db_cursor() as cursor:
+                    cursor.execute("SELECT order_id FROM orders WHERE status = 'received' ORDER BY order_id")
+                    order_ids = [row['order_id'] for row in cursor.fetchall()]
+                with self._lock:
+                    order_ids = [order_id for order_id in order_ids if order_id not in self._queued]
+                for order_id in order_ids:
+                    if not self.enqueue(order_id):
+                        break
+                    self._count('swept')
+            except Exception:
+                logger.exception("Intake sweep failed")
+            if self._stop.wait(self.sweep_seconds):
+                return
+
+    def _count(self, key: str):
+        with self._lock:
+            self._counts[key] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._counts, running=bool(self._threads), workers=self.workers,
+                        queued=self._queue.qsize(), in_flight=len(self._queued))
+
+
+intake = IntakeWorkers()
@@ -1,6 +1,9 @@
-from db import db_cursor
 from datetime import datetime, time
-from utils import calculate_distance, estimate_delivery_time
+import numpy as np
+
+from geo import geocode, haversine_km
+from travel import get_model
+from models import open_hours, rider_registry, suggestions
 from models.restaurant import Restaurant
 from models.rider import Rider
 
@@ -12,6 +15,9 @@ class MatchingService:
     DINNER_START = time(16, 0)
     DINNER_END = time(23, 0)
 
+    # A rider carries at most this many assigned or in-progress orders
+    MAX_ACTIVE_ORDERS = rider_registry.MAX_ACTIVE_ORDERS
+
     def get_current_meal_period():
         current_time = datetime.now().time()
 
@@ -25,70 +31,99 @@ class MatchingService:
 
     @staticmethod
     def calculate_distance(point1, point2):
-        # Simple distance calculation - in production use proper geocoding
-        return abs(hash(point1) - hash(point2)) % 10
+        """
+        Distance in kilometres between two points.
+
+        Points are (lat, lon) pairs or address strings, which are geocoded.
+        """
+        lat1, lon1 = geocode(point1) if isinstance(point1, str) else point1
+        lat2, lon2 = geocode(point2) if isinstance(point2, str) else point2
+        return haversine_km(lat1, lon1, lat2, lon2)
 
     """Service to handle restaurant suggestions and rider assignment."""
 
     @staticmethod
-    def suggest_restaurants(user_location: str, food_type: str, max_delivery_time: int) -> list:
+    def suggest_restaurants(user_location, food_type, max_delivery_time: int, limit: int = None,
+                            after: tuple = None, open_now: bool = False) -> list:
         """
-        Suggest restaurants based on food type and delivery time.
+        Suggest restaurants based on food type and delivery time, fastest first.
+
+        Served by the precomputed per-cuisine candidate lists in
+        models.suggestions, so the cost grows with the number of results
+        rather than with the number of restaurants of the cuisine.
 
         Args:
-            user_location (str): User's location (e.g., 'Downtown')
-            food_type (str): Desired food type (e.g., 'Italian')
+            user_location (str or tuple): User's address, or (lat, lon)
+            food_type (str or list): Desired food type (e.g., 'Italian'), a
+                list of them, or None for every cuisine
             max_delivery_time (int): Maximum delivery time in minutes
+            limit (int, optional): Maximum number of restaurants to return
+            after (tuple, optional): (estimated_delivery_time, restaurant_id)
+                of the last restaurant of the previous page
+            open_now (bool): Only restaurants open now, and serving the
+                current meal if there is one
 
         Returns:
-            list: List of restaurant dictionaries with estimated delivery time
+            list: List of restaurant dictionaries with estimated delivery time,
+                ordered by (estimated_delivery_time, restaurant_id)
         """
-        if not user_location or not food_type or max_delivery_time <= 0:
-            raise ValueError("User location, food type, and valid delivery time are required")
-
-        suggestions = []
-        with db_cursor() as cursor:
-            cursor.execute(
-                "SELECT restaurant_id, name, location, food_type, prep_time FROM restaurants WHERE food_type = ?",
-                (food_type,)
-            )
-            restaurants = cursor.fetchall()
-
-            for restaurant in restaurants:
-                delivery_time = estimate_delivery_time(restaurant['location'], user_location, restaurant['prep_time'])
-                if delivery_time <= max_delivery_time:
-                    suggestions.append({
-                        "restaurant_id": restaurant['restaurant_id'],
-                        "name": restaurant['name'],
-                        "location": restaurant['location'],
-                        "food_type": restaurant['food_type'],
-                        "estimated_delivery_time": delivery_time
-                    })
-
-        # Sort by estimated delivery time
-        return sorted(suggestions, key=lambda x: x['estimated_delivery_time'])
+        if not user_location or max_delivery_time <= 0:
+            raise ValueError("User location and a valid delivery time are required")
+        user_lat, user_lon = geocode(user_location) if isinstance(user_location, str) else user_location
+        food_types = [food_type] if isinstance(food_type, str) else food_type
+
+        is_open = None
+        if open_now:
+            now = datetime.now()
+            bits = open_hours.get_index().open_at(now.hour * 60 + now.minute,
+                                                  MatchingService.get_current_meal_period())
+            is_open = lambda restaurant_id: open_hours.is_member(bits, restaurant_id)
+
+        return suggestions.get_index().suggest(user_lat, user_lon, food_types, max_delivery_time,
+                                               limit, after, is_open)
+
+
+    @staticmethod
+    def find_nearest_rider(lat, lon):
+        """
+        Find the closest available rider with spare capacity, without reserving it.
+
+        Args:
+            lat (float): Pickup latitude
+            lon (float): Pickup longitude
 
+        Returns:
+            dict: The rider's registry snapshot plus distance_km, or None
+        """
+        return rider_registry.get_registry().nearest(lat, lon)
 
     @staticmethod
-    def find_nearest_rider(restaurant_location):
-        with db_cursor() as cursor:
-            cursor.execute("""
-                SELECT r.*,
-                    (SELECT COUNT(*) FROM orders
-                     WHERE rider_id = r.rider_id
-                     AND status = 'in_progress') as active_orders
-                FROM riders r
-                WHERE is_available = 1
-                HAVING active_orders < 3
-                ORDER BY ABS(CAST(REPLACE(r.location, ' ', '') AS INTEGER) -
-                           CAST(REPLACE(?, ' ', '') AS INTEGER))
-                LIMIT 1
-            """, (restaurant_location,))
-            return cursor.fetchone()
+    def reserve_nearest_rider(lat, lon):
+        """
+        Reserve a slot on the closest available rider with spare capacity.
+
+        The slot is taken atomically in the rider registry, so concurrent
+        orders never both get a rider's last slot. Call it before submitting
+        the write that assigns the rider, so the search does not hold up the
+        writer thread. If the assignment does not happen, e.g. the write
+        fails, give the slot back with rider_registry.registry.release().
+
+        Args:
+            lat (float): Pickup latitude
+            lon (float): Pickup longitude
+
+        Returns:
+            dict: The rider's registry snapshot plus distance_km, or None
+        """
+        return rider_registry.get_registry().reserve_nearest(lat, lon)
 
     @staticmethod
     def calculate_delivery_time(restaurant_location, rider_location):
-        # Simple mock distance calculation
-        distance = abs(int(''.join(filter(str.isdigit, restaurant_location))) -
-                      int(''.join(filter(str.isdigit, rider_location))))
-        return max(5, min(30, distance // 100))
+        """
+        Minutes for a rider to reach a restaurant, at least 5.
+
+        Locations are (lat, lon) pairs or address strings, which are geocoded.
+        """
+        lat1, lon1 = geocode(restaurant_location) if isinstance(restaurant_location, str) else restaurant_location
+        lat2, lon2 = geocode(rider_location) if isinstance(rider_location, str) else rider_location
+        return max(5, int(np.ceil(get_model().travel_minutes(lat2, lon2, lat1, lon1))))
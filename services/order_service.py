@@ -1,67 +1,277 @@
-from db import db_cursor
+from collections import Counter
+import json
+import sqlite3
+from db import db_cursor, submit_write
 from models.user import User
 from models.restaurant import Restaurant
+from models import rider_registry
 from models.order import Order
+from models.order_status import ASSIGNED, PENDING
+from event_bus import publish_order_event
+from services.dispatch_service import DispatchService, batch_dispatch_enabled
 from services.matching_service import MatchingService
 
 class OrderService:
     """Service to handle order placement and related operations."""
-    
+
+    @staticmethod
+    def price_items(restaurant_id: int, items: list) -> list:
+        """
+        Turn client-supplied cart items into order lines priced from the menu.
+
+        Items are matched to the restaurant's menu by menu_id, else by name,
+        with one query, and always take the menu price; any price the client
+        sends is ignored.
+
+        Args:
+            restaurant_id (int): Restaurant's ID
+            items (list): Dicts with menu_id or name/item_name, optional
+                quantity and price
+
+        Returns:
+            list: Line dicts with menu_id, item_name, quantity and unit_price
+
+        Raises:
+            ValueError: If the items are not a list of objects, an item is
+                not on the menu, a quantity is not a positive whole number,
+                or the order would not cost anything
+        """
+        if isinstance(restaurant_id, bool) or not isinstance(restaurant_id, (int, str)):
+            raise ValueError("restaurant_id must be an integer")
+        restaurant_id = int(restaurant_id)
+        by_id, by_name = OrderService._menu_rows([(restaurant_id, items)])
+        return OrderService._price_lines(restaurant_id, items, by_id, by_name)
+
     @staticmethod
+    def _menu_rows(carts) -> tuple:
+        """
+        Load, with one query, the menu rows that any of several carts may refer to.
+
+        Args:
+            carts (iterable): (restaurant_id, items) pairs
+
+        Returns:
+            tuple: (rows by menu_id, rows by (restaurant_id, item_name))
+        """
+        restaurant_ids, ids, names = set(), set(), set()
+        for restaurant_id, items in carts:
+            restaurant_ids.add(restaurant_id)
+            for item in items if isinstance(items, list) else ():
+                if not isinstance(item, dict):
+                    continue
+                if isinstance(item.get('menu_id'), int):
+                    ids.add(item['menu_id'])
+                if isinstance(item.get('name') or item.get('item_name'), str):
+                    names.add(item.get('name') or item.get('item_name'))
+        with db_cursor() as cursor:
+            # Each set travels as one JSON parameter, however large the batch
+            cursor.execute(
+                """
+                SELECT menu_id, restaurant_id, item_name, price FROM menus
+                WHERE restaurant_id IN (SELECT value FROM json_each(?))
+                AND (menu_id IN (SELECT value FROM json_each(?))
+                     OR item_name IN (SELECT value FROM json_each(?)))
+                """,
+                (json.dumps(list(restaurant_ids)), json.dumps(list(ids)), json.dumps(list(names)))
+            )
+            menu = cursor.fetchall()
+        return ({row['menu_id']: row for row in menu},
+                {(row['restaurant_id'], row['item_name']): row for row in menu})
+
+    @staticmethod
+    def _price_lines(restaurant_id: int, items: list, by_id: dict, by_name: dict) -> list:
+        """Price one cart from rows loaded by _menu_rows; see price_items."""
+        if not isinstance(items, list):
+            raise ValueError("items must be a list of objects")
+        if not items:
+            raise ValueError("At least one item must be selected")
+
+        line_items = []
+        for item in items:
+            if not isinstance(item, dict):
+                raise ValueError("items must be a list of objects")
+            name = item.get('name') or item.get('item_name')
+            row = by_id.get(item['menu_id']) if isinstance(item.get('menu_id'), int) else None
+            if row is None or row['restaurant_id'] != restaurant_id:
+                row = by_name.get((restaurant_id, name))
+            quantity = OrderService._quantity(item.get('quantity', 1))
+            if quantity <= 0:
+                raise ValueError("Item quantity must be positive")
+            if not row:
+                raise ValueError(f"Item {name or item.get('menu_id')!r} is not on this restaurant's menu")
+            line_items.append({"menu_id": row['menu_id'], "item_name": row['item_name'],
+                               "quantity": quantity, "unit_price": row['price']})
+        if sum(line['unit_price'] * line['quantity'] for line in line_items) <= 0:
+            raise ValueError("Order total must be positive")
+        return line_items
+
+    @staticmethod
+    def _quantity(value) -> int:
+        """Read an item's quantity, given as an integer or a string of digits."""
+        # bool is an int subclass, but true is not a quantity
+        if isinstance(value, bool) or not isinstance(value, (int, str)):
+            raise ValueError("Item quantity must be a whole number")
+        try:
+            return int(value)
+        except ValueError:
+            raise ValueError("Item quantity must be a whole number")
+
+    @staticmethod
+    def reserve_rider(lat: float, lon: float) -> dict:
+        """
+        Reserve the nearest available rider to a restaurant, unless the batch
+        dispatcher will assign one in its next window.
+
+        Args:
+            lat (float): Restaurant's latitude
+            lon (float): Restaurant's longitude
+
+        Returns:
+            dict: The reserved rider, as from MatchingService.reserve_nearest_rider, or None
+        """
+        if batch_dispatch_enabled():
+            return None
+        return MatchingService.reserve_nearest_rider(lat, lon)
+
+    @staticmethod
+    def release_rider(rider: dict):
+        """Give back a rider reserved with reserve_rider whose order write did not happen."""
+        if rider:
+            rider_registry.registry.release(rider['rider_id'])
+
+    @staticmethod
+    def assign_reserved_rider(cursor, order_id: int, prep_time: int, rider: dict, user_id: int = None) -> dict:
+        """
+        Assign a pending order to a rider reserved with reserve_rider.
+
+        Reserve the rider before submitting the write that places the order,
+        so a slow match never holds up the writer thread. The assignment re-checks the rider's load in SQL, so a rider another
+        worker filled up is never overbooked; the order then stays pending
+        and the reservation is given back. The order's status event is
+        published once the write commits.
+
+        Args:
+            cursor (sqlite3.Cursor): Cursor of the write placing the order
+            order_id (int): Pending order's ID
+            prep_time (int): Restaurant's preparation time in minutes
+            rider (dict): Reserved rider, or None to leave the order pending
+            user_id (int, optional): Ordering user, to reach their event stream
+
+        Returns:
+            dict: order_id and status, plus estimated_time and rider once assigned
+        """
+        if rider:
+            estimated_time = prep_time + 15  # Base delivery time
+
+            # Update order with rider and estimated time, unless another
+            # worker filled the rider up in the meantime
+            cursor.execute(f"""
+                UPDATE orders
+                SET rider_id = ?,
+                    estimated_delivery_time = ?,
+                    status = 'assigned'
+                WHERE order_id = ? AND {rider_registry.CAPACITY_GUARD}
+            """, (rider['rider_id'], estimated_time, order_id,
+                  rider['rider_id'], rider_registry.MAX_ACTIVE_ORDERS))
+            if cursor.rowcount == 0:
+                rider_registry.registry.release(rider['rider_id'])
+                rider_registry.registry.expire()
+                rider = None
+
+        if rider:
+            publish_order_event(order_id, ASSIGNED, user_id=user_id, rider_id=rider['rider_id'],
+                                estimated_delivery_time=estimated_time)
+            return {
+                'order_id': order_id,
+                'status': ASSIGNED,
+                'estimated_time': estimated_time,
+                'rider': {
+                    'name': rider['name'],
+                    'id': rider['rider_id']
+                }
+            }
+
+        publish_order_event(order_id, PENDING, user_id=user_id)
+        return {
+            'order_id': order_id,
+            'status': PENDING
+        }
+
     @staticmethod
     def place_order(user_id: int, restaurant_id: int, item_ids: list) -> dict:
         """
-    Place an order for a user from a restaurant with selected menu items.
-    
-    Args:
-        user_id (int): User's ID
-        restaurant_id (int): Restaurant's ID
-        item_ids (list): List of menu item IDs to order
-        
-    Returns:
-        dict: Order details including order_id, items, total_price, and status
-        
-    Raises:
-        ValueError: If user, restaurant, or items are invalid
-    """
+        Place an order for a user from a restaurant with selected menu items.
+
+        Args:
+            user_id (int): User's ID
+            restaurant_id (int): Restaurant's ID
+            item_ids (list): List of menu item IDs to order
+
+        Returns:
+            dict: Order details including order_id, items, total_price, and status
+
+        Raises:
+            ValueError: If user, restaurant, or items are invalid
+        """
         if not item_ids:
             raise ValueError("At least one item must be selected")
-        
-    # Validate user
+
+        # Validate user
         user = User.get_by_id(user_id)
         if not user:
             raise ValueError("User not found")
-        
-    # Validate restaurant
+
+        # Validate restaurant
         restaurant = Restaurant.get_by_id(restaurant_id)
         if not restaurant:
-           raise ValueError("Restaurant not found")
-        
-    # Fetch and validate menu items
+            raise ValueError("Restaurant not found")
+
+        # Fetch and validate menu items
+        placeholders = ','.join('?' for _ in set(item_ids))
         with db_cursor() as cursor:
-           placeholders = ','.join('?' for _ in item_ids)
-           cursor.execute(
-               f"SELECT menu_id, item_name, price FROM menus WHERE menu_id IN ({placeholders}) AND restaurant_id = ?",
-               item_ids + [restaurant_id]
-           )
-           menu_items = cursor.fetchall()
-
-           if len(menu_items) != len(item_ids):
-               raise ValueError("Some items are invalid or not available at this restaurant")
-
-           # Calculate total price and format items
-           total_price = sum(item['price'] for item in menu_items)
-           items_str = ','.join(item['item_name'] for item in menu_items)
-
-    #    Place order
-        order = Order.place_order(user_id, restaurant_id, items_str, total_price)
-    
-        # Assign rider
-        rider = MatchingService.find_nearest_rider(restaurant.location)
-        rider_status = "Pending"
-        if rider:
-           if Order.assign_rider(order.order_id, rider['rider_id']):
-               rider_status = "Assigned"
+            cursor.execute(
+                f"SELECT menu_id, item_name, price FROM menus WHERE menu_id IN ({placeholders}) AND restaurant_id = ?",
+                list(set(item_ids)) + [restaurant_id]
+            )
+            menu_items = cursor.fetchall()
+
+        quantities = Counter(item_ids)
+        if len(menu_items) != len(quantities):
+            raise ValueError("Some items are invalid or not available at this restaurant")
+
+        # Calculate total price and format items; repeated IDs become quantities
+        line_items = [{
+            "menu_id": item['menu_id'],
+            "item_name": item['item_name'],
+            "quantity": quantities[item['menu_id']],
+            "unit_price": item['price']
+        } for item in menu_items]
+        total_price = sum(line['unit_price'] * line['quantity'] for line in line_items)
+        items_str = ','.join(item['item_name'] for item in menu_items)
+
+        # Find the rider first; with batch dispatch the order stays pending
+        # until the dispatcher's next window
+        rider = OrderService.reserve_rider(restaurant.lat, restaurant.lon)
+
+        # The order, its order_items rows and the rider assignment commit (or
+        # roll back) together, as one operation of the writer thread
+        def write(cursor):
+            order = Order.place_order(user_id, restaurant_id, items_str, total_price, line_items)
+            if rider:
+                if Order.assign_rider(order.order_id, rider['rider_id']):
+                    order.status = ASSIGNED
+                else:
+                    # Another worker filled the rider up since the registry was loaded
+                    rider_registry.registry.release(rider['rider_id'])
+                    rider_registry.registry.expire()
+            return order
+
+        try:
+            order = submit_write(write)
+        except Exception:
+            OrderService.release_rider(rider)
+            raise
+        rider_status = "Assigned" if order.status == ASSIGNED else "Pending"
 
         return {
             "order_id": order.order_id,
@@ -71,4 +281,111 @@ class OrderService:
             "total_price": total_price,
             "status": order.status,
             "rider_status": rider_status
-        }
\ No newline at end of file
+        }
+
+    @staticmethod
+    def place_orders(orders: list) -> list:
+        """
+        Place many orders at once, e.g. a partner's burst or a catering job.
+
+        Restaurants, users and the menu items of every order are validated
+        with one set-based query each. The valid orders are then inserted
+        with executemany as one write, and handed to dispatch as one group
+        once it has committed, so the plan is solved off the writer thread;
+        with batch dispatch enabled they stay pending for the dispatcher's
+        next window instead. An invalid order is rejected on its own without
+        affecting the others.
+
+        Args:
+            orders (list): Dicts with restaurant_id, items (as for
+                price_items) and optional user_id
+
+        Returns:
+            list: One result per order, in input order: index, order_id,
+                status ('assigned' or 'pending') and, once assigned, rider_id
+                and estimated_time; or index, status 'rejected' and error
+
+        Raises:
+            sqlite3.Error: If the orders cannot be inserted; none is placed
+        """
+        results = [None] * len(orders)
+        carts = []
+        for index, order in enumerate(orders):
+            try:
+                if not isinstance(order, dict):
+                    raise ValueError("Each order must be an object")
+                items = order.get('items')
+                if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+                    raise ValueError("items must be a list of objects")
+                user_id = int(order['user_id']) if order.get('user_id') is not None else None
+                carts.append((index, int(order['restaurant_id']), user_id, items))
+            except KeyError as e:
+                results[index] = {"index": index, "status": "rejected", "error": f"Missing {e.args[0]}"}
+            except (TypeError, ValueError) as e:
+                results[index] = {"index": index, "status": "rejected", "error": str(e)}
+
+        by_id, by_name = OrderService._menu_rows((restaurant_id, items) for _, restaurant_id, _, items in carts)
+        with db_cursor() as cursor:
+            cursor.execute("SELECT restaurant_id FROM restaurants WHERE restaurant_id IN (SELECT value FROM json_each(?))",
+                           (json.dumps(list({cart[1] for cart in carts})),))
+            restaurants = {row['restaurant_id'] for row in cursor.fetchall()}
+            cursor.execute("SELECT user_id FROM users WHERE user_id IN (SELECT value FROM json_each(?))",
+                           (json.dumps(list({cart[2] for cart in carts} - {None})),))
+            users = {row['user_id'] for row in cursor.fetchall()}
+
+        valid = []
+        for index, restaurant_id, user_id, items in carts:
+            try:
+                if restaurant_id not in restaurants:
+                    raise ValueError("Restaurant not found")
+                if user_id is not None and user_id not in users:
+                    raise ValueError("User not found")
+                line_items = OrderService._price_lines(restaurant_id, items, by_id, by_name)
+                valid.append((index, restaurant_id, user_id, items, line_items))
+            except (TypeError, ValueError) as e:
+                results[index] = {"index": index, "status": "rejected", "error": str(e)}
+        if not valid:
+            return results
+
+        def write(cursor):
+            cursor.executemany(
+                "INSERT INTO orders (user_id, restaurant_id, items, total_price, status) VALUES (?, ?, ?, ?, 'pending')",
+                [(user_id, restaurant_id, json.dumps(items),
+                  sum(line['unit_price'] * line['quantity'] for line in line_items))
+                 for _, restaurant_id, user_id, items, line_items in valid]
+            )
+            # orders uses AUTOINCREMENT and the writer holds the write lock,
+            # so the batch got consecutive IDs ending at the last one
+            cursor.execute("SELECT last_insert_rowid() AS last_id")
+            last_id = cursor.fetchone()['last_id']
+            order_ids = range(last_id - len(valid) + 1, last_id + 1)
+            cursor.executemany("""
+                INSERT INTO order_items (order_id, menu_id, item_name, quantity, unit_price)
+                VALUES (?, ?, ?, ?, ?)
+            """, [(order_id, line['menu_id'], line['item_name'], line['quantity'], line['unit_price'])
+                  for order_id, (*_, line_items) in zip(order_ids, valid) for line in line_items])
+            for order_id, (_, _, user_id, _, _) in zip(order_ids, valid):
+                publish_order_event(order_id, PENDING, user_id=user_id)
+            return order_ids
+
+        try:
+            order_ids = submit_write(write)
+        except sqlite3.Error as e:
+            raise sqlite3.Error(f"Database error: {str(e)}")
+
+        # Orders the plan cannot serve stay pending for the next window; so
+        # do all of them if dispatch fails, since they are already placed
+        assigned = {}
+        if not batch_dispatch_enabled():
+            try:
+                assigned = DispatchService.dispatch_orders(order_ids)
+            except sqlite3.Error:
+                pass
+        for order_id, (index, _, _, _, _) in zip(order_ids, valid):
+            if order_id in assigned:
+                rider_id, estimated_time = assigned[order_id]
+                results[index] = {"index": index, "order_id": order_id, "status": ASSIGNED,
+                                  "rider_id": rider_id, "estimated_time": estimated_time}
+            else:
+                results[index] = {"index": index, "order_id": order_id, "status": PENDING}
+        return results
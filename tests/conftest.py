@@ -0,0 +1,26 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# app.py migrates and loads its indexes at import; keep that away from the repo's database
+os.environ.setdefault('FOOD_DELIVERY_DB', os.path.join(tempfile.mkdtemp(), 'import.db'))
+
+
+@pytest.fixture
+def client(tmp_path):
+    """Test client of the app on a fresh database holding the sample data."""
+    import db
+    from app import app
+    from models import open_hours, rider_registry, suggestions
+
+    db.configure_pool(str(tmp_path / 'food_delivery.db'))
+    db.init_db()
+    db.populate_sample_data()
+    open_hours.refresh()
+    suggestions.refresh()
+    rider_registry.refresh()
+    return app.test_client()
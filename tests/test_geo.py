@@ -0,0 +1,27 @@
+import time
+
+from geo import CITY_CENTER, GridIndex
+
+
+def test_nearest_finds_k_closest():
+    index = GridIndex()
+    lat, lon = CITY_CENTER
+    index.rebuild([(n, lat + n * 0.01, lon) for n in range(10)])
+    assert [key for _, key in index.nearest(lat, lon, 3)] == [0, 1, 2]
+
+
+def test_nearest_with_far_outlier_and_too_few_points():
+    index = GridIndex()
+    lat, lon = CITY_CENTER
+    index.rebuild([(n, lat + n * 0.01, lon + n * 0.01) for n in range(5)] + [('outlier', 0.0, 0.0)])
+    started = time.perf_counter()
+    result = index.nearest(lat, lon, 8)
+    assert time.perf_counter() - started < 1
+    assert [key for _, key in result] == [0, 1, 2, 3, 4, 'outlier']
+
+
+def test_nearest_respects_max_km_with_outlier():
+    index = GridIndex()
+    lat, lon = CITY_CENTER
+    index.rebuild([(1, lat, lon), ('outlier', 0.0, 0.0)])
+    assert [key for _, key in index.nearest(lat, lon, 8, max_km=50)] == [1]
@@ -0,0 +1,40 @@
+import hashlib
+import json
+import time
+
+import db
+
+
+def _order_body():
+    with db.db_cursor() as cursor:
+        cursor.execute("SELECT restaurant_id, menu_id FROM menus ORDER BY menu_id LIMIT 1")
+        menu = cursor.fetchone()
+    return json.dumps({'restaurant_id': menu['restaurant_id'], 'items': [{'menu_id': menu['menu_id']}]})
+
+
+def _post(client, body, key):
+    return client.post('/api/orders', data=body, content_type='application/json', headers={'Idempotency-Key': key})
+
+
+def test_retry_replays_stored_response(client):
+    body = _order_body()
+    first = _post(client, body, 'retry-1')
+    second = _post(client, body, 'retry-1')
+    assert first.status_code == second.status_code == 200
+    assert second.headers['Idempotent-Replayed'] == 'true'
+    assert second.get_json()['order_id'] == first.get_json()['order_id']
+
+
+def test_stale_in_flight_claim_is_taken_over(client):
+    body = _order_body()
+    # A claim left behind by a request that died before storing its response
+    stale = time.time() - 60
+    db.submit_write(lambda cursor: cursor.execute(
+        "INSERT INTO idempotency_keys (key, fingerprint, created_at, claimed_at) VALUES (?, ?, ?, ?)",
+        ('POST /api/orders dead-1', hashlib.sha256(body.encode()).hexdigest()[:32], stale, stale)
+    ))
+    started = time.monotonic()
+    response = _post(client, body, 'dead-1')
+    assert response.status_code == 200
+    assert time.monotonic() - started < 5
+    assert _post(client, body, 'dead-1').get_json()['order_id'] == response.get_json()['order_id']
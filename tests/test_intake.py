@@ -0,0 +1,55 @@
+import time
+
+import db
+from services.intake_service import IntakeService, IntakeWorkers
+from services.order_service import OrderService
+
+
+def _received_order():
+    order_id = IntakeService.receive(1, [{'name': 'anything'}], 1)
+    assert order_id is not None
+    return order_id
+
+
+def _status(order_id):
+    with db.db_cursor() as cursor:
+        cursor.execute("SELECT status, rejection_reason, intake_attempts FROM orders WHERE order_id = ?",
+                       (order_id,))
+        return cursor.fetchone()
+
+
+def test_any_validation_error_rejects_the_order(client, monkeypatch):
+    def broken(restaurant_id, items):
+        raise KeyError('menu_id')
+    monkeypatch.setattr(OrderService, 'price_items', broken)
+    order_id = _received_order()
+
+    result = IntakeService.process(order_id)
+    assert result['status'] == 'rejected'
+    assert _status(order_id)['status'] == 'rejected'
+
+
+def test_poison_order_is_given_up_on(client, monkeypatch):
+    def broken(cursor, order_id, prep_time, rider, user_id=None):
+        raise RuntimeError("cannot assign")
+    monkeypatch.setattr(OrderService, 'price_items',
+                        lambda restaurant_id, items: [{'menu_id': 1, 'item_name': 'x', 'quantity': 1,
+                                                       'unit_price': 5.0}])
+    monkeypatch.setattr(OrderService, 'assign_reserved_rider', broken)
+    order_id = _received_order()
+
+    workers = IntakeWorkers(workers=1, max_attempts=2, retry_seconds=0.01, sweep_seconds=0.05,
+                            give_up_attempts=4)
+    workers.start()
+    try:
+        deadline = time.monotonic() + 5
+        while _status(order_id)['status'] == 'received' and time.monotonic() < deadline:
+            time.sleep(0.02)
+    finally:
+        workers.stop()
+
+    order = _status(order_id)
+    assert order['status'] == 'rejected'
+    assert order['rejection_reason'] == "Order could not be processed"
+    assert order['intake_attempts'] == 4
+    assert workers.stats()['given_up'] == 1
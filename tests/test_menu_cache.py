@@ -0,0 +1,28 @@
+import db
+from cache import version_key
+
+
+def _add_item_from_another_process(restaurant_id, item_name):
+    """Write a menu item the way another worker would: only data_versions changes, not this process's counters."""
+    def write(cursor):
+        cursor.execute("INSERT INTO menus (restaurant_id, item_name, price) VALUES (?, ?, 9.5)",
+                       (restaurant_id, item_name))
+        cursor.execute("""
+            INSERT INTO data_versions (key, version) VALUES (?, 1)
+            ON CONFLICT (key) DO UPDATE SET version = version + 1
+        """, (version_key(('menu', restaurant_id)),))
+    db.submit_write(write)
+
+
+def test_menu_etag_and_body_follow_other_workers_writes(client):
+    first = client.get('/api/restaurant/1/menu')
+    assert first.status_code == 200
+
+    _add_item_from_another_process(1, 'Other Worker Special')
+    second = client.get('/api/restaurant/1/menu', headers={'If-None-Match': first.headers['ETag']})
+    assert second.status_code == 200
+    assert second.headers['ETag'] != first.headers['ETag']
+    assert 'Other Worker Special' in [item['item_name'] for item in second.get_json()]
+
+    page = client.get('/menu/1')
+    assert 'Other Worker Special' in [item['item_name'] for item in page.get_json()['menu']]
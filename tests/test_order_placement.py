@@ -0,0 +1,40 @@
+import pytest
+
+import db
+
+
+def _menu_id(restaurant_id=1):
+    with db.db_cursor() as cursor:
+        cursor.execute("SELECT menu_id FROM menus WHERE restaurant_id = ? LIMIT 1", (restaurant_id,))
+        return cursor.fetchone()['menu_id']
+
+
+@pytest.mark.parametrize('items', [
+    [{'menu_id': 0, 'quantity': None}],
+    [{'menu_id': 0, 'quantity': [2]}],
+    [{'menu_id': 0, 'quantity': {'n': 2}}],
+    [{'menu_id': 0, 'quantity': True}],
+    [{'menu_id': 0, 'quantity': 'two'}],
+    ['not an item'],
+    'not a list',
+])
+def test_malformed_items_are_rejected(client, items):
+    menu_id = _menu_id()
+    if isinstance(items, list) and isinstance(items[0], dict):
+        items = [dict(items[0], menu_id=menu_id)]
+    response = client.post('/api/orders', json={'restaurant_id': 1, 'items': items})
+    assert response.status_code == 400
+
+
+def test_unknown_restaurant_is_not_found(client):
+    response = client.post('/api/orders', json={'restaurant_id': 999999, 'items': [{'name': 'Pizza'}]})
+    assert response.status_code == 404
+    assert response.get_json()['error'] == 'Restaurant not found'
+
+
+def test_valid_order_is_placed(client):
+    response = client.post('/api/orders', json={'restaurant_id': 1,
+                                                'items': [{'menu_id': _menu_id(), 'quantity': '2'}]})
+    assert response.status_code == 200
+    order = client.get(f"/api/orders/{response.get_json()['order_id']}").get_json()
+    assert order['total_price'] > 0
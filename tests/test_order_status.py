@@ -0,0 +1,33 @@
+import db
+
+
+def _pending_order():
+    def write(cursor):
+        cursor.execute("""
+            INSERT INTO orders (user_id, restaurant_id, items, total_price, status)
+            VALUES (1, 1, '[]', 10.0, 'pending') RETURNING order_id
+        """)
+        return cursor.fetchone()['order_id']
+    return db.submit_write(write)
+
+
+def test_status_change_cannot_assign_without_rider(client):
+    order_id = _pending_order()
+    response = client.put(f'/api/orders/{order_id}/status', json={'status': 'assigned'})
+    assert response.status_code == 409
+    order = client.get(f'/api/orders/{order_id}').get_json()
+    assert order['status'] == 'pending'
+    assert order['rider_id'] is None
+
+
+def test_assigned_order_moves_along_lifecycle(client):
+    order_id = _pending_order()
+    with db.db_cursor() as cursor:
+        cursor.execute("SELECT rider_id FROM riders ORDER BY rider_id LIMIT 1")
+        rider_id = cursor.fetchone()['rider_id']
+    response = client.post('/api/orders/assign_rider',
+                           json={'order_id': order_id, 'rider_id': rider_id, 'estimated_time': 20})
+    assert response.status_code == 200
+    assert client.put(f'/api/orders/{order_id}/status', json={'status': 'picked_up'}).status_code == 200
+    assert client.put(f'/api/orders/{order_id}/status', json={'status': 'delivered'}).status_code == 200
+    assert client.get(f'/api/orders/{order_id}').get_json()['status'] == 'delivered'
@@ -0,0 +1,13 @@
+from models import open_hours
+
+
+def test_hours_update_reaches_open_hours_index(client):
+    response = client.put('/api/restaurant/1/hours', json={'opening_time': '03:00', 'closing_time': '04:00'})
+    assert response.status_code == 200
+    assert open_hours.is_member(open_hours.index.open_at(3 * 60 + 30), 1)
+    assert not open_hours.is_member(open_hours.index.open_at(12 * 60), 1)
+
+
+def test_hours_update_of_unknown_restaurant(client):
+    response = client.put('/api/restaurant/999999/hours', json={'opening_time': '03:00', 'closing_time': '04:00'})
+    assert response.status_code == 404
@@ -0,0 +1,122 @@
+"""
+Zone-based travel-time model.
+
+The service area is cut into square zones. Neighbouring zones (including
+diagonals) are joined by edges weighted with the time it takes to ride
+between their centres, slower towards the congested city centre. All-pairs
+shortest travel times are precomputed once with a vectorized Floyd-Warshall
+into a float32 matrix, so an ETA is a matrix lookup and the ETAs from many
+restaurants to one user are a single fancy-indexing operation.
+"""
+from math import ceil, cos, radians
+import threading
+
+import numpy as np
+
+from geo import CITY_CENTER, CITY_SPAN_KM, KM_PER_DEG_LAT, KM_PER_DEG_LON_EQUATOR
+
+ZONE_KM = 1.0
+# Riding speed at the edge of the service area and in the centre
+OUTER_SPEED_KMH = 28.0
+CENTER_SPEED_KMH = 14.0
+
+
+class TravelModel:
+    """Precomputed zone-to-zone travel minutes; see the module docstring."""
+
+    def __init__(self, zone_km: float = ZONE_KM, span_km: float = CITY_SPAN_KM, center: tuple = CITY_CENTER):
+        """
+        Args:
+            zone_km (float): Side of a zone in kilometres
+            span_km (float): Side of the square service area in kilometres
+            center (tuple): (lat, lon) of the centre of the service area
+        """
+        self.zone_km = zone_km
+        self.side = max(1, ceil(span_km / zone_km))
+        self._km_per_deg_lon = KM_PER_DEG_LON_EQUATOR * cos(radians(center[0]))
+        half = self.side * zone_km / 2
+        self._origin_lat = center[0] - half / KM_PER_DEG_LAT
+        self._origin_lon = center[1] - half / self._km_per_deg_lon
+        self.minutes = self._all_pairs()
+
+    def _speeds(self) -> np.ndarray:
+        """Riding speed in each zone, km/h, falling linearly towards the centre."""
+        idx = np.arange(self.side) + 0.5 - self.side / 2
+        radius = np.hypot(idx[:, None], idx[None, :])
+        share = radius / radius.max() if radius.max() > 0 else radius
+        return (CENTER_SPEED_KMH + (OUTER_SPEED_KMH - CENTER_SPEED_KMH) * share).ravel()
+
+    def _all_pairs(self) -> np.ndarray:
+        n = self.side * self.side
+        speeds = self._speeds()
+        minutes = np.full((n, n), np.inf, dtype=np.float64)
+        # Getting anywhere inside a zone takes about half a crossing
+        np.fill_diagonal(minutes, self.zone_km / 2 / speeds * 60)
+
+        rows, cols = np.divmod(np.arange(n), self.side)
+        for dr, dc in ((0, 1), (1, 0), (1, 1), (1, -1)):
+            r2, c2 = rows + dr, cols + dc
+            ok = (r2 >= 0) & (r2 < self.side) & (c2 >= 0) & (c2 < self.side)
+            a = np.nonzero(ok)[0]
+            b = r2[ok] * self.side + c2[ok]
+            km = self.zone_km * (2 ** 0.5 if dr and dc else 1.0)
+            # Half of the ride is in each zone, at that zone's speed
+            edge = (km / 2 / speeds[a] + km / 2 / speeds[b]) * 60
+            minutes[a, b] = edge
+            minutes[b, a] = edge
+
+        for k in range(n):
+            np.minimum(minutes, minutes[:, k:k + 1] + minutes[k:k + 1, :], out=minutes)
+        return minutes.astype(np.float32)
+
+    def zones(self, lat, lon) -> np.ndarray:
+        """
+        Zone index of each point; points outside the service area fall into
+        the nearest border zone.
+
+        Args:
+            lat (float or array): Latitudes
+            lon (float or array): Longitudes
+        """
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        row = np.floor((lat - self._origin_lat) * KM_PER_DEG_LAT / self.zone_km)
+        col = np.floor((lon - self._origin_lon) * self._km_per_deg_lon / self.zone_km)
+        row = np.clip(row, 0, self.side - 1).astype(np.intp)
+        col = np.clip(col, 0, self.side - 1).astype(np.intp)
+        return row * self.side + col
+
+    def travel_minutes(self, from_lat, from_lon, to_lat, to_lon) -> np.ndarray:
+        """Travel minutes between points; arguments broadcast like NumPy arrays."""
+        return self.minutes[self.zones(from_lat, from_lon), self.zones(to_lat, to_lon)]
+
+    def etas(self, lat, lon, prep_times, to_lat: float, to_lon: float) -> np.ndarray:
+        """
+        Delivery ETAs in minutes from many restaurants to one destination.
+
+        Args:
+            lat (array): Restaurant latitudes
+            lon (array): Restaurant longitudes
+            prep_times (array): Restaurant preparation times in minutes
+            to_lat (float): Destination latitude
+            to_lon (float): Destination longitude
+
+        Returns:
+            np.ndarray: prep time plus travel time, one entry per restaurant
+        """
+        destination = self.zones(to_lat, to_lon)
+        return np.asarray(prep_times, dtype=np.float32) + self.minutes[self.zones(lat, lon), destination]
+
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_model() -> TravelModel:
+    """Return the process-wide travel model, building it on first use."""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = TravelModel()
+    return _model
@@ -1,14 +1,22 @@
+import base64
+import json
+import math
 from datetime import datetime
 
+from geo import geocode, haversine_km
+from travel import get_model
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
 def calculate_distance(loc1: str, loc2: str) -> float:
-    """Dummy function to calculate distance between two locations"""
-    # Simplified: Treat different location strings as 5 units apart
-    return 0 if loc1 == loc2 else 5
+    """Distance in kilometres between two geocoded addresses"""
+    return haversine_km(*geocode(loc1), *geocode(loc2))
 
 def estimate_delivery_time(restaurant_location: str, user_location: str, prep_time: int) -> int:
-    """Estimate delivery time as sum of travel time and prep time"""
-    travel_time = calculate_distance(restaurant_location, user_location) * 2  # 2 mins per unit distance
-    return prep_time + travel_time
+    """Estimate delivery time as sum of travel time (from the zone travel-time model) and prep time"""
+    travel_time = get_model().travel_minutes(*geocode(restaurant_location), *geocode(user_location))
+    return prep_time + int(math.ceil(travel_time))
 
 def format_order_details(order):
     """
@@ -39,3 +47,75 @@ def format_order_details(order):
             else str(order.get("order_time"))
         )
     }
+
+
+def encode_cursor(*values) -> str:
+    """Encode the sort key of the last row on a page as an opaque, URL-safe token."""
+    raw = json.dumps(list(values), separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token: str, size: int) -> list:
+    """
+    Decode a token produced by encode_cursor.
+
+    Args:
+        token (str): Cursor token from a previous page
+        size (int): Expected number of key values
+
+    Returns:
+        list: The key values
+
+    Raises:
+        ValueError: If the token is malformed
+    """
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid pagination cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Invalid pagination cursor")
+    return values
+
+
+def parse_page_args(args, key_size: int = 1) -> tuple:
+    """
+    Read 'limit' and 'after' pagination parameters.
+
+    Args:
+        args (Mapping): Query string arguments or a JSON body
+        key_size (int): Number of values in the sort key
+
+    Returns:
+        tuple: (limit, after) where after is None or the decoded key values
+
+    Raises:
+        ValueError: If limit is not a positive integer or the cursor is malformed
+    """
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except (TypeError, ValueError):
+        raise ValueError("limit must be an integer")
+    if limit <= 0:
+        raise ValueError("limit must be positive")
+    after = args.get('after')
+    return min(limit, MAX_PAGE_SIZE), decode_cursor(after, key_size) if after else None
+
+
+def next_cursor(rows: list, limit: int, key) -> tuple:
+    """
+    Split a page fetched with LIMIT limit + 1 into the rows to return and the next cursor.
+
+    Args:
+        rows (list): Rows fetched, at most limit + 1
+        limit (int): Page size
+        key (callable): Returns the sort key values (as a tuple) of a row
+
+    Returns:
+        tuple: (page_rows, cursor) where cursor is None on the last page
+    """
+    if len(rows) <= limit:
+        return rows, None
+    page = rows[:limit]
+    return page, encode_cursor(*key(page[-1]))